@@ -0,0 +1,105 @@
+## Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+## Licensed under the Amazon Software License  https://aws.amazon.com/asl/
+"""Microbenchmark of the bounding box renderer of draw_bboxes_invoices on a synthetic invoice.
+
+The explainability info has the header fields of invoices_blueprint.json and --line-items rows in
+SERVICES_TABLE. The renderer is compared with a per-call implementation that walks the same tree
+recursively and loads the font on every call, as the original renderer did. Usage:
+
+    python benchmarks/annotation_renderer.py --line-items 500
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+LAMBDA_DIR = os.path.join(BENCHMARKS_DIR, "..", "lambda", "draw_bboxes_invoices")
+COMMON_LAYER_DIR = os.path.join(BENCHMARKS_DIR, "..", "lambda", "lambda_layer", "idp_common_layer")
+HEADER_FIELDS = ["ID", "DATE", "PO", "SUBTOTAL", "TOTAL", "VENDORNAME", "VENDORADDRESS", "RECIPIENTNAME",
+                 "RECIPIENTADDRESS", "VENDOR_TAX_ID", "RECEIVER_TAX_ID"]
+LINE_ITEM_FIELDS = ["quantity", "unit price", "amount", "product name", "product description"]
+
+
+def get_field(rng, page):
+    return {
+        "success": True,
+        "confidence": rng.random(),
+        "value": "x",
+        "geometry": [{"page": page, "boundingBox": {"left": rng.random() * 0.8, "top": rng.random() * 0.9,
+                                                     "width": 0.1, "height": 0.02}}],
+    }
+
+
+def get_synthetic_explainability(n_line_items, seed=0):
+    rng = random.Random(seed)
+    explainability = {field: get_field(rng, 1) for field in HEADER_FIELDS}
+    explainability["TAX"] = [get_field(rng, 1) for _ in range(2)]
+    explainability["SERVICES_TABLE"] = [{field: get_field(rng, 1) for field in LINE_ITEM_FIELDS}
+                                        for _ in range(n_line_items)]
+    return explainability
+
+
+def draw_per_call(json_data, draw, image_width, image_height, ImageFont):
+    font = ImageFont.load_default()
+    for key, value in json_data.items():
+        if isinstance(value, dict) and value.get("success"):
+            for geometry in value.get("geometry", []):
+                bbox = geometry['boundingBox']
+                left = bbox['left'] * image_width
+                top = bbox['top'] * image_height
+                draw.rectangle([left, top, left + bbox['width'] * image_width, top + bbox['height'] * image_height],
+                               outline="red", width=2)
+                draw.text((left, top - 10), f"{key}: {value.get('confidence', 0):.2f}", fill="red", font=font)
+        elif isinstance(value, dict):
+            draw_per_call(value, draw, image_width, image_height, ImageFont)
+        elif isinstance(value, list):
+            for item in value:
+                if isinstance(item, dict) and item.get("success"):
+                    draw_per_call({key: item}, draw, image_width, image_height, ImageFont)
+                elif isinstance(item, dict):
+                    draw_per_call(item, draw, image_width, image_height, ImageFont)
+
+
+def time_runs(function, repeat):
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--line-items", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    sys.path.insert(0, COMMON_LAYER_DIR)
+    sys.path.insert(0, LAMBDA_DIR)
+    import helper
+    from PIL import Image, ImageDraw, ImageFont
+
+    explainability = get_synthetic_explainability(args.line_items)
+    image = Image.new("RGB", (1190, 1684), "white")
+    draw = ImageDraw.Draw(image)
+    image_width, image_height = image.size
+
+    boxes = helper.flatten_annotations(explainability)
+    flatten_ms = time_runs(lambda: helper.flatten_annotations(explainability), args.repeat)
+    draw_ms = time_runs(lambda: helper.draw_annotation_boxes(boxes, draw, image_width, image_height), args.repeat)
+    per_call_ms = time_runs(lambda: draw_per_call(explainability, draw, image_width, image_height, ImageFont),
+                            args.repeat)
+
+    print(f"line items: {args.line_items}, boxes: {len(boxes)}")
+    print(f"{'flatten (ms)':>14} {'draw (ms)':>10} {'total (ms)':>11} {'per-call renderer (ms)':>23}")
+    print(f"{flatten_ms:>14.2f} {draw_ms:>10.2f} {flatten_ms + draw_ms:>11.2f} {per_call_ms:>23.2f}")
+
+
+if __name__ == "__main__":
+    main()
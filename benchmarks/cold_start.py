@@ -0,0 +1,97 @@
+## Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+## Licensed under the Amazon Software License  https://aws.amazon.com/asl/
+"""Import time of the Lambda functions, the part of a cold start spent in the function code.
+
+Every measurement imports index.py of a function in a fresh interpreter, as the Lambda runtime does on a
+cold start, and reports the median import time, the number of boto3 clients created at import and the
+slowest top level imports (from python -X importtime). The time to create the first client is reported
+separately, as the ingest and completion paths pay for it on their first request. Usage:
+
+    python benchmarks/cold_start.py --repeat 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+LAMBDA_DIR = os.path.join(BENCHMARKS_DIR, "..", "lambda")
+COMMON_LAYER_DIR = os.path.join(LAMBDA_DIR, "lambda_layer", "idp_common_layer")
+FUNCTIONS = ["process_input_files", "process_invoices_bda", "draw_bboxes_invoices", "export_invoices_parquet",
+             "create_blueprint_cr", "poll_bda_jobs"]
+FUNCTION_MODULES = {"index", "helper", "dedup"}
+CHILD_CODE = """
+import json, sys, time
+start = time.perf_counter()
+import index
+import_ms = (time.perf_counter() - start) * 1000
+helper = sys.modules["helper"]
+# Clients created at import, either module level clients or clients already in the lazy registry
+from botocore.client import BaseClient
+clients_at_import = len(getattr(helper, "clients", {})) + sum(isinstance(value, BaseClient) for value in vars(helper).values())
+first_client_ms = None
+if hasattr(helper, "get_client"):
+    start = time.perf_counter()
+    helper.get_client("s3")
+    first_client_ms = (time.perf_counter() - start) * 1000
+print(json.dumps({"import_ms": import_ms, "clients_at_import": clients_at_import, "first_client_ms": first_client_ms}))
+"""
+
+
+def run_child(function_name, importtime=False):
+    # The layers are extracted to /opt/python in Lambda, PYTHONPATH stands in for it here
+    env = {**os.environ, "AWS_DEFAULT_REGION": os.getenv("AWS_DEFAULT_REGION", "us-east-1"),
+           "PYTHONPATH": os.path.abspath(COMMON_LAYER_DIR)}
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", CHILD_CODE]
+    result = subprocess.run(command, cwd=os.path.join(LAMBDA_DIR, function_name), env=env,
+                            check=True, capture_output=True, text=True)
+    return json.loads(result.stdout.splitlines()[-1]), result.stderr
+
+
+def get_slowest_imports(importtime_output, count):
+    # Lines are "import time: self [us] | cumulative | imported package", nested imports are indented by two
+    # spaces per level. The packages imported by the function modules (index, helper and the idp_common layer)
+    # are reported
+    imports = []
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        if depth <= 3 and name.strip() not in FUNCTION_MODULES and not name.strip().startswith("idp_common"):
+            imports.append((int(cumulative) / 1000, name.strip()))
+    # A package and its submodules are reported once, with the slowest of them
+    slowest = {}
+    for ms, name in sorted(imports, reverse=True):
+        slowest.setdefault(name.split(".")[0], (ms, name))
+    return list(slowest.values())[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--functions", nargs="+", default=FUNCTIONS, choices=FUNCTIONS)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=3, help="slowest top level imports to show")
+    args = parser.parse_args()
+
+    print(f"{'function':>24} {'import (ms)':>12} {'clients at import':>18} {'first client (ms)':>18}  slowest imports")
+    for function_name in args.functions:
+        try:
+            runs = [run_child(function_name)[0] for _ in range(args.repeat)]
+        except subprocess.CalledProcessError as e:
+            # e.g. pyarrow is not installed locally
+            print(f"{function_name:>24} failed: {e.stderr.strip().splitlines()[-1]}")
+            continue
+        _, importtime_output = run_child(function_name, importtime=True)
+        slowest = ", ".join(f"{name} {ms:.0f}ms" for ms, name in get_slowest_imports(importtime_output, args.top))
+        first_client = "n/a" if runs[0]["first_client_ms"] is None else \
+            f"{statistics.median(run['first_client_ms'] for run in runs):.1f}"
+        print(f"{function_name:>24} {statistics.median(run['import_ms'] for run in runs):>12.1f} "
+              f"{runs[0]['clients_at_import']:>18} {first_client:>18}  {slowest}")
+
+
+if __name__ == "__main__":
+    main()
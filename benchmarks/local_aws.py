@@ -0,0 +1,156 @@
+## Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+## Licensed under the Amazon Software License  https://aws.amazon.com/asl/
+import collections
+from datetime import datetime, timezone
+import io
+import json
+import os
+import shutil
+import threading
+import uuid
+
+from botocore.response import StreamingBody
+
+
+class LocalS3Client:
+    # Stand-in for the boto3 S3 client used by the Lambda helpers, objects are files under root_dir/<bucket>/<key>
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+
+    def get_path(self, bucket, key):
+        path = os.path.join(self.root_dir, bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def head_object(self, Bucket, Key):
+        path = self.get_path(Bucket, Key)
+        return {"ContentLength": os.path.getsize(path), "ETag": f'"{int(os.path.getmtime(path) * 1000)}"'}
+
+    def get_object(self, Bucket, Key, Range=None):
+        path = self.get_path(Bucket, Key)
+        size = os.path.getsize(path)
+        if Range:
+            start, end = (int(position) for position in Range.removeprefix("bytes=").split("-"))
+            with open(path, "rb") as file:
+                file.seek(start)
+                data = file.read(min(end, size - 1) - start + 1)
+            return {"Body": StreamingBody(io.BytesIO(data), len(data)), "ContentLength": len(data)}
+        return {"Body": StreamingBody(open(path, "rb"), size), "ContentLength": size}
+
+    def download_fileobj(self, Bucket, Key, Fileobj):
+        with open(self.get_path(Bucket, Key), "rb") as file:
+            shutil.copyfileobj(file, Fileobj, 1024 * 1024)
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, **kwargs):
+        with open(self.get_path(Bucket, Key), "wb") as file:
+            shutil.copyfileobj(Fileobj, file, 1024 * 1024)
+
+    def upload_file(self, Filename, Bucket, Key, **kwargs):
+        shutil.copyfile(Filename, self.get_path(Bucket, Key))
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        with open(self.get_path(Bucket, Key), "wb") as file:
+            file.write(Body if isinstance(Body, bytes) else Body.read())
+        return {}
+
+    def copy_object(self, Bucket, Key, CopySource, **kwargs):
+        shutil.copyfile(self.get_path(CopySource["Bucket"], CopySource["Key"]), self.get_path(Bucket, Key))
+        return {}
+
+
+class LocalSQSClient:
+    # Stand-in for the boto3 SQS client, every queue URL is an in-memory FIFO of message bodies
+    def __init__(self):
+        self.queues = {}
+        self.deferrals = 0
+        self.lock = threading.Lock()
+
+    def send_message_batch(self, QueueUrl, Entries):
+        with self.lock:
+            queue = self.queues.setdefault(QueueUrl, collections.deque())
+            for entry in Entries:
+                # The delay is not waited for, delayed messages are the deferred documents sent back to their queue
+                if entry.get("DelaySeconds"):
+                    self.deferrals += 1
+                queue.append({"messageId": str(uuid.uuid4()), "body": entry["MessageBody"], "receive_count": 0})
+        return {"Successful": [{"Id": entry["Id"]} for entry in Entries]}
+
+    def receive(self, queue_url, max_messages, queue_arn):
+        # Returns the messages as an SQS event source delivers them to a Lambda function
+        with self.lock:
+            queue = self.queues.setdefault(queue_url, collections.deque())
+            messages = [queue.popleft() for _ in range(min(max_messages, len(queue)))]
+        records = []
+        for message in messages:
+            message["receive_count"] += 1
+            records.append({"messageId": message["messageId"], "body": message["body"],
+                            "receiptHandle": message["messageId"], "eventSourceARN": queue_arn,
+                            "attributes": {"ApproximateReceiveCount": str(message["receive_count"])}})
+        return messages, records
+
+    def requeue(self, queue_url, messages):
+        with self.lock:
+            self.queues[queue_url].extend(messages)
+
+    def size(self, queue_url):
+        return len(self.queues.get(queue_url, ()))
+
+
+class LocalSSMClient:
+    # Stand-in for the boto3 SSM client, parameters are kept in a dict
+    def __init__(self, parameters=None):
+        self.parameters = dict(parameters or {})
+
+    def get_parameter(self, Name, WithDecryption=False):
+        return {"Parameter": {"Name": Name, "Value": self.parameters[Name]}}
+
+    def put_parameter(self, Name, Value, **kwargs):
+        self.parameters[Name] = Value
+        return {"Version": 1}
+
+
+class FakeBDARuntimeClient:
+    # Stand-in for the bedrock-data-automation-runtime client. Every job ends right away: its custom output and
+    # job_metadata.json are written like BDA writes them, and the completion event is queued for the caller
+    def __init__(self, s3_client, custom_output, region="us-east-1", account="000000000000"):
+        self.s3_client = s3_client
+        self.custom_output = json.dumps(custom_output).encode("utf-8")
+        self.region = region
+        self.account = account
+        self.jobs = {}
+        self.completion_events = collections.deque()
+        self.lock = threading.Lock()
+
+    def invoke_data_automation_async(self, inputConfiguration, outputConfiguration, **kwargs):
+        job_id = str(uuid.uuid4())
+        input_bucket, input_key = inputConfiguration["s3Uri"].removeprefix("s3://").split("/", 1)
+        output_bucket, output_prefix = outputConfiguration["s3Uri"].removeprefix("s3://").split("/", 1)
+        job_prefix = f"{output_prefix}/{job_id}"
+        custom_output_key = f"{job_prefix}/0/custom_output/0/result.json"
+        self.s3_client.put_object(Bucket=output_bucket, Key=custom_output_key, Body=self.custom_output)
+        job_metadata = {
+            "job_id": job_id,
+            "job_status": "PROCESSED",
+            "semantic_modality": "Document",
+            "output_metadata": [{"asset_id": 0, "asset_input_path": {"s3_path": inputConfiguration["s3Uri"]},
+                                 "segment_metadata": [{"custom_output_status": "MATCH",
+                                                       "custom_output_path": f"s3://{output_bucket}/{custom_output_key}"}]}],
+        }
+        job_metadata_key = f"{job_prefix}/job_metadata.json"
+        self.s3_client.put_object(Bucket=output_bucket, Key=job_metadata_key, Body=json.dumps(job_metadata).encode("utf-8"))
+        invocation_arn = f"arn:aws:bedrock:{self.region}:{self.account}:data-automation-invocation/{job_id}"
+        with self.lock:
+            self.jobs[invocation_arn] = f"s3://{output_bucket}/{job_metadata_key}"
+            self.completion_events.append({
+                "source": "aws.bedrock-data-insights",
+                "time": datetime.now(timezone.utc).isoformat(),
+                "detail-type": "Insights Extraction Job Completed",
+                "detail": {"job_id": job_id, "job_status": "SUCCESS",
+                           "input_s3_object": {"s3_bucket": input_bucket, "name": input_key},
+                           "output_s3_location": {"s3_bucket": output_bucket, "name": f"{job_prefix}/0"}},
+            })
+        return {"invocationArn": invocation_arn}
+
+    def get_data_automation_status(self, invocationArn):
+        return {"status": "Success", "outputConfiguration": {"s3Uri": self.jobs[invocationArn]}}
@@ -0,0 +1,90 @@
+## Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+## Licensed under the Amazon Software License  https://aws.amazon.com/asl/
+"""Size and encode time of the output encodings of draw_bboxes_invoices (output_encoding in project_config.json).
+
+The inputs are BDA custom outputs (the files listed in job_metadata.json under custom_output_path), e.g.
+downloaded with `aws s3 cp --recursive s3://<output bucket>/raw_bda_job_outputs/ outputs/`. Without --inputs
+a synthetic invoice from annotation_renderer.py is used. The inference results and the explainability info
+are encoded separately, as draw_bboxes_invoices writes them. Usage:
+
+    python benchmarks/output_encoding.py --inputs "outputs/**/custom_output/*/result.json"
+    python benchmarks/output_encoding.py --line-items 500
+"""
+import argparse
+import glob
+import json
+import os
+import statistics
+import sys
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+LAMBDA_DIR = os.path.join(BENCHMARKS_DIR, "..", "lambda", "draw_bboxes_invoices")
+COMMON_LAYER_DIR = os.path.join(BENCHMARKS_DIR, "..", "lambda", "lambda_layer", "idp_common_layer")
+
+
+def load_documents(args):
+    if args.inputs:
+        paths = sorted(glob.glob(args.inputs, recursive=True))
+        if not paths:
+            raise SystemExit(f"No file matches {args.inputs}")
+        outputs = []
+        for path in paths:
+            with open(path) as file:
+                outputs.append(json.load(file))
+    else:
+        from annotation_renderer import get_synthetic_explainability
+        explainability = get_synthetic_explainability(args.line_items)
+        outputs = [{"inference_result": {key: "x" * 20 for key in explainability},
+                    "explainability_info": [explainability]}]
+    documents = []
+    for output in outputs:
+        documents.extend([output["inference_result"], output["explainability_info"][0]])
+    return documents
+
+
+def time_encoding(helper, documents, encoding, repeat):
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        bodies = [helper.encode_json(document, encoding)[0] for document in documents]
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations) * 1000, sum(len(body) for body in bodies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--inputs", help="glob of BDA custom output files")
+    parser.add_argument("--line-items", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    sys.path.insert(0, COMMON_LAYER_DIR)
+    sys.path.insert(0, LAMBDA_DIR)
+    sys.path.insert(0, BENCHMARKS_DIR)
+    import helper
+
+    documents = load_documents(args)
+    serializers = {"json": None}
+    if helper.orjson is not None:
+        serializers["orjson"] = helper.orjson
+
+    print(f"documents: {len(documents)}")
+    print(f"{'encoding':>10} {'serializer':>11} {'size (KB)':>10} {'vs pretty':>10} {'encode (ms)':>12}")
+    pretty_size = None
+    for encoding in helper.OUTPUT_ENCODINGS:
+        for serializer_name, serializer in serializers.items():
+            # pretty is always written with the standard library
+            if encoding == "pretty" and serializer_name != "json":
+                continue
+            helper.orjson = serializer
+            encode_ms, size = time_encoding(helper, documents, encoding, args.repeat)
+            pretty_size = pretty_size or size
+            print(f"{encoding:>10} {serializer_name:>11} {size / 1024:>10.1f} {size / pretty_size:>10.0%} "
+                  f"{encode_ms:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+## Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+## Licensed under the Amazon Software License  https://aws.amazon.com/asl/
+"""Peak memory of the PDF load modes of process_invoices_bda against the size of the input PDF.
+
+Each measurement runs in a fresh process that opens a generated PDF through open_pdf_from_s3 (backed by
+a local S3 stand-in) and renders its first and last page. Usage:
+
+    python benchmarks/pdf_load_memory.py --sizes-mb 10 50 100 200
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+LAMBDA_DIR = os.path.join(BENCHMARKS_DIR, "..", "lambda", "process_invoices_bda")
+COMMON_LAYER_DIR = os.path.join(BENCHMARKS_DIR, "..", "lambda", "lambda_layer", "idp_common_layer")
+LOAD_MODES = ["memory", "spool", "range"]
+
+
+def generate_pdf(path, size_mb, page_size=(1240, 1754)):
+    # Random noise pages barely compress, pages are appended one at a time until the file reaches
+    # size_mb so the generator itself stays bounded
+    from PIL import Image
+    n_pages = 0
+    while n_pages == 0 or os.path.getsize(path) < size_mb * 1024 * 1024:
+        image = Image.frombytes("RGB", page_size, os.urandom(page_size[0] * page_size[1] * 3))
+        image.save(path, "PDF", append=n_pages > 0, quality=95)
+        image.close()
+        n_pages += 1
+    return n_pages
+
+
+def run_child(load_mode, root_dir, key):
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    sys.path.insert(0, COMMON_LAYER_DIR)
+    sys.path.insert(0, LAMBDA_DIR)
+    sys.path.insert(0, BENCHMARKS_DIR)
+    import helper
+    from local_aws import LocalS3Client
+
+    helper.clients["s3"] = LocalS3Client(root_dir)
+    # The helpers import pdfium lazily, import it before the baseline so only the load itself is measured
+    import pypdfium2
+    import PIL.Image
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with helper.open_pdf_from_s3("input", key, load_mode=load_mode) as pdf:
+        for page_index, pil_image in helper.render_pdf_pages(pdf, sorted({0, len(pdf) - 1})):
+            pil_image.load()
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"{baseline_kb} {peak_kb}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes-mb", type=int, nargs="+", default=[10, 50, 100])
+    parser.add_argument("--modes", nargs="+", default=LOAD_MODES, choices=LOAD_MODES)
+    parser.add_argument("--child", nargs=3, metavar=("MODE", "ROOT_DIR", "KEY"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(*args.child)
+        return
+
+    with tempfile.TemporaryDirectory() as root_dir:
+        print(f"{'size (MB)':>10} {'pages':>6} {'mode':>8} {'peak RSS (MB)':>14} {'above baseline (MB)':>20}")
+        for size_mb in args.sizes_mb:
+            key = f"invoices/generated_{size_mb}mb.pdf"
+            path = os.path.join(root_dir, "input", key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            n_pages = generate_pdf(path, size_mb)
+            actual_size_mb = os.path.getsize(path) / 1024 / 1024
+            for load_mode in args.modes:
+                output = subprocess.run([sys.executable, __file__, "--child", load_mode, root_dir, key],
+                                        check=True, capture_output=True, text=True).stdout
+                baseline_kb, peak_kb = (int(value) for value in output.split()[-2:])
+                print(f"{actual_size_mb:>10.1f} {n_pages:>6} {load_mode:>8} {peak_kb / 1024:>14.1f} "
+                      f"{(peak_kb - baseline_kb) / 1024:>20.1f}")
+
+
+if __name__ == "__main__":
+    main()
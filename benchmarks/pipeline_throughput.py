@@ -0,0 +1,246 @@
+## Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+## Licensed under the Amazon Software License  https://aws.amazon.com/asl/
+"""End-to-end throughput of the pipeline, run in process against local stand-ins for S3, SQS, SSM and BDA.
+
+The PDFs of sample_invoices/ are uploaded --docs times (as hard links) and go through the three runtime
+handlers, as the deployed stack chains them:
+
+    S3 event -> process_input_files -> fast / bulk queue -> process_invoices_bda -> BDA job
+             -> completion event -> draw_bboxes_invoices
+
+The fake BDA runtime ends every job right away and writes a custom output with the fields of
+invoices_blueprint.json, so the numbers are the cost of the Lambda code and not of BDA. Handlers are invoked
+one at a time, the throughput is the one of a single container per function. The timings the handlers log as
+embedded metrics (S3Get, PdfRender, Annotate...) are reported after the ones of the handlers. Usage:
+
+    python benchmarks/pipeline_throughput.py --docs 2000
+    python benchmarks/pipeline_throughput.py --docs 200 --json --fail-under 20
+"""
+import argparse
+import contextlib
+from datetime import datetime, timezone
+import importlib
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+LAMBDA_DIR = os.path.join(BENCHMARKS_DIR, "..", "lambda")
+COMMON_LAYER_DIR = os.path.join(LAMBDA_DIR, "lambda_layer", "idp_common_layer")
+SAMPLE_INVOICES_DIR = os.path.join(BENCHMARKS_DIR, "..", "sample_invoices")
+STAGES = ["process_input_files", "process_invoices_bda", "draw_bboxes_invoices"]
+FUNCTION_MODULES = ["index", "helper"]
+INPUT_BUCKET, STAGING_BUCKET, OUTPUT_BUCKET = "input", "staging", "output"
+FAST_QUEUE_URL = "https://sqs.us-east-1.amazonaws.com/000000000000/InvoicesBDAQueue"
+BULK_QUEUE_URL = "https://sqs.us-east-1.amazonaws.com/000000000000/InvoicesBDABulkQueue"
+SSM_PARAMETER_NAME = "/my-demo/inovices_blueprint_arn"
+
+
+def set_environment(args):
+    # The handlers read their settings from the environment, as set by IDPStack
+    os.environ.update({
+        "AWS_DEFAULT_REGION": os.getenv("AWS_DEFAULT_REGION", "us-east-1"),
+        "DOC_TYPE": "invoices",
+        "INVOICES_BDA_QUEUE_URL": FAST_QUEUE_URL,
+        "INVOICES_BDA_BULK_QUEUE_URL": BULK_QUEUE_URL,
+        "STAGGING_BUCKET": STAGING_BUCKET,
+        "OUTPUT_BUCKET": OUTPUT_BUCKET,
+        "SSM_PARAMETER_NAME": SSM_PARAMETER_NAME,
+        "PDF_PASSTHROUGH": str(args.pdf_passthrough).lower(),
+        "ANNOTATE_IMAGES": str(args.annotate).lower(),
+        "OUTPUT_ENCODING": args.output_encoding,
+        "EXPORT_QUEUE_URL": "",
+        "DEDUP_TABLE_NAME": "memory",
+        "JOBS_TABLE_NAME": "memory",
+        "BDA_MAX_IN_FLIGHT_JOBS": str(args.max_in_flight_jobs),
+    })
+
+
+def load_handler(function_name):
+    # Every function has its own index and helper modules, they are imported under their usual names one
+    # function at a time and taken out of sys.modules, so the next function gets its own
+    function_dir = os.path.join(LAMBDA_DIR, function_name)
+    for module_name in FUNCTION_MODULES:
+        sys.modules.pop(module_name, None)
+    sys.path.insert(0, function_dir)
+    try:
+        index = importlib.import_module("index")
+    finally:
+        sys.path.remove(function_dir)
+        for module_name in FUNCTION_MODULES:
+            sys.modules.pop(module_name, None)
+    return index.lambda_handler
+
+
+def get_custom_output():
+    from annotation_renderer import get_synthetic_explainability
+    # The explainability info of a 10 line invoice, the inference result holds the same values
+    explainability = get_synthetic_explainability(n_line_items=10)
+    inference_result = {field: value["value"] for field, value in explainability.items() if isinstance(value, dict)}
+    inference_result["TAX"] = [item["value"] for item in explainability["TAX"]]
+    inference_result["SERVICES_TABLE"] = [{field: item["value"] for field, item in row.items()}
+                                          for row in explainability["SERVICES_TABLE"]]
+    return {"inference_result": inference_result, "explainability_info": [explainability]}
+
+
+def upload_documents(root_dir, n_docs):
+    # Hard links keep thousands of documents cheap on disk, every copy gets its own key and ETag
+    sample_paths = sorted(os.path.join(SAMPLE_INVOICES_DIR, name) for name in os.listdir(SAMPLE_INVOICES_DIR)
+                          if name.endswith(".pdf"))
+    s3_records = []
+    os.makedirs(os.path.join(root_dir, INPUT_BUCKET, "invoices"), exist_ok=True)
+    for doc_index in range(n_docs):
+        sample_path = sample_paths[doc_index % len(sample_paths)]
+        key = f"invoices/{doc_index:06d}_{os.path.basename(sample_path)}"
+        path = os.path.join(root_dir, INPUT_BUCKET, key)
+        try:
+            os.link(sample_path, path)
+        except OSError:
+            with open(sample_path, "rb") as source, open(path, "wb") as destination:
+                destination.write(source.read())
+        s3_records.append({"eventSource": "aws:s3", "eventTime": datetime.now(timezone.utc).isoformat(),
+                           "s3": {"bucket": {"name": INPUT_BUCKET}, "object": {"key": key, "size": os.path.getsize(path),
+                                                                               "eTag": f"{doc_index:032x}"}}})
+    return s3_records
+
+
+def get_percentile(sorted_values, percentile):
+    # Nearest rank
+    if not sorted_values:
+        return 0.0
+    rank = max(1, round(percentile / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(durations):
+    durations = sorted(durations)
+    return {"invocations": len(durations),
+            **{f"p{percentile}_ms": get_percentile(durations, percentile) * 1000 for percentile in (50, 90, 99)},
+            "max_ms": (durations[-1] if durations else 0.0) * 1000}
+
+
+def run_pipeline(n_docs, root_dir, sqs_batch_size=10, bulk_sqs_batch_size=1, pdf_passthrough=True, annotate=True,
+                 output_encoding="compact", max_in_flight_jobs=0, verbose=False):
+    args = argparse.Namespace(pdf_passthrough=pdf_passthrough, annotate=annotate, output_encoding=output_encoding,
+                              max_in_flight_jobs=max_in_flight_jobs)
+    set_environment(args)
+    for path in (BENCHMARKS_DIR, COMMON_LAYER_DIR):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    from local_aws import FakeBDARuntimeClient, LocalS3Client, LocalSQSClient, LocalSSMClient
+    from idp_common import clients, metrics
+
+    handlers = {stage: load_handler(stage) for stage in STAGES}
+    s3_client = LocalS3Client(root_dir)
+    sqs_client = LocalSQSClient()
+    bda_client = FakeBDARuntimeClient(s3_client, get_custom_output())
+    clients.clients.update({
+        "s3": s3_client,
+        "sqs": sqs_client,
+        "ssm": LocalSSMClient({SSM_PARAMETER_NAME: "arn:aws:bedrock:us-east-1:000000000000:blueprint/benchmark"}),
+        "bedrock-data-automation-runtime": bda_client,
+    })
+    s3_records = upload_documents(root_dir, n_docs)
+    lanes = [(FAST_QUEUE_URL, sqs_batch_size), (BULK_QUEUE_URL, bulk_sqs_batch_size)]
+    durations = {stage: [] for stage in STAGES}
+    # The embedded metrics of the handlers, e.g. S3Get or PdfRender, are gathered across all the records
+    operation_durations = {}
+
+    def collect_metrics(record):
+        for metric in record.get("_aws", {}).get("CloudWatchMetrics", [{}])[0].get("Metrics", []):
+            if metric["Unit"] == "Milliseconds":
+                values = record[metric["Name"]]
+                operation_durations.setdefault(metric["Name"], []).extend(
+                    value / 1000 for value in (values if isinstance(values, list) else [values]))
+
+    def invoke(stage, event):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(handler_output):
+            response = handlers[stage](event, None)
+        durations[stage].append(time.perf_counter() - start)
+        return response
+
+    handler_output = sys.stdout if verbose else open(os.devnull, "w")
+    metrics.metric_sinks.append(collect_metrics)
+    start = time.perf_counter()
+    try:
+        # S3 sends one record per event notification
+        for s3_record in s3_records:
+            invoke("process_input_files", {"Records": [s3_record]})
+        # Queues are drained batch by batch and the completion events delivered in between, as with concurrent
+        # functions. Deferred messages (admission control) go back to their queue
+        while any(sqs_client.size(queue_url) for queue_url, _ in lanes) or bda_client.completion_events:
+            for queue_url, batch_size in lanes:
+                queue_arn = f"arn:aws:sqs:us-east-1:000000000000:{queue_url.rsplit('/', 1)[-1]}"
+                messages, records = sqs_client.receive(queue_url, batch_size, queue_arn)
+                if not records:
+                    continue
+                response = invoke("process_invoices_bda", {"Records": records})
+                failed_ids = {failure["itemIdentifier"] for failure in response["batchItemFailures"]}
+                failed = [message for message in messages if message["messageId"] in failed_ids]
+                if any(message["receive_count"] >= 100 for message in failed):
+                    raise RuntimeError(f"Messages keep failing: {response['batchItemFailures']}")
+                sqs_client.requeue(queue_url, failed)
+            while bda_client.completion_events:
+                invoke("draw_bboxes_invoices", bda_client.completion_events.popleft())
+    finally:
+        metrics.metric_sinks.remove(collect_metrics)
+        if not verbose:
+            handler_output.close()
+    seconds = time.perf_counter() - start
+
+    inference_results_dir = os.path.join(root_dir, OUTPUT_BUCKET, "bda_json", "inference_results", "invoices")
+    n_results = len(os.listdir(inference_results_dir)) if os.path.isdir(inference_results_dir) else 0
+    return {
+        "docs": n_docs,
+        "results": n_results,
+        "seconds": seconds,
+        "docs_per_sec": n_docs / seconds if seconds else 0.0,
+        "deferrals": sqs_client.deferrals,
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "stages": {stage: summarize(stage_durations) for stage, stage_durations in durations.items()},
+        "operations": {operation: summarize(operation_durations[operation]) for operation in sorted(operation_durations)},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=1000)
+    parser.add_argument("--sqs-batch-size", type=int, default=10)
+    parser.add_argument("--bulk-sqs-batch-size", type=int, default=1)
+    parser.add_argument("--stage-pdfs", action="store_true", help="render the pages instead of sending PDFs as is")
+    parser.add_argument("--no-annotate", action="store_true")
+    parser.add_argument("--output-encoding", default="compact", choices=["pretty", "compact", "gzip", "jsonl"])
+    parser.add_argument("--max-in-flight-jobs", type=int, default=0, help="admission control, 0 disables it")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--fail-under", type=float, default=0, help="exit with 1 under this many docs/sec")
+    parser.add_argument("--verbose", action="store_true", help="show the output of the handlers")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root_dir:
+        results = run_pipeline(args.docs, root_dir, args.sqs_batch_size, args.bulk_sqs_batch_size,
+                               pdf_passthrough=not args.stage_pdfs, annotate=not args.no_annotate,
+                               output_encoding=args.output_encoding, max_in_flight_jobs=args.max_in_flight_jobs,
+                               verbose=args.verbose)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{results['docs']} documents, {results['results']} results in {results['seconds']:.1f}s: "
+              f"{results['docs_per_sec']:.1f} docs/sec, peak RSS {results['peak_rss_mb']:.0f} MB, "
+              f"{results['deferrals']} deferrals")
+        print(f"{'stage':>22} {'invocations':>12} {'p50 (ms)':>10} {'p90 (ms)':>10} {'p99 (ms)':>10} {'max (ms)':>10}")
+        for stage, summary in [*results["stages"].items(), *results["operations"].items()]:
+            print(f"{stage:>22} {summary['invocations']:>12} {summary['p50_ms']:>10.1f} {summary['p90_ms']:>10.1f} "
+                  f"{summary['p99_ms']:>10.1f} {summary['max_ms']:>10.1f}")
+    if results["results"] < results["docs"] or results["docs_per_sec"] < args.fail_under:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+## Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+## Licensed under the Amazon Software License  https://aws.amazon.com/asl/
+"""Compare render settings (the "render" section of project_config.json) on sample_invoices/.
+
+For every setting the sample PDFs are rendered and encoded with the process_invoices_bda helpers, and the
+render time, encode time and encoded size are reported. With --bda-bucket and --blueprint-arn each encoded
+image is also sent to Bedrock Data Automation, and the extracted fields are compared with the ones of the
+first setting (the baseline). Usage:
+
+    python benchmarks/render_settings.py
+    python benchmarks/render_settings.py --bda-bucket my-staging-bucket --blueprint-arn arn:aws:bedrock:...
+"""
+import argparse
+import glob
+import json
+import os
+import statistics
+import sys
+import time
+from io import BytesIO
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+LAMBDA_DIR = os.path.join(BENCHMARKS_DIR, "..", "lambda", "process_invoices_bda")
+COMMON_LAYER_DIR = os.path.join(BENCHMARKS_DIR, "..", "lambda", "lambda_layer", "idp_common_layer")
+SAMPLES_DIR = os.path.join(BENCHMARKS_DIR, "..", "sample_invoices")
+
+# The first setting is the baseline the extraction results are compared to
+SETTINGS = {
+    "png-144dpi-l6": {"dpi": 144, "format": "PNG", "png_compress_level": 6},
+    "png-144dpi-l1": {"dpi": 144, "format": "PNG", "png_compress_level": 1},
+    "png-144dpi-l9": {"dpi": 144, "format": "PNG", "png_compress_level": 9},
+    "png-144dpi-gray": {"dpi": 144, "format": "PNG", "grayscale": True},
+    "png-100dpi": {"dpi": 100, "format": "PNG"},
+    "png-200dpi": {"dpi": 200, "format": "PNG"},
+    "jpeg-144dpi-q85": {"dpi": 144, "format": "JPEG", "jpeg_quality": 85},
+    "jpeg-144dpi-q70-gray": {"dpi": 144, "format": "JPEG", "jpeg_quality": 70, "grayscale": True},
+    "jpeg-200dpi-q85": {"dpi": 200, "format": "JPEG", "jpeg_quality": 85},
+    "webp-144dpi-q80": {"dpi": 144, "format": "WEBP", "webp_quality": 80},
+}
+
+
+def flatten_fields(value, prefix=""):
+    if isinstance(value, dict):
+        fields = {}
+        for key, item in value.items():
+            fields.update(flatten_fields(item, f"{prefix}.{key}" if prefix else key))
+        return fields
+    if isinstance(value, list):
+        fields = {}
+        for index, item in enumerate(value):
+            fields.update(flatten_fields(item, f"{prefix}[{index}]"))
+        return fields
+    return {prefix: value}
+
+
+def get_field_agreement(baseline, result):
+    baseline_fields = flatten_fields(baseline)
+    result_fields = flatten_fields(result)
+    if not baseline_fields:
+        return 1.0
+    return sum(result_fields.get(path) == value for path, value in baseline_fields.items()) / len(baseline_fields)
+
+
+def extract_with_bda(helper, image_bytes, bucket, key, blueprint_arn, content_type):
+    s3_client = helper.get_client("s3")
+    bda_runtime_client = helper.get_client("bedrock-data-automation-runtime")
+    s3_client.put_object(Bucket=bucket, Key=key, Body=image_bytes, ContentType=content_type)
+    response = helper.invoke_data_automation(f"s3://{bucket}/{key}", f"s3://{bucket}/benchmarks/bda_outputs", blueprint_arn)
+    while True:
+        status_response = bda_runtime_client.get_data_automation_status(invocationArn=response["invocationArn"])
+        if status_response["status"] not in ("Created", "InProgress"):
+            break
+        time.sleep(5)
+    if status_response["status"] != "Success":
+        return None
+    job_metadata_uri = status_response["outputConfiguration"]["s3Uri"]
+    metadata_bucket, metadata_key = job_metadata_uri.removeprefix("s3://").split("/", 1)
+    job_metadata = json.loads(s3_client.get_object(Bucket=metadata_bucket, Key=metadata_key)["Body"].read())
+    custom_output_uri = job_metadata["output_metadata"][0]["segment_metadata"][0]["custom_output_path"]
+    output_bucket, output_key = custom_output_uri.removeprefix("s3://").split("/", 1)
+    custom_output = json.loads(s3_client.get_object(Bucket=output_bucket, Key=output_key)["Body"].read())
+    return custom_output["inference_result"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", default=os.path.join(SAMPLES_DIR, "*.pdf"))
+    parser.add_argument("--settings", nargs="+", default=list(SETTINGS), choices=list(SETTINGS))
+    parser.add_argument("--bda-bucket", help="bucket the encoded images and BDA outputs are written to")
+    parser.add_argument("--blueprint-arn")
+    args = parser.parse_args()
+
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    sys.path.insert(0, COMMON_LAYER_DIR)
+    sys.path.insert(0, LAMBDA_DIR)
+    import helper
+    import pypdfium2
+
+    sample_paths = sorted(glob.glob(args.samples))
+    baseline_results = {}
+    print(f"{'setting':>22} {'render (ms)':>12} {'encode (ms)':>12} {'size (KB)':>10} {'field agreement':>16}")
+    for setting_name in args.settings:
+        config = {**helper.DEFAULT_RENDER_CONFIG, **SETTINGS[setting_name]}
+        render_times, encode_times, sizes, agreements = [], [], [], []
+        for sample_path in sample_paths:
+            pdf = pypdfium2.PdfDocument(sample_path)
+            pages = helper.render_pdf_pages(pdf, range(len(pdf)), config)
+            while True:
+                start = time.perf_counter()
+                page = next(pages, None)
+                if page is None:
+                    break
+                page_index, pil_image = page
+                render_times.append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                with BytesIO() as image_buffer:
+                    content_type = helper.encode_image(pil_image, image_buffer, config)
+                    image_bytes = image_buffer.getvalue()
+                encode_times.append(time.perf_counter() - start)
+                sizes.append(len(image_bytes))
+
+                # BDA accepts PNG and JPEG only
+                if args.bda_bucket and config["format"] in ("PNG", "JPEG"):
+                    sample_name = f"{os.path.basename(sample_path)}.page{page_index + 1}"
+                    key = f"benchmarks/render/{setting_name}/{sample_name}.{helper.get_image_extension(config)}"
+                    result = extract_with_bda(helper, image_bytes, args.bda_bucket, key, args.blueprint_arn, content_type)
+                    if sample_name not in baseline_results:
+                        baseline_results[sample_name] = result
+                    elif result is not None and baseline_results[sample_name] is not None:
+                        agreements.append(get_field_agreement(baseline_results[sample_name], result))
+            pdf.close()
+
+        agreement = f"{statistics.mean(agreements):.1%}" if agreements else "n/a"
+        print(f"{setting_name:>22} {statistics.mean(render_times) * 1000:>12.1f} "
+              f"{statistics.mean(encode_times) * 1000:>12.1f} {statistics.mean(sizes) / 1024:>10.1f} {agreement:>16}")
+
+
+if __name__ == "__main__":
+    main()
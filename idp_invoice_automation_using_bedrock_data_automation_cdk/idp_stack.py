@@ -5,6 +5,7 @@ from aws_cdk import (
     RemovalPolicy,
     Stack,
     Duration,
+    Size,
     aws_iam as iam,
     aws_lambda as _lambda,
     aws_s3 as s3,
@@ -19,10 +20,12 @@ from aws_cdk import (
     CustomResource,
     aws_events as events,
     aws_events_targets as targets,
+    aws_dynamodb as dynamodb,
 )
 
 from constructs import Construct
 from cdk_nag import NagSuppressions
+import hashlib
 import json
 
 
@@ -37,6 +40,60 @@ class IDPStack(Stack):
         ssm_parameter_name = variables["invoices"]["ssm_parameter_name"]
         invoices_blueprint_name = variables["invoices"]["blueprint_name"]
         invoices_doc_type = variables["invoices"]["doc_type"]
+        invoices_pdf_page_range = variables["invoices"].get("pdf_page_range", "all")
+        invoices_pdf_passthrough = variables["invoices"].get("pdf_passthrough", True)
+        invoices_annotate_images = variables["invoices"].get("annotate_images", True)
+        invoices_annotation_output = variables["invoices"].get("annotation_output", "pages")
+        invoices_s3_max_concurrency = variables["invoices"].get("s3_max_concurrency", 8)
+        invoices_output_encoding = variables["invoices"].get("output_encoding", "compact")
+        invoices_export_enabled = variables["invoices"].get("export_enabled", True)
+        invoices_export_prefix = variables["invoices"].get("export_prefix", "analytics")
+        invoices_export_partition_field = variables["invoices"].get("export_partition_field", "")
+        invoices_export_batch_size = variables["invoices"].get("export_batch_size", 1000)
+        invoices_export_max_batching_window = variables["invoices"].get("export_max_batching_window_seconds", 120)
+        invoices_export_max_file_mb = variables["invoices"].get("export_max_file_mb", 64)
+        invoices_sqs_batch_size = variables["invoices"].get("sqs_batch_size", 10)
+        invoices_sqs_max_batching_window = variables["invoices"].get("sqs_max_batching_window_seconds", 5)
+        invoices_bda_max_concurrency = variables["invoices"].get("bda_max_concurrency", 5)
+        invoices_ssm_cache_ttl = variables["invoices"].get("ssm_cache_ttl_seconds", 300)
+        invoices_pdf_load_mode = variables["invoices"].get("pdf_load_mode", "spool")
+        invoices_pdf_spool_storage_mb = variables["invoices"].get("pdf_spool_storage_mb", 2048)
+        invoices_render_config = json.dumps(variables["invoices"].get("render", {}))
+        invoices_dedup_enabled = variables["invoices"].get("dedup_enabled", True)
+        invoices_dedup_hash = variables["invoices"].get("dedup_hash", "etag")
+        invoices_dedup_retention_days = variables["invoices"].get("dedup_retention_days", 30)
+        invoices_jobs_tracking_enabled = variables["invoices"].get("jobs_tracking_enabled", True)
+        invoices_jobs_retention_days = variables["invoices"].get("jobs_retention_days", 30)
+        invoices_jobs_first_poll_after = variables["invoices"].get("jobs_first_poll_after_seconds", 300)
+        invoices_jobs_poll_interval = variables["invoices"].get("jobs_poll_interval_minutes", 5)
+        invoices_jobs_poll_base_delay = variables["invoices"].get("jobs_poll_base_delay_seconds", 60)
+        invoices_jobs_poll_max_delay = variables["invoices"].get("jobs_poll_max_delay_seconds", 3600)
+        invoices_jobs_reconcile_after = variables["invoices"].get("jobs_reconcile_after_seconds", 900)
+        invoices_bda_max_in_flight_jobs = variables["invoices"].get("bda_max_in_flight_jobs", 20)
+        invoices_bda_sqs_max_concurrency = variables["invoices"].get("bda_sqs_max_concurrency", 5)
+        invoices_bda_max_receive_count = variables["invoices"].get("bda_max_receive_count", 3)
+        invoices_admission_base_delay = variables["invoices"].get("admission_base_delay_seconds", 30)
+        invoices_admission_max_delay = variables["invoices"].get("admission_max_delay_seconds", 900)
+        invoices_fast_lane_max_mb = variables["invoices"].get("fast_lane_max_mb", 5)
+        invoices_fast_lane_max_pages = variables["invoices"].get("fast_lane_max_pages", 10)
+        invoices_fast_memory_mb = variables["invoices"].get("fast_memory_mb", 512)
+        invoices_fast_timeout_minutes = variables["invoices"].get("fast_timeout_minutes", 3)
+        invoices_bulk_memory_mb = variables["invoices"].get("bulk_memory_mb", 2048)
+        invoices_bulk_timeout_minutes = variables["invoices"].get("bulk_timeout_minutes", 15)
+        invoices_bulk_sqs_batch_size = variables["invoices"].get("bulk_sqs_batch_size", 1)
+        invoices_bulk_sqs_max_concurrency = variables["invoices"].get("bulk_sqs_max_concurrency", 2)
+        invoices_metrics_namespace = variables["invoices"].get("metrics_namespace", "IDPInvoices")
+        invoices_profile_mode = variables["invoices"].get("profile_mode", "")
+        invoices_profile_sample_rate = variables["invoices"].get("profile_sample_rate", 0.01)
+        invoices_log_level = variables["invoices"].get("log_level", "INFO")
+        invoices_log_event_sample_rate = variables["invoices"].get("log_event_sample_rate", 0.01)
+        invoices_log_max_field_chars = variables["invoices"].get("log_max_field_chars", 1024)
+        invoices_raw_output_retention_days = variables["invoices"].get("raw_output_retention_days", 7)
+        invoices_staged_retention_days = variables["invoices"].get("staged_retention_days", 3)
+
+        # Version tag of the blueprint schema, a change invalidates the blueprint ARN cached by the Lambdas
+        with open('./lambda/create_blueprint_cr/invoices_blueprint.json', 'rb') as file:
+            invoices_blueprint_version = hashlib.sha256(file.read()).hexdigest()[:12]
 
         # Create a VPC (if you don't already have one)
         public_subnet = ec2.SubnetConfiguration(
@@ -127,6 +184,22 @@ class IDPStack(Stack):
             auto_delete_objects=True,
         )
 
+        # Staged images and raw BDA outputs are only read until the curated results are written to bda_json/,
+        # they expire after a few days instead of piling up (0 keeps them)
+        if invoices_staged_retention_days:
+            stagging_bucket_s3.add_lifecycle_rule(
+                id="ExpireStagedImages",
+                expiration=Duration.days(invoices_staged_retention_days),
+                abort_incomplete_multipart_upload_after=Duration.days(1),
+            )
+        if invoices_raw_output_retention_days:
+            output_bucket_s3.add_lifecycle_rule(
+                id="ExpireRawBDAOutputs",
+                prefix="raw_bda_job_outputs/",
+                expiration=Duration.days(invoices_raw_output_retention_days),
+                abort_incomplete_multipart_upload_after=Duration.days(1),
+            )
+
         # # Add a policy to allow access through the VPC Endpoint for the access logs bucket
         # access_logs_bucket.add_to_resource_policy(
         #     iam.PolicyStatement(
@@ -188,12 +261,7 @@ class IDPStack(Stack):
         # )
 
         ######################### Lambda Layers  #########################
-        langchain_core_layer =_alambda.PythonLayerVersion(self, 'langchain-core-layer',
-            entry = './lambda/lambda_layer/langchain_core_layer/',
-            compatible_runtimes=[_lambda.Runtime.PYTHON_3_12],
-            compatible_architectures=[_lambda.Architecture.ARM_64],
-        )
-
+        ## Every function only gets the layers its imports need, the layers are unzipped on each cold start
         pypdfium2_layer = _alambda.PythonLayerVersion(self, 'pypdfium2-layer',
             entry = './lambda/lambda_layer/pypdfium2_layer/',
             compatible_runtimes=[_lambda.Runtime.PYTHON_3_12],
@@ -211,6 +279,25 @@ class IDPStack(Stack):
             compatible_runtimes=[_lambda.Runtime.PYTHON_3_12],
             compatible_architectures=[_lambda.Architecture.ARM_64],
         )
+
+        orjson_layer = _alambda.PythonLayerVersion(self, 'orjson-layer',
+            entry = './lambda/lambda_layer/orjson_layer/',
+            compatible_runtimes=[_lambda.Runtime.PYTHON_3_12],
+            compatible_architectures=[_lambda.Architecture.ARM_64],
+        )
+
+        pyarrow_layer = _alambda.PythonLayerVersion(self, 'pyarrow-layer',
+            entry = './lambda/lambda_layer/pyarrow_layer/',
+            compatible_runtimes=[_lambda.Runtime.PYTHON_3_12],
+            compatible_architectures=[_lambda.Architecture.ARM_64],
+        )
+
+        ## Shared clients and S3, SSM, PDF and BDA helpers (idp_common package), used by every function
+        idp_common_layer = _alambda.PythonLayerVersion(self, 'idp-common-layer',
+            entry = './lambda/lambda_layer/idp_common_layer/',
+            compatible_runtimes=[_lambda.Runtime.PYTHON_3_12],
+            compatible_architectures=[_lambda.Architecture.ARM_64],
+        )
         ######################### SQS and DLQ  #########################
         # Create a KMS key for encryption
         kms_key = kms.Key(self, "SQSEncryptionKey",
@@ -219,6 +306,7 @@ class IDPStack(Stack):
         )
 
         ############ Invoices BDA Queue ############
+        ## Fast lane, for the small documents (see fast_lane_max_mb and fast_lane_max_pages)
         #### DLQ
         invoices_bda_dlq_ = sqs.Queue(
             self,
@@ -228,8 +316,9 @@ class IDPStack(Stack):
             removal_policy=RemovalPolicy.DESTROY,
             encryption=sqs.QueueEncryption.SQS_MANAGED,
         )
+        ## Messages deferred by the admission control are received again, so they get more receives than failures
         invoices_bda_dlq = sqs.DeadLetterQueue(
-            max_receive_count=3,
+            max_receive_count=invoices_bda_max_receive_count,
             queue=invoices_bda_dlq_,
         )
         #### SQS
@@ -237,7 +326,7 @@ class IDPStack(Stack):
             self,
             "InvoicesBDAQueue",
             receive_message_wait_time=Duration.seconds(5), #Time that the poller waits for new messages before returning a response
-            visibility_timeout = Duration.minutes(3),  # This should be bingger than Lambda time out
+            visibility_timeout = Duration.minutes(invoices_fast_timeout_minutes),  # This should be bingger than Lambda time out
             dead_letter_queue=invoices_bda_dlq,
             enforce_ssl=True,
             removal_policy=RemovalPolicy.DESTROY,
@@ -253,9 +342,107 @@ class IDPStack(Stack):
             )
         )
 
+        ############ Invoices BDA Bulk Queue ############
+        ## Bulk lane, for the large documents, so they do not hold the concurrency of the small ones
+        #### DLQ
+        invoices_bda_bulk_dlq_ = sqs.Queue(
+            self,
+            id="InvoicesBDABulkDLQ",
+            retention_period=Duration.days(7),
+            enforce_ssl=True,
+            removal_policy=RemovalPolicy.DESTROY,
+            encryption=sqs.QueueEncryption.SQS_MANAGED,
+        )
+        invoices_bda_bulk_dlq = sqs.DeadLetterQueue(
+            max_receive_count=invoices_bda_max_receive_count,
+            queue=invoices_bda_bulk_dlq_,
+        )
+        #### SQS
+        invoices_bda_bulk_queue = sqs.Queue(
+            self,
+            "InvoicesBDABulkQueue",
+            receive_message_wait_time=Duration.seconds(5),
+            visibility_timeout = Duration.minutes(invoices_bulk_timeout_minutes + 1),  # This should be bingger than Lambda time out
+            dead_letter_queue=invoices_bda_bulk_dlq,
+            enforce_ssl=True,
+            removal_policy=RemovalPolicy.DESTROY,
+            encryption=sqs.QueueEncryption.KMS,
+            encryption_master_key=kms_key,
+        )
+
+        ############ Invoices Export Queue ############
+        #### DLQ
+        invoices_export_dlq_ = sqs.Queue(
+            self,
+            id="InvoicesExportDLQ",
+            retention_period=Duration.days(7),
+            enforce_ssl=True,
+            removal_policy=RemovalPolicy.DESTROY,
+            encryption=sqs.QueueEncryption.SQS_MANAGED,
+        )
+        invoices_export_dlq = sqs.DeadLetterQueue(
+            max_receive_count=3,
+            queue=invoices_export_dlq_,
+        )
+        #### SQS
+        invoices_export_queue = sqs.Queue(
+            self,
+            "InvoicesExportQueue",
+            receive_message_wait_time=Duration.seconds(5),
+            visibility_timeout = Duration.seconds(6 * 60 + invoices_export_max_batching_window),  # This should be bingger than Lambda time out plus the batching window
+            dead_letter_queue=invoices_export_dlq,
+            enforce_ssl=True,
+            removal_policy=RemovalPolicy.DESTROY,
+            encryption=sqs.QueueEncryption.KMS,
+            encryption_master_key=kms_key,
+        )
+
+        ######################### DynamoDB  #########################
+        #### Content hash deduplication records, so re-uploaded invoices reuse the curated results
+        invoices_dedup_table = dynamodb.Table(
+            self,
+            "InvoicesDedupTable",
+            partition_key=dynamodb.Attribute(name="pk", type=dynamodb.AttributeType.STRING),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at",
+            point_in_time_recovery=True,
+            removal_policy=RemovalPolicy.DESTROY,
+        )
+        invoices_dedup_table_name = invoices_dedup_table.table_name if invoices_dedup_enabled else ""
+
+        #### BDA jobs by job id, recorded on submission and updated by the completion event and the poller
+        invoices_jobs_table = dynamodb.Table(
+            self,
+            "InvoicesJobsTable",
+            partition_key=dynamodb.Attribute(name="pk", type=dynamodb.AttributeType.STRING),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at",
+            point_in_time_recovery=True,
+            removal_policy=RemovalPolicy.DESTROY,
+        )
+        ## Only pending jobs have next_poll_at, so the index only holds the jobs the poller may have to check
+        invoices_jobs_table.add_global_secondary_index(
+            index_name="job_status-next_poll_at-index",
+            partition_key=dynamodb.Attribute(name="job_status", type=dynamodb.AttributeType.STRING),
+            sort_key=dynamodb.Attribute(name="next_poll_at", type=dynamodb.AttributeType.NUMBER),
+            projection_type=dynamodb.ProjectionType.ALL,
+        )
+        invoices_jobs_table_name = invoices_jobs_table.table_name if invoices_jobs_tracking_enabled else ""
+
         ######################################################################
         ############################ Lambda ##################################
         ######################################################################
+        ## Per stage timings are logged as CloudWatch embedded metrics, a sample of the invocations can be profiled.
+        ## Logs are JSON lines, only a sample of the invocations logs its whole event
+        observability_environment = {
+            "METRICS_NAMESPACE": invoices_metrics_namespace,
+            "PROFILE_MODE": invoices_profile_mode,
+            "PROFILE_SAMPLE_RATE": str(invoices_profile_sample_rate),
+            "LOG_LEVEL": invoices_log_level,
+            "LOG_EVENT_SAMPLE_RATE": str(invoices_log_event_sample_rate),
+            "LOG_MAX_FIELD_CHARS": str(invoices_log_max_field_chars),
+        }
+
         ##################### Create Blurprint Lambda #####################
         create_blueprint_cr_lambda = _lambda.Function(self, 
                                 "create_blueprint_cr",
@@ -265,11 +452,12 @@ class IDPStack(Stack):
                                 memory_size=512,
                                 timeout=Duration.seconds(30),
                                 handler="index.lambda_handler",
-                                layers=[boto3_layer],
+                                layers=[boto3_layer, idp_common_layer],
                                 vpc=vpc,
                                 vpc_subnets=ec2.SubnetSelection(subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS),
                                 environment={
                                     "SSM_PARAMETER_NAME": ssm_parameter_name,
+                                    **observability_environment,
                                 }
                             )
         bda_list_blueprint_policy_statement = iam.PolicyStatement(
@@ -312,13 +500,20 @@ class IDPStack(Stack):
                                 memory_size=512,
                                 timeout=Duration.seconds(30),
                                 handler="index.lambda_handler",
+                                layers=[pypdfium2_layer, idp_common_layer],
                                 vpc=vpc,
                                 vpc_subnets=ec2.SubnetSelection(subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS),
                                 environment={
                                     "INVOICES_BDA_QUEUE_URL": invoices_bda_queue.queue_url,
+                                    "INVOICES_BDA_BULK_QUEUE_URL": invoices_bda_bulk_queue.queue_url,
+                                    "FAST_LANE_MAX_MB": str(invoices_fast_lane_max_mb),
+                                    "FAST_LANE_MAX_PAGES": str(invoices_fast_lane_max_pages),
+                                    "DOC_TYPE": invoices_doc_type,
+                                    **observability_environment,
                                 }
                             )
         invoices_bda_queue.grant_send_messages(process_input_files_lambda)
+        invoices_bda_bulk_queue.grant_send_messages(process_input_files_lambda)
         input_bucket_s3.grant_read(process_input_files_lambda)
         kms_key.grant_encrypt_decrypt(process_input_files_lambda)
 
@@ -347,25 +542,55 @@ class IDPStack(Stack):
                                 ),
             )
 
-        ##################### Process Invoices BDA Lambda #####################
+        ##################### Process Invoices BDA Lambdas #####################
+        ## The same code consumes the fast lane and the bulk lane, with the memory and timeout of its lane
+        process_invoices_bda_environment = {
+            "STAGGING_BUCKET":stagging_bucket_s3.bucket_name,
+            "OUTPUT_BUCKET":output_bucket_s3.bucket_name,
+            "SSM_PARAMETER_NAME": ssm_parameter_name,
+            "PDF_PAGE_RANGE": invoices_pdf_page_range,
+            "PDF_PASSTHROUGH": str(invoices_pdf_passthrough).lower(),
+            "BDA_MAX_CONCURRENCY": str(invoices_bda_max_concurrency),
+            "PDF_LOAD_MODE": invoices_pdf_load_mode,
+            "RENDER_CONFIG": invoices_render_config,
+            "SSM_CACHE_TTL_SECONDS": str(invoices_ssm_cache_ttl),
+            "BLUEPRINT_VERSION": invoices_blueprint_version,
+            "DEDUP_TABLE_NAME": invoices_dedup_table_name,
+            "DEDUP_HASH": invoices_dedup_hash,
+            "DEDUP_RETENTION_DAYS": str(invoices_dedup_retention_days),
+            "JOBS_TABLE_NAME": invoices_jobs_table_name,
+            "JOBS_RETENTION_DAYS": str(invoices_jobs_retention_days),
+            "JOBS_FIRST_POLL_AFTER_SECONDS": str(invoices_jobs_first_poll_after),
+            "BDA_MAX_IN_FLIGHT_JOBS": str(invoices_bda_max_in_flight_jobs),
+            "ADMISSION_BASE_DELAY_SECONDS": str(invoices_admission_base_delay),
+            "ADMISSION_MAX_DELAY_SECONDS": str(invoices_admission_max_delay),
+            "DOC_TYPE": invoices_doc_type,
+            **observability_environment,
+        }
         process_invoices_bda_lambda = _lambda.Function(self, 
                                 "process_invoices_bda",
                                 code=_lambda.Code.from_asset("./lambda/process_invoices_bda"),
                                 runtime=_lambda.Runtime.PYTHON_3_12,
                                 architecture=_lambda.Architecture.ARM_64,
-                                memory_size=512,
-                                timeout=Duration.minutes(3),
+                                memory_size=invoices_fast_memory_mb,
+                                timeout=Duration.minutes(invoices_fast_timeout_minutes),
+                                ephemeral_storage_size=Size.mebibytes(invoices_pdf_spool_storage_mb),
                                 handler="index.lambda_handler",
-                                layers=[boto3_layer, pypdfium2_layer, pillow_layer],
-                                environment={
-                                    "STAGGING_BUCKET":stagging_bucket_s3.bucket_name,
-                                    "OUTPUT_BUCKET":output_bucket_s3.bucket_name,
-                                    "SSM_PARAMETER_NAME": ssm_parameter_name,
-                                }
+                                layers=[boto3_layer, pypdfium2_layer, pillow_layer, idp_common_layer],
+                                environment=process_invoices_bda_environment,
+                            )
+        process_invoices_bda_bulk_lambda = _lambda.Function(self, 
+                                "process_invoices_bda_bulk",
+                                code=_lambda.Code.from_asset("./lambda/process_invoices_bda"),
+                                runtime=_lambda.Runtime.PYTHON_3_12,
+                                architecture=_lambda.Architecture.ARM_64,
+                                memory_size=invoices_bulk_memory_mb,
+                                timeout=Duration.minutes(invoices_bulk_timeout_minutes),
+                                ephemeral_storage_size=Size.mebibytes(invoices_pdf_spool_storage_mb),
+                                handler="index.lambda_handler",
+                                layers=[boto3_layer, pypdfium2_layer, pillow_layer, idp_common_layer],
+                                environment=process_invoices_bda_environment,
                             )
-        input_bucket_s3.grant_read(process_invoices_bda_lambda)
-        stagging_bucket_s3.grant_read_write(process_invoices_bda_lambda)
-        output_bucket_s3.grant_read_write(process_invoices_bda_lambda)
 
         bda_invoke_job_policy_statement = iam.PolicyStatement(
             effect=iam.Effect.ALLOW,
@@ -379,14 +604,39 @@ class IDPStack(Stack):
             actions=["ssm:GetParameter"],
             resources= [f"arn:aws:ssm:{self.region}:{self.account}:parameter{ssm_parameter_name}",]
         )
-        process_invoices_bda_lambda.add_to_role_policy(bda_invoke_job_policy_statement)
-        process_invoices_bda_lambda.add_to_role_policy(ssm_get_policy_statement)
+        for process_invoices_function in [process_invoices_bda_lambda, process_invoices_bda_bulk_lambda]:
+            input_bucket_s3.grant_read(process_invoices_function)
+            stagging_bucket_s3.grant_read_write(process_invoices_function)
+            output_bucket_s3.grant_read_write(process_invoices_function)
+            invoices_dedup_table.grant_read_write_data(process_invoices_function)
+            invoices_jobs_table.grant_read_write_data(process_invoices_function)
+            process_invoices_function.add_to_role_policy(bda_invoke_job_policy_statement)
+            process_invoices_function.add_to_role_policy(ssm_get_policy_statement)
         invoices_bda_queue.grant_consume_messages(process_invoices_bda_lambda)
+        invoices_bda_bulk_queue.grant_consume_messages(process_invoices_bda_bulk_lambda)
+        # Deferred documents are sent back to the queue they came from
+        invoices_bda_queue.grant_send_messages(process_invoices_bda_lambda)
+        invoices_bda_bulk_queue.grant_send_messages(process_invoices_bda_bulk_lambda)
 
-        ## This event will be triggered by SQS when a new message is received
-        invoke_event_source = lambda_event_sources.SqsEventSource(invoices_bda_queue, batch_size=1)
+        ## This event will be triggered by SQS when new messages are received.
+        ## Messages are delivered in batches and only the failed ones are returned to the queue.
+        ## max_concurrency caps the concurrent invocations, so intake stays near the BDA job quota
+        invoke_event_source = lambda_event_sources.SqsEventSource(invoices_bda_queue,
+                                batch_size=invoices_sqs_batch_size,
+                                max_batching_window=Duration.seconds(invoices_sqs_max_batching_window),
+                                max_concurrency=invoices_bda_sqs_max_concurrency,
+                                report_batch_item_failures=True,
+                            )
         process_invoices_bda_lambda.add_event_source(invoke_event_source)
 
+        ## Large documents are processed a few at a time, with their own concurrency
+        bulk_invoke_event_source = lambda_event_sources.SqsEventSource(invoices_bda_bulk_queue,
+                                batch_size=invoices_bulk_sqs_batch_size,
+                                max_concurrency=invoices_bulk_sqs_max_concurrency,
+                                report_batch_item_failures=True,
+                            )
+        process_invoices_bda_bulk_lambda.add_event_source(bulk_invoke_event_source)
+
         ##################### Dummy Lambda #####################
         draw_bboxes_invoices_lambda = _lambda.Function(self, 
                                 "draw_bboxes_invoices",
@@ -395,15 +645,32 @@ class IDPStack(Stack):
                                 architecture=_lambda.Architecture.ARM_64,
                                 memory_size=512,
                                 timeout=Duration.minutes(3),
+                                ephemeral_storage_size=Size.mebibytes(invoices_pdf_spool_storage_mb),
                                 handler="index.lambda_handler",
-                                layers=[langchain_core_layer, pypdfium2_layer, pillow_layer, boto3_layer],
+                                layers=[pypdfium2_layer, pillow_layer, boto3_layer, orjson_layer, idp_common_layer],
                                 environment={
                                     "DOC_TYPE": invoices_doc_type,
+                                    "ANNOTATE_IMAGES": str(invoices_annotate_images).lower(),
+                                    "ANNOTATION_OUTPUT": invoices_annotation_output,
+                                    "S3_MAX_CONCURRENCY": str(invoices_s3_max_concurrency),
+                                    "OUTPUT_ENCODING": invoices_output_encoding,
+                                    "EXPORT_QUEUE_URL": invoices_export_queue.queue_url if invoices_export_enabled else "",
+                                    "PDF_LOAD_MODE": invoices_pdf_load_mode,
+                                    "RENDER_CONFIG": invoices_render_config,
+                                    "DEDUP_TABLE_NAME": invoices_dedup_table_name,
+                                    "DEDUP_RETENTION_DAYS": str(invoices_dedup_retention_days),
+                                    "JOBS_TABLE_NAME": invoices_jobs_table_name,
+                                    "JOBS_RETENTION_DAYS": str(invoices_jobs_retention_days),
+                                    **observability_environment,
                                 }
                             )
         input_bucket_s3.grant_read(draw_bboxes_invoices_lambda)
         stagging_bucket_s3.grant_read(draw_bboxes_invoices_lambda)
         output_bucket_s3.grant_read_write(draw_bboxes_invoices_lambda)
+        invoices_dedup_table.grant_read_write_data(draw_bboxes_invoices_lambda)
+        invoices_jobs_table.grant_read_write_data(draw_bboxes_invoices_lambda)
+        invoices_export_queue.grant_send_messages(draw_bboxes_invoices_lambda)
+        kms_key.grant_encrypt_decrypt(draw_bboxes_invoices_lambda)
         
         event_bridge_job_completion_rule = events.Rule(
             self, 
@@ -419,13 +686,90 @@ class IDPStack(Stack):
         # Add State Change Lambda function as a target to the EventBridge rule
         event_bridge_job_completion_rule.add_target(targets.LambdaFunction(draw_bboxes_invoices_lambda))
 
+        ##################### Export Invoices Parquet Lambda #####################
+        ## Flattens the inference results into header and line item tables, written as partitioned Parquet
+        export_invoices_parquet_lambda = _lambda.Function(self, 
+                                "export_invoices_parquet",
+                                code=_lambda.Code.from_asset("./lambda/export_invoices_parquet"),
+                                runtime=_lambda.Runtime.PYTHON_3_12,
+                                architecture=_lambda.Architecture.ARM_64,
+                                memory_size=1024,
+                                timeout=Duration.minutes(5),
+                                handler="index.lambda_handler",
+                                layers=[boto3_layer, pyarrow_layer, idp_common_layer],
+                                environment={
+                                    "OUTPUT_BUCKET": output_bucket_s3.bucket_name,
+                                    "SSM_PARAMETER_NAME": ssm_parameter_name,
+                                    "SSM_CACHE_TTL_SECONDS": str(invoices_ssm_cache_ttl),
+                                    "BLUEPRINT_VERSION": invoices_blueprint_version,
+                                    "DOC_TYPE": invoices_doc_type,
+                                    "EXPORT_PREFIX": invoices_export_prefix,
+                                    "EXPORT_PARTITION_FIELD": invoices_export_partition_field,
+                                    "EXPORT_MAX_FILE_MB": str(invoices_export_max_file_mb),
+                                    "S3_MAX_CONCURRENCY": str(invoices_s3_max_concurrency),
+                                    **observability_environment,
+                                }
+                            )
+        output_bucket_s3.grant_read_write(export_invoices_parquet_lambda)
+        export_invoices_parquet_lambda.add_to_role_policy(bda_list_blueprint_policy_statement)
+        export_invoices_parquet_lambda.add_to_role_policy(ssm_get_policy_statement)
+        invoices_export_queue.grant_consume_messages(export_invoices_parquet_lambda)
+
+        ## Results are exported in batches, so every invocation writes a few larger files instead of many small ones
+        export_event_source = lambda_event_sources.SqsEventSource(invoices_export_queue,
+                                batch_size=invoices_export_batch_size,
+                                max_batching_window=Duration.seconds(invoices_export_max_batching_window),
+                                report_batch_item_failures=True,
+                            )
+        if invoices_export_enabled:
+            export_invoices_parquet_lambda.add_event_source(export_event_source)
+
+        ##################### Poll BDA Jobs Lambda #####################
+        ## Checks the jobs the completion event did not report (failed, stuck or missed jobs), with backoff per job
+        poll_bda_jobs_lambda = _lambda.Function(self, 
+                                "poll_bda_jobs",
+                                code=_lambda.Code.from_asset("./lambda/poll_bda_jobs"),
+                                runtime=_lambda.Runtime.PYTHON_3_12,
+                                architecture=_lambda.Architecture.ARM_64,
+                                memory_size=256,
+                                timeout=Duration.minutes(2),
+                                handler="index.lambda_handler",
+                                layers=[boto3_layer, idp_common_layer],
+                                environment={
+                                    "JOBS_TABLE_NAME": invoices_jobs_table_name,
+                                    "JOBS_RETENTION_DAYS": str(invoices_jobs_retention_days),
+                                    "JOBS_POLL_BASE_DELAY_SECONDS": str(invoices_jobs_poll_base_delay),
+                                    "JOBS_POLL_MAX_DELAY_SECONDS": str(invoices_jobs_poll_max_delay),
+                                    "JOBS_RECONCILE_AFTER_SECONDS": str(invoices_jobs_reconcile_after),
+                                    "COMPLETION_FUNCTION_NAME": draw_bboxes_invoices_lambda.function_name,
+                                    "BDA_MAX_CONCURRENCY": str(invoices_bda_max_concurrency),
+                                    **observability_environment,
+                                }
+                            )
+        invoices_jobs_table.grant_read_write_data(poll_bda_jobs_lambda)
+        poll_bda_jobs_lambda.add_to_role_policy(bda_invoke_job_policy_statement)
+        # Successful jobs whose completion event was missed are post-processed like the others
+        draw_bboxes_invoices_lambda.grant_invoke(poll_bda_jobs_lambda)
+
+        if invoices_jobs_tracking_enabled:
+            poll_bda_jobs_rule = events.Rule(
+                self,
+                'PollBDAJobsRule',
+                description='Scheduled check of the BDA jobs that did not report completion',
+                schedule=events.Schedule.rate(Duration.minutes(invoices_jobs_poll_interval)),
+            )
+            poll_bda_jobs_rule.add_target(targets.LambdaFunction(poll_bda_jobs_lambda))
+
         #######################################################################
         ######################### CDK Nag Suppression #########################
         #######################################################################
         NagSuppressions.add_resource_suppressions([create_blueprint_cr_lambda.role, 
                                                    process_input_files_lambda.role,
                                                    process_invoices_bda_lambda.role,
+                                                   process_invoices_bda_bulk_lambda.role,
                                                    draw_bboxes_invoices_lambda.role,
+                                                   export_invoices_parquet_lambda.role,
+                                                   poll_bda_jobs_lambda.role,
                                                    ],
                             suppressions=[ {
                                                 "id": "AwsSolutions-IAM4",
@@ -442,7 +786,10 @@ class IDPStack(Stack):
         NagSuppressions.add_resource_suppressions([create_blueprint_cr_lambda, 
                                                    process_input_files_lambda,
                                                    process_invoices_bda_lambda,
+                                                   process_invoices_bda_bulk_lambda,
                                                    draw_bboxes_invoices_lambda,
+                                                   export_invoices_parquet_lambda,
+                                                   poll_bda_jobs_lambda,
                                                    ],
                             suppressions=[  {   "id": "AwsSolutions-L1", 
                                                 "reason": "This code is for demo purposes. So using Python 3.12."
@@ -1,12 +1,13 @@
 ## Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
 ## SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
 ## Licensed under the Amazon Software License  https://aws.amazon.com/asl/
+import json
 from helper import * 
 import os
 from urllib.parse import urlparse, unquote_plus
 
 def lambda_handler(event, context):
-    print(event)
+    logger.log_event(event)
     
     if event['RequestType'] != 'Create':
         return
@@ -19,7 +20,7 @@ def lambda_handler(event, context):
     ssm_param_name = os.getenv("SSM_PARAMETER_NAME", "/my-demo/inovices_blueprint_arn")
     ssm_param_value = inovices_blueprint_arn
     response = put_parameter_in_ssm(ssm_param_name, ssm_param_value)
-    print(response)
+    logger.info("Blueprint ARN saved to SSM", ssm_parameter_name=ssm_param_name, blueprint_arn=inovices_blueprint_arn)
 
     
     return {'statusCode': 200,
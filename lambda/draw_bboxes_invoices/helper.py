@@ -1,253 +1,191 @@
 ## Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
 ## SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
 ## Licensed under the Amazon Software License  https://aws.amazon.com/asl/
-import boto3
-from botocore.config import Config
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
-from urllib.parse import urlparse, unquote_plus
-import json
-import os
-import time
-from PIL import Image, ImageDraw, ImageFont
-import pypdfium2
-
-
-#increase the standard time out limits in boto3, because Bedrock may take a while to respond to large requests.
-my_config = Config(
-    connect_timeout=60*5,
-    read_timeout=60*5,
-)
-
-s3_client=boto3.client("s3")
-s3_resource = boto3.resource('s3')
-ssm = boto3.client('ssm')
-bda_client = boto3.client('bedrock-data-automation')
-bda_runtime_client = boto3.client('bedrock-data-automation-runtime')
-
-# read json file from 'blueprints' folder. Json file name is bda_invoices_blueprint.json. this json schmea i need to pass as string to another method. 
-def read_json_as_str(file_name):
-    # json_file_path = os.path.join(folder_name, file_name)
-    
-    # Read the JSON file
-    with open(file_name, 'r') as file:
-        blueprint_schema = json.load(file)
-        # Convert the JSON to a string
-        schema_string = json.dumps(blueprint_schema)
-    return schema_string
-
-def save_image_to_s3(image, bucket, key):
-    with BytesIO() as image_buffer:
-        image.save(image_buffer, 'PNG')
-        image_buffer.seek(0)
-        s3_client.upload_fileobj(image_buffer, bucket, key)
-    return bucket, key
-
-def convert_pdf_to_png(input_bucket, input_key, output_bucket, output_key):
-    pdf_obj = s3_resource.Object(input_bucket, input_key).get()['Body'].read()
-    pdf = pypdfium2.PdfDocument(pdf_obj)
-    n_pages = len(pdf)  # get the number of pages in the document
-    print("Number of pages:", n_pages)
-    page = pdf[0] # we will take first page only
-    bitmap = page.render(scale=2, rotation=0)
-    pil_image = bitmap.to_pil()
-    save_image_to_s3(pil_image, output_bucket, output_key)
-    return output_bucket, output_key
-
-def create_blueprint(blueprint_name, schema_str):
-    response = bda_client.create_blueprint(
-        blueprintName=blueprint_name,
-        type='DOCUMENT',
-        blueprintStage='LIVE',
-        schema=schema_str
-    )
-    return response
-
-def create_blueprint_version(blueprint_arn):
-    response = bda_client.create_blueprint_version(
-        blueprintArn=blueprint_arn
-    )
-    return response
-
-def get_or_create_blueprint(blueprint_name, blueprint_file_name):
-        blueprint_arn = ""
-        all_blueprint_response = bda_client.list_blueprints(blueprintStageFilter='LIVE')
-        for item in all_blueprint_response['blueprints']:
-            if blueprint_name in item['blueprintName']:
-                blueprint_arn = item['blueprintArn']
-                break 
-        if blueprint_arn == "":
-            print("Blueprint not found")
-            blueprint_schema = read_json_as_str(blueprint_file_name)
-            blueprint_response = create_blueprint(blueprint_name, blueprint_schema)
-            blueprint_arn = blueprint_response['blueprint']['blueprintArn']
-        return blueprint_arn
-
-
-def invoke_data_automation(input_s3_uri, output_s3_uri, blueprint_arn):
-    response = bda_runtime_client.invoke_data_automation_async(
-                                inputConfiguration={
-                                    's3Uri': input_s3_uri
-                                },
-                                outputConfiguration={
-                                    's3Uri': output_s3_uri
-                                },
-                                notificationConfiguration={
-                                    'eventBridgeConfiguration': {
-                                        'eventBridgeEnabled': True
-                                    }
-                                },
-                                blueprints=[{'blueprintArn': blueprint_arn},]
-                            )
-    return response
-
-def check_data_automation_job_status(invocation_arn):
-    while True:
-        job_status_response = bda_runtime_client.get_data_automation_status(
-            invocationArn=invocation_arn
-        )
-        
-        status = job_status_response['status']  # Assuming the status is in this field
-        job_metadata_s3_uri = ""
-        
-        if status == 'InProgress':
-            print("Job is still in progress. Waiting...")
-            time.sleep(5)  # Wait for 5 seconds before checking again
-            continue
-        elif status == 'Success':
-            print("Job completed successfully!")
-            job_metadata_s3_uri = job_status_response['outputConfiguration']['s3Uri']
-            return 'Success', job_metadata_s3_uri
-        elif status in ['ServiceError', 'ClientError', 'Created']:
-            print(f"Job ended with status: {status}")
-            job_metadata_s3_uri = job_status_response['outputConfiguration']['s3Uri']
-            return status, job_metadata_s3_uri
-        else:
-            print(f"Unknown status: {status}")
-            return status, job_metadata_s3_uri
-
-def read_json_content_from_s3(s3_path):
-    # Parse bucket and key from s3 path
-    bucket_name = s3_path.split('/')[2]
-    key = '/'.join(s3_path.split('/')[3:])
-    
-    response = s3_client.get_object(Bucket=bucket_name, Key=key)
-    json_content = json.loads(response['Body'].read().decode('utf-8'))
-    return json_content
-    
-def get_custom_output_path(s3_path):
-    json_content = read_json_content_from_s3(s3_path)
-    custom_output_path = json_content['output_metadata'][0]['segment_metadata'][0]['custom_output_path']
-    return custom_output_path
-
+import tempfile
+import threading
+from idp_common.clients import *
+from idp_common.ssm import *
+from idp_common.s3 import *
+from idp_common.sqs import *
+from idp_common.pdf import *
+from idp_common.bda import *
+from idp_common.metrics import *
+from idp_common.logger import bind_log_context, get_logger
+
+logger = get_logger("draw_bboxes_invoices")
+
+
+# The boxes are drawn in color even when grayscale rendering is set
+annotation_render_config = {**render_config, "grayscale": False}
+
+# Loaded once per container by get_annotation_font
+annotation_font = None
+
+# Parsed BDA outputs of the most recent jobs, see resolve_job_outputs
+job_outputs_cache_size = 16
+job_outputs_cache = OrderedDict()
+job_outputs_cache_lock = threading.Lock()
+
+def resolve_job_outputs(job_metadata_s3_uri, invocation_id=None):
+    # Reads job_metadata.json once, then all the custom outputs of the job concurrently.
+    # The parsed outputs are cached per invocation, so reprocessing the same job does not read them again
+    cache_key = invocation_id or job_metadata_s3_uri
+    with job_outputs_cache_lock:
+        if cache_key in job_outputs_cache:
+            job_outputs_cache.move_to_end(cache_key)
+            return job_outputs_cache[cache_key]
+
+    custom_output_paths = get_custom_output_paths(read_json_content_from_s3(job_metadata_s3_uri))
+    if len(custom_output_paths) > 1:
+        with ThreadPoolExecutor(max_workers=min(len(custom_output_paths), s3_max_concurrency)) as executor:
+            futures = [submit_in_context(executor, read_json_content_from_s3, path) for path in custom_output_paths]
+            custom_outputs = [future.result() for future in futures]
+    else:
+        custom_outputs = [read_json_content_from_s3(path) for path in custom_output_paths]
+
+    with job_outputs_cache_lock:
+        job_outputs_cache[cache_key] = custom_outputs
+        if len(job_outputs_cache) > job_outputs_cache_size:
+            job_outputs_cache.popitem(last=False)
+    return custom_outputs
+
+
+def flatten_annotations(json_data):
+    # Walk the explainability tree once and collect every extracted field that has a geometry, including the
+    # fields of nested groups (e.g. SERVICES_TABLE / LINEITEM rows), as (label, confidence, page, bbox) tuples
+    boxes = []
+    stack = [(None, json_data)]
+    while stack:
+        key, value = stack.pop()
+        if isinstance(value, dict) and ("success" in value or "geometry" in value):
+            if value.get("success"):
+                confidence = value.get("confidence", 0)
+                for geometry in value.get("geometry", []):
+                    boxes.append((key, confidence, geometry.get("page", 1), geometry['boundingBox']))
+        elif isinstance(value, dict):
+            stack.extend(reversed(list(value.items())))
+        elif isinstance(value, list):
+            stack.extend((key, item) for item in reversed(value))
+    return boxes
+
+def get_annotation_font():
+    global annotation_font
+    if annotation_font is None:
+        from PIL import ImageFont
+        # Pillow >= 10.1 returns a FreeType font from load_default(), which draws each label ~30x slower
+        # than the bitmap font it returned before. Keep the bitmap font where both are available
+        load_font = getattr(ImageFont, "load_default_imagefont", ImageFont.load_default)
+        annotation_font = load_font()
+    return annotation_font
+
+def draw_annotation_boxes(boxes, draw, image_width, image_height):
+    font = get_annotation_font()
+    for label, confidence, _, bbox in boxes:
+        left = bbox['left'] * image_width
+        top = bbox['top'] * image_height
+        right = left + bbox['width'] * image_width
+        bottom = top + bbox['height'] * image_height
+
+        # Draw the bounding box and annotate it with the confidence score
+        draw.rectangle([left, top, right, bottom], outline="red", width=2)
+        draw.text((left, top - 10), f"{label}: {confidence:.2f}", fill="red", font=font)
 
 # Function to draw bounding boxes and confidence scores
 def draw_invoices_annotations(json_data, draw, image_width, image_height):
-    font = ImageFont.load_default()
-    for key, value in json_data.items():
-        if isinstance(value, dict) and value.get("success"):
-            confidence = value.get("confidence", 0)
-            for geometry in value.get("geometry", []):
-                bbox = geometry['boundingBox']
-                left = bbox['left'] * image_width
-                top = bbox['top'] * image_height
-                width = bbox['width'] * image_width
-                height = bbox['height'] * image_height
-                right = left + width
-                bottom = top + height
-
-                # Draw the bounding box
-                draw.rectangle([left, top, right, bottom], outline="red", width=2)
-
-                # Annotate with confidence score
-                text = f"{key}: {confidence:.2f}"
-                text_position = (left, top - 10)
-                draw.text(text_position, text, fill="red", font=font)
-                
-        elif isinstance(value, list):  # For nested drug details or similar
-            for item in value:
-                draw_invoices_annotations(item, draw, image_width, image_height)
-                         
-def annotate_form_and_save_to_s3(input_s3_uri, json_data, op_bucket, op_key, doc_type):
+    draw_annotation_boxes(flatten_annotations(json_data), draw, image_width, image_height)
+
+def group_boxes_by_page(boxes):
+    # BDA page numbers start at 1
+    boxes_by_page = {}
+    for box in boxes:
+        boxes_by_page.setdefault(box[2], []).append(box)
+    return boxes_by_page
+
+def draw_annotated_image(image, boxes):
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    from PIL import ImageDraw
+    draw = ImageDraw.Draw(image)
+    image_width, image_height = image.size
+    draw_annotation_boxes(boxes, draw, image_width, image_height)
+    return image
+
+def upload_annotated_image(image, op_bucket, op_key):
+    # Encode the image and upload it to S3, the boxes are drawn in color even when grayscale rendering is set
+    with BytesIO() as image_buffer:
+        content_type = encode_image(image, image_buffer, annotation_render_config)
+        with timer("S3Put"):
+            get_client("s3").put_object(Body=image_buffer.getvalue(), Bucket=op_bucket, Key=op_key, ContentType=content_type)
+    logger.debug("Annotated image saved to S3", s3_uri=f"s3://{op_bucket}/{op_key}")
+
+def get_annotated_page_key(op_key, page_number, n_pages):
+    # Single page documents keep the original key
+    if n_pages == 1:
+        return op_key
+    base_key, extension = op_key.rsplit(".", 1)
+    return f"{base_key}.page{page_number}.{extension}"
+
+def annotate_pdf_pages(bucket_name, key, boxes_by_page, op_bucket, op_key, output_mode):
+    # Only the pages that have boxes are rendered, one at a time. With output_mode "pdf" the annotated pages
+    # are appended to a single PDF in /tmp, otherwise every page is uploaded as its own image
+    # pdfium calls hold idp_common.pdf.pdfium_lock, the drawing and the uploads of the segments overlap
+    op_keys = []
+    with open_pdf_from_s3(bucket_name, key) as pdf:
+        n_pages = get_page_count(pdf)
+        set_document_properties(pages=n_pages)
+        page_numbers = sorted(page_number for page_number in boxes_by_page if 1 <= page_number <= n_pages) or [1]
+        annotated_pdf = tempfile.NamedTemporaryFile(suffix=".pdf") if output_mode == "pdf" else None
+        for page_number in page_numbers:
+            image = draw_annotated_image(render_pdf_page(pdf, page_number - 1, annotation_render_config),
+                                         boxes_by_page.get(page_number, []))
+            if annotated_pdf:
+                image.save(annotated_pdf.name, "PDF", append=page_number != page_numbers[0], resolution=render_config["dpi"])
+            else:
+                page_key = get_annotated_page_key(op_key, page_number, n_pages)
+                upload_annotated_image(image, op_bucket, page_key)
+                op_keys.append(page_key)
+            image.close()
+    if annotated_pdf:
+        with annotated_pdf:
+            pdf_key = f"{op_key.rsplit('.', 1)[0]}.pdf"
+            with timer("S3Put"):
+                get_client("s3").upload_file(annotated_pdf.name, op_bucket, pdf_key, ExtraArgs={"ContentType": "application/pdf"})
+        logger.debug("Annotated PDF saved to S3", s3_uri=f"s3://{op_bucket}/{pdf_key}")
+        op_keys.append(pdf_key)
+    return op_keys
+
+@timed("Annotate")
+def annotate_form_and_save_to_s3(input_s3_uri, json_data, op_bucket, op_key, doc_type, output_mode="pages"):
+    # Returns the keys of the annotated images (or PDF) written to op_bucket
     # Parse S3 URI
     bucket_name = input_s3_uri.split('/')[2]
     key = '/'.join(input_s3_uri.split('/')[3:])
-    
-    # Download the image from S3
-    response = s3_client.get_object(Bucket=bucket_name, Key=key)
-    image_data = response['Body'].read()
-    
-    # Load image into PIL
-    image = Image.open(BytesIO(image_data))
-    draw = ImageDraw.Draw(image)
-    
-    # Get image dimensions
-    image_width, image_height = image.size
-    
+
     # Annotate the image
-    if doc_type =="invoices":
-        draw_invoices_annotations(json_data, draw, image_width, image_height)
-    
-    # Display the image in the notebook
-    # plt.figure(figsize=(15, 15))
-    # plt.imshow(image)
-    # plt.axis('off')  # Hide axes
-    # plt.show()
-    
-    # Save the image to a BytesIO object
-    img_byte_arr = BytesIO()
-    image.save(img_byte_arr, format='PNG')
-    img_byte_arr = img_byte_arr.getvalue()
-    
-    # Upload the image to S3
-    s3_client.put_object(Body=img_byte_arr, Bucket=op_bucket, Key=op_key)
-    
-    print(f"Annotated image saved to S3: s3://{op_bucket}/{op_key}")
-
-def get_s3_bucket_and_key(s3_input_uri):
-    parsed_uri = urlparse(s3_input_uri)
-    
-    if parsed_uri.scheme == 's3':
-        # s3://bucket-name/key format
-        bucket = parsed_uri.netloc
-        key = parsed_uri.path.lstrip('/')
-    elif parsed_uri.scheme == 'https':
-        # https://bucket-name.s3.amazonaws.com/key format
-        bucket = parsed_uri.netloc.split('.')[0]
-        key = parsed_uri.path.lstrip('/')
-    else:
-        raise ValueError("Unsupported URL format")
-    
-    # remove un necesssary special quotes
-    key = unquote_plus(key)
-
-    return bucket, key
-    
-def save_json_to_s3(bucket, key, llm_json_response):
-    # Convert the dictionary to a JSON string
-    json_content = json.dumps(llm_json_response, indent=4)
-    # Save the JSON string to S3 (S3 expects bytes, so we encode the string to bytes)
-    s3_client.put_object(Bucket=bucket, Key=key, Body=json_content.encode('utf-8'))
-
-def list_s3_items(bucket_name, prefix):
-    items = []
-    paginator = s3_client.get_paginator('list_objects_v2')
-    
-    # The S3 API returns results in pages, so we use a paginator
-    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
-        if 'Contents' in page:
-            for obj in page['Contents']:
-                key = obj['Key']
-                # Only include the key if it's not the prefix itself and it's not empty
-                if key != prefix and key.strip():
-                    full_uri = f"s3://{bucket_name}/{key}"
-                    items.append(full_uri)
-    
-    return items
-
-def get_parameter_from_ssm(param_name):
-    response = ssm.get_parameter(
-            Name=param_name,
-            WithDecryption=True
-        )
-    param_value = response['Parameter']['Value']
-    return param_value
\ No newline at end of file
+    boxes = flatten_annotations(json_data) if doc_type == "invoices" else []
+
+    if key.lower().endswith(".pdf"):
+        return annotate_pdf_pages(bucket_name, key, group_boxes_by_page(boxes), op_bucket, op_key, output_mode)
+
+    # Images are single page documents
+    image = draw_annotated_image(load_image_from_s3(bucket_name, key), boxes)
+    upload_annotated_image(image, op_bucket, op_key)
+    return [op_key]
+
+def record_document_timings(job, completed_at_ms, started_at_ms):
+    # Stage timings of the document, the queue wait and rasterize timings are recorded by process_invoices_bda.
+    # Without the job record (job tracking disabled, or a late duplicate event) only the post-processing is known
+    now_ms = get_timestamp_ms()
+    timings = {"PostProcessing": now_ms - started_at_ms}
+    if job and job.get("submitted_at_ms") is not None:
+        timings["BdaProcessing"] = completed_at_ms - int(job["submitted_at_ms"])
+    if job and job.get("uploaded_at_ms") is not None:
+        timings["EndToEnd"] = now_ms - int(job["uploaded_at_ms"])
+    for name, value in timings.items():
+        put_metric(name, value)
+    logger.info("Document timings", document_key=job and job.get("document_key"), post_processing_ms=timings["PostProcessing"],
+                bda_processing_ms=timings.get("BdaProcessing"), end_to_end_ms=timings.get("EndToEnd"))
+    return timings
@@ -3,11 +3,16 @@
 ## Licensed under the Amazon Software License  https://aws.amazon.com/asl/
 import json
 from helper import * 
+from idp_common.dedup import get_dedup_store
+from idp_common.jobs import get_job_store
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 import os
-from urllib.parse import urlparse, unquote_plus
+from urllib.parse import unquote_plus
 
+@instrument_handler
 def lambda_handler(event, context):
-    print(event)
+    logger.log_event(event)
     try:
         input_bucket = event["detail"]["input_s3_object"]["s3_bucket"]
         input_key = event["detail"]["input_s3_object"]["name"]
@@ -15,43 +20,98 @@ def lambda_handler(event, context):
         output_bucket = event["detail"]["output_s3_location"]["s3_bucket"]
         output_key = event["detail"]["output_s3_location"]["name"]
         output_key = unquote_plus(output_key)
+        invocation_id = event["detail"].get("job_id")
+        # The time of the event is when BDA ended the job
+        completed_at_ms = get_timestamp_ms(event.get("time"))
         doc_type = os.getenv("DOC_TYPE", "invoices")
+        annotate_images = os.getenv("ANNOTATE_IMAGES", "true").lower() == "true"
+        annotation_output = os.getenv("ANNOTATION_OUTPUT", "pages")
+        export_queue_url = os.getenv("EXPORT_QUEUE_URL", "")
     except:
-        print("dev mode activated")
+        logger.warning("dev mode activated")
         input_bucket= ""
         input_key = "invoices/test_invoice_0_1.pdf.png"
         output_bucket = ""
         output_key = "raw_bda_job_outputs/ef33d28a-8503-4cfa-9ea7-1b36ac8de7c2/0"
+        invocation_id = None
+        completed_at_ms = get_timestamp_ms()
         doc_type = "invoices"
-
-    output_json_key = f"{input_key}.json"
-    output_inference_results_json_key = f"bda_json/inference_results/{output_json_key}"
-    output_explainability_info_result_json_key = f"bda_json/explainability_info_result/{output_json_key}"
-    output_bbox_image_key = f"bda_bbox_img/{output_json_key.removesuffix('.json')}.png"
+        annotate_images = True
+        annotation_output = "pages"
+        export_queue_url = ""
 
     input_s3_uri = f"s3://{input_bucket}/{input_key}"
-    
-    s3_uri = f"s3://{output_bucket}/{output_key}"
-    job_metadata_s3_uri = s3_uri.split("/")[:-1]
-    job_metadata_s3_uri = "/".join(job_metadata_s3_uri)
-    job_metadata_s3_uri = job_metadata_s3_uri + "/job_metadata.json"
-    #Get the Custom blueprint output
-    custom_output_s3_uri = get_custom_output_path(job_metadata_s3_uri)
-
-    # Read the json results from output S3 json files
-    custom_op_json = read_json_content_from_s3(custom_output_s3_uri)
-    inference_results = custom_op_json["inference_result"]
-    explainability_info_result = custom_op_json['explainability_info'][0]
-    
-    # Save the inference results in s3 output bucket
-    save_json_to_s3(output_bucket, output_inference_results_json_key, inference_results)
-    
-    # Save the bounding boxes and all in outuut bucket
-    save_json_to_s3(output_bucket, output_explainability_info_result_json_key, explainability_info_result)
-    
-    # Annotate and save image in output S3 bucket
-    annotate_form_and_save_to_s3(input_s3_uri, explainability_info_result, output_bucket, output_bbox_image_key, doc_type=doc_type)
-        
+    # process_invoices_bda named the output prefix of the job after the correlation id of the document
+    correlation_id = get_correlation_id(output_key)
+    started_at_ms = get_timestamp_ms()
+
+    # Everything below is timed into the metrics record of the document, and logged with its correlation id
+    with document_metrics(input_key, doc_type), bind_log_context(correlation_id=correlation_id):
+        set_document_properties(correlation_id=correlation_id)
+        # job_metadata.json sits next to the output folder of the job
+        s3_uri = f"s3://{output_bucket}/{output_key}"
+        job_metadata_s3_uri = s3_uri.split("/")[:-1]
+        job_metadata_s3_uri = "/".join(job_metadata_s3_uri)
+        job_metadata_s3_uri = job_metadata_s3_uri + "/job_metadata.json"
+        # Get the custom blueprint outputs of all the documents and segments of the job
+        custom_outputs = resolve_job_outputs(job_metadata_s3_uri, invocation_id)
+
+        # The JSON results and the annotations do not depend on each other, they are written concurrently.
+        # The annotation is submitted first as it takes the longest (download, render, draw and upload)
+        output_keys = []
+        export_messages = []
+        with ThreadPoolExecutor(max_workers=s3_max_concurrency) as executor:
+            futures = []
+            for segment_index, custom_op_json in enumerate(custom_outputs):
+                # A job with a single result keeps the original keys, others get one set of keys per segment
+                output_json_key = f"{input_key}.json" if len(custom_outputs) == 1 else f"{input_key}.segment{segment_index + 1}.json"
+                output_inference_results_json_key = f"bda_json/inference_results/{output_json_key}"
+                output_explainability_info_result_json_key = f"bda_json/explainability_info_result/{output_json_key}"
+                output_bbox_image_key = f"bda_bbox_img/{output_json_key.removesuffix('.json')}.{get_image_extension(annotation_render_config)}"
+
+                inference_results = custom_op_json["inference_result"]
+                explainability_info_result = custom_op_json['explainability_info'][0]
+
+                # Annotate and save image in output S3 bucket
+                if annotate_images:
+                    futures.append(submit_in_context(executor, annotate_form_and_save_to_s3, input_s3_uri,
+                                                     explainability_info_result, output_bucket, output_bbox_image_key,
+                                                     doc_type=doc_type, output_mode=annotation_output))
+
+                # Save the inference results in s3 output bucket
+                futures.append(submit_in_context(executor, save_json_to_s3, output_bucket,
+                                                 output_inference_results_json_key, inference_results))
+
+                # Save the bounding boxes and all in outuut bucket
+                futures.append(submit_in_context(executor, save_json_to_s3, output_bucket,
+                                                 output_explainability_info_result_json_key, explainability_info_result))
+                output_keys.extend([output_inference_results_json_key, output_explainability_info_result_json_key])
+                export_messages.append({"bucket": output_bucket, "key": output_inference_results_json_key,
+                                        "document_key": output_json_key.removesuffix(".json"),
+                                        "completed_at": datetime.now(timezone.utc).isoformat()})
+
+            # result() re-raises the first failed write, so the event is retried
+            for future in futures:
+                output_keys.extend(future.result() or [])
+
+        # The analytics export reads the inference results once they are all written
+        if export_queue_url:
+            send_messages_to_sqs(export_queue_url, export_messages)
+
+        # Record the curated results, so re-uploads of the same content reuse them instead of running BDA again
+        dedup_store = get_dedup_store()
+        if dedup_store:
+            dedup_store.record_job_outputs(input_s3_uri, output_keys)
+
+        # The job ended, the poller no longer checks it. Its record holds when the document was uploaded and submitted.
+        # When the poller recorded the end first, the record is read as it is
+        job_store = get_job_store()
+        job = None
+        if job_store and invocation_id:
+            job = job_store.record_status(invocation_id, "Success", job_metadata_s3_uri) \
+                or job_store.get_jobs([invocation_id]).get(invocation_id)
+        record_document_timings(job, completed_at_ms, started_at_ms)
+
     return {'statusCode': 200,
             'body': json.dumps({
                         'event': event
@@ -0,0 +1,195 @@
+## Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+## Licensed under the Amazon Software License  https://aws.amazon.com/asl/
+import hashlib
+import json
+import os
+import re
+from io import BytesIO
+import pyarrow as pa
+import pyarrow.parquet as pq
+from idp_common.clients import *
+from idp_common.ssm import *
+from idp_common.s3 import *
+from idp_common.bda import *
+from idp_common.metrics import *
+from idp_common.logger import get_logger
+
+logger = get_logger("export_invoices_parquet")
+
+
+# JSON schema types of the blueprint fields and the Parquet column types they are written as
+ARROW_TYPES = {
+    "string": pa.string(),
+    "number": pa.float64(),
+    "integer": pa.int64(),
+    "boolean": pa.bool_(),
+}
+
+def get_export_schema(ssm_param_name, blueprint_version=None):
+    # BLUEPRINT_SCHEMA_FILE reads the schema from a local file, e.g. invoices_blueprint.json in dev mode
+    schema_file = os.getenv("BLUEPRINT_SCHEMA_FILE")
+    if schema_file:
+        with open(schema_file, 'r') as file:
+            return json.load(file)
+    return get_blueprint_schema(get_parameter_from_ssm(ssm_param_name, blueprint_version))
+
+def get_column_name(field_name):
+    # "unit price" -> "unit_price"
+    return re.sub(r"[^0-9a-zA-Z]+", "_", field_name).strip("_").lower()
+
+def resolve_ref(blueprint_schema, field_schema):
+    if "$ref" in field_schema:
+        return blueprint_schema.get("definitions", {})[field_schema["$ref"].rsplit("/", 1)[-1]]
+    return field_schema
+
+def get_columns(blueprint_schema, properties, prefix=()):
+    # Flattens the blueprint properties into (field path, column name, json type, is list) tuples.
+    # Nested objects become prefixed columns, arrays of scalars become list columns
+    columns = []
+    for field_name, field_schema in properties.items():
+        field_schema = resolve_ref(blueprint_schema, field_schema)
+        path = prefix + (field_name,)
+        if field_schema.get("type") == "object":
+            columns.extend(get_columns(blueprint_schema, field_schema.get("properties", {}), path))
+        elif field_schema.get("type") == "array":
+            item_schema = resolve_ref(blueprint_schema, field_schema.get("items", {}))
+            columns.append((path, get_column_name("_".join(path)), item_schema.get("type", "string"), True))
+        else:
+            columns.append((path, get_column_name("_".join(path)), field_schema.get("type", "string"), False))
+    return columns
+
+def get_table_schemas(blueprint_schema, doc_type):
+    # The header table has one row per document. Every array of objects (e.g. SERVICES_TABLE or a LINEITEM
+    # list) becomes a child table with one row per item, joined to the header on document_key
+    header_properties = {}
+    child_tables = []
+    for field_name, field_schema in blueprint_schema.get("properties", {}).items():
+        field_schema = resolve_ref(blueprint_schema, field_schema)
+        item_schema = resolve_ref(blueprint_schema, field_schema.get("items", {}))
+        if field_schema.get("type") == "array" and item_schema.get("type") == "object":
+            child_tables.append({
+                "name": f"{doc_type}_{get_column_name(field_name)}",
+                "field": field_name,
+                "columns": get_columns(blueprint_schema, item_schema.get("properties", {})),
+            })
+        else:
+            header_properties[field_name] = field_schema
+    header_table = {"name": doc_type, "field": None, "columns": get_columns(blueprint_schema, header_properties)}
+    return header_table, child_tables
+
+def get_arrow_schema(table, child=False):
+    fields = [pa.field("document_key", pa.string())]
+    if child:
+        fields.append(pa.field("line_number", pa.int32()))
+    for _, column_name, json_type, is_list in table["columns"]:
+        arrow_type = ARROW_TYPES.get(json_type, pa.string())
+        fields.append(pa.field(column_name, pa.list_(arrow_type) if is_list else arrow_type))
+    fields.append(pa.field("exported_at", pa.timestamp("ms", tz="UTC")))
+    return pa.schema(fields)
+
+def coerce_value(value, json_type):
+    # BDA returns extracted values as they are printed, e.g. "$1,234.50", values that cannot be read are null
+    if value is None or value == "":
+        return None
+    try:
+        if json_type in ("number", "integer"):
+            if isinstance(value, str):
+                value = re.sub(r"[^0-9.\-]", "", value)
+            return int(float(value)) if json_type == "integer" else float(value)
+        if json_type == "boolean":
+            return value.strip().lower() in ("true", "yes", "1") if isinstance(value, str) else bool(value)
+        return value if isinstance(value, str) else json.dumps(value)
+    except (TypeError, ValueError):
+        return None
+
+def get_field_value(data, path):
+    for field_name in path:
+        if not isinstance(data, dict):
+            return None
+        data = data.get(field_name)
+    return data
+
+def get_row(data, columns):
+    row = {}
+    for path, column_name, json_type, is_list in columns:
+        value = get_field_value(data, path)
+        if is_list:
+            value = value if isinstance(value, list) else ([] if value is None else [value])
+            row[column_name] = [coerce_value(item, json_type) for item in value]
+        else:
+            row[column_name] = coerce_value(value, json_type)
+    return row
+
+def flatten_inference_result(inference_result, header_table, child_tables, document_key, exported_at):
+    # Returns the header row and the rows of every child table
+    header_row = {"document_key": document_key, **get_row(inference_result, header_table["columns"]),
+                  "exported_at": exported_at}
+    child_rows = {}
+    for child_table in child_tables:
+        items = inference_result.get(child_table["field"]) or []
+        child_rows[child_table["name"]] = [
+            {"document_key": document_key, "line_number": line_number, **get_row(item, child_table["columns"]),
+             "exported_at": exported_at}
+            for line_number, item in enumerate(items, start=1) if isinstance(item, dict)
+        ]
+    return header_row, child_rows
+
+def get_partition_value(value):
+    # Hive style partition values, e.g. "ACME Corp." -> "acme_corp"
+    value = re.sub(r"[^0-9a-zA-Z]+", "_", str(value or "")).strip("_").lower()[:64]
+    return value or "unknown"
+
+def estimate_row_size(row):
+    return sum(len(str(value)) + 8 for value in row.values())
+
+class PartitionedParquetWriter:
+    """Buffers rows per table and partition and writes them as Parquet files of at most about max_file_bytes.
+
+    Files are written under <prefix>/<table>/ingest_date=<date>[/vendor=<vendor>]/part-<hash>-<n>.parquet, the
+    hash is the one of the SQS messages of their rows. A retried batch overwrites the files it already wrote.
+    """
+
+    def __init__(self, bucket, prefix, max_file_bytes):
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.max_file_bytes = max_file_bytes
+        self.buffers = {}
+        self.part_numbers = {}
+        self.written_keys = []
+
+    def add(self, table_name, arrow_schema, partition, row, message_id):
+        # partition is a tuple of (name, value) pairs, e.g. (("ingest_date", "2024-01-31"), ("vendor", "acme"))
+        buffer = self.buffers.setdefault((table_name, partition),
+                                         {"schema": arrow_schema, "rows": [], "size": 0, "message_ids": set()})
+        buffer["rows"].append(row)
+        buffer["size"] += estimate_row_size(row)
+        buffer["message_ids"].add(message_id)
+        if buffer["size"] >= self.max_file_bytes:
+            self.flush(table_name, partition)
+
+    def get_file_key(self, table_name, partition, message_ids):
+        # Named after the messages of its rows and its rank in the partition, so the same messages always
+        # write the same keys
+        part_number = self.part_numbers[(table_name, partition)] = self.part_numbers.get((table_name, partition), 0) + 1
+        messages_hash = hashlib.sha256("\n".join(sorted(message_ids)).encode("utf-8")).hexdigest()[:32]
+        partition_path = "/".join(f"{name}={value}" for name, value in partition)
+        return f"{self.prefix}/{table_name}/{partition_path}/part-{messages_hash}-{part_number:04d}.parquet"
+
+    def flush(self, table_name, partition):
+        buffer = self.buffers.pop((table_name, partition), None)
+        if not buffer or not buffer["rows"]:
+            return
+        key = self.get_file_key(table_name, partition, buffer["message_ids"])
+        table = pa.Table.from_pylist(buffer["rows"], schema=buffer["schema"])
+        with BytesIO() as parquet_buffer:
+            pq.write_table(table, parquet_buffer, compression="zstd")
+            get_client("s3").put_object(Bucket=self.bucket, Key=key, Body=parquet_buffer.getvalue(),
+                                 ContentType="application/vnd.apache.parquet")
+        logger.info("Wrote Parquet file", rows=table.num_rows, s3_uri=f"s3://{self.bucket}/{key}")
+        self.written_keys.append(key)
+
+    def flush_all(self):
+        for table_name, partition in list(self.buffers):
+            self.flush(table_name, partition)
+        return self.written_keys
@@ -0,0 +1,70 @@
+## Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+## Licensed under the Amazon Software License  https://aws.amazon.com/asl/
+import json
+from helper import *
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+def read_message(message_body):
+    # Messages are sent by draw_bboxes_invoices once the curated results of a document are written
+    message = json.loads(message_body)
+    return message, read_json_from_s3(message["bucket"], message["key"])
+
+@instrument_handler
+def lambda_handler(event, context):
+    logger.log_event(event)
+    ## os variables
+    output_bucket = os.getenv("OUTPUT_BUCKET", "")
+    export_prefix = os.getenv("EXPORT_PREFIX", "analytics")
+    max_file_bytes = int(os.getenv("EXPORT_MAX_FILE_MB", "64")) * 1024 * 1024
+    partition_field = os.getenv("EXPORT_PARTITION_FIELD", "")
+    doc_type = os.getenv("DOC_TYPE", "invoices")
+    ssm_param_name = os.getenv("SSM_PARAMETER_NAME", "/my-demo/inovices_blueprint_arn")
+
+    # The tables follow the blueprint, so new fields get a column without changing this function
+    blueprint_schema = get_export_schema(ssm_param_name, os.getenv("BLUEPRINT_VERSION") or None)
+    header_table, child_tables = get_table_schemas(blueprint_schema, doc_type)
+    header_schema = get_arrow_schema(header_table)
+    child_schemas = {child_table["name"]: get_arrow_schema(child_table, child=True) for child_table in child_tables}
+    exported_at = datetime.now(timezone.utc)
+
+    # Results that cannot be read are reported back to SQS, the rest of the batch is written
+    batch_item_failures = []
+    writer = PartitionedParquetWriter(output_bucket, export_prefix, max_file_bytes)
+    with ThreadPoolExecutor(max_workers=max(1, min(s3_max_concurrency, len(event["Records"])))) as executor:
+        futures = {record["messageId"]: executor.submit(read_message, record["body"]) for record in event["Records"]}
+        for message_id, future in futures.items():
+            try:
+                message, inference_result = future.result()
+                header_row, child_rows = flatten_inference_result(inference_result, header_table, child_tables,
+                                                                  message["document_key"], exported_at)
+            except Exception as e:
+                logger.error("Failed to read message", message_id=message_id, error=str(e))
+                batch_item_failures.append({"itemIdentifier": message_id})
+                continue
+            # Rows are partitioned by date, and by vendor when EXPORT_PARTITION_FIELD is set. Every partition is
+            # buffered across the whole batch, more partitions mean smaller files
+            partition = (("ingest_date", message.get("completed_at", exported_at.isoformat())[:10]),)
+            if partition_field:
+                partition += (("vendor", get_partition_value(inference_result.get(partition_field))),)
+            writer.add(header_table["name"], header_schema, partition, header_row, message_id)
+            for table_name, rows in child_rows.items():
+                for row in rows:
+                    writer.add(table_name, child_schemas[table_name], partition, row, message_id)
+
+    # A failed write raises, so the whole batch is retried. The files are named after the messages of their rows,
+    # the retried batch overwrites the ones already written. document_key identifies the rows of a document
+    written_keys = writer.flush_all()
+    logger.info("Exported documents", exported=len(event["Records"]) - len(batch_item_failures),
+                files=len(written_keys), failed=len(batch_item_failures))
+    return {"batchItemFailures": batch_item_failures}
+
+
+if __name__ == "__main__":
+    print("dev mode activated")
+    message = {"bucket": "", "key": "bda_json/inference_results/invoices/test_invoice_0_1.pdf.json",
+               "document_key": "invoices/test_invoice_0_1.pdf"}
+    event = {"Records": [{"messageId": "dev", "body": json.dumps(message)}]}
+    lambda_handler(event, None)
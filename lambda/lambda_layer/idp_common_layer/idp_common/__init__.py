@@ -0,0 +1,17 @@
+## Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+## Licensed under the Amazon Software License  https://aws.amazon.com/asl/
+"""Code shared by the Lambda functions, delivered as the idp-common layer.
+
+    clients        - shared boto3 clients (connection pool, keep-alive, timeouts and retries)
+    ssm            - SSM parameters cached across warm invocations
+    s3             - S3 operations and the encodings of the curated JSON results
+    sqs            - sending messages to the SQS queues of the pipeline
+    pdf            - loading PDFs from S3, rendering and encoding page images
+    bda            - blueprints and Bedrock Data Automation jobs
+    store          - base of the record stores, in process or in DynamoDB
+    dedup          - content hash deduplication records
+    jobs           - BDA job status records
+    metrics        - per stage timings as CloudWatch embedded metrics, sampled profiling
+    logger         - structured JSON logs with levels, event sampling and truncation
+"""
@@ -0,0 +1,155 @@
+## Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+## Licensed under the Amazon Software License  https://aws.amazon.com/asl/
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import hashlib
+import json
+import time
+import uuid
+from idp_common.clients import bda_max_concurrency, get_client
+from idp_common.metrics import timed
+from idp_common.logger import get_logger
+from idp_common.ssm import get_parameter_from_ssm, invalidate_ssm_cache
+
+
+logger = get_logger("idp_common.bda")
+
+# BDA writes the outputs of a job under <output prefix>/<job id>/. Every document gets its own output prefix,
+# named after the correlation id minted by process_input_files, so the completion Lambda can recover it.
+# The raw outputs expire with a lifecycle rule of the output bucket, the curated copies are kept
+RAW_OUTPUT_PREFIX = "raw_bda_job_outputs"
+
+# Blueprint schemas by blueprint ARN, a new blueprint version gets a new ARN in SSM
+blueprint_schema_cache = {}
+
+# read json file from 'blueprints' folder. Json file name is bda_invoices_blueprint.json. this json schmea i need to pass as string to another method.
+def read_json_as_str(file_name):
+    # Read the JSON file
+    with open(file_name, 'r') as file:
+        blueprint_schema = json.load(file)
+        # Convert the JSON to a string
+        schema_string = json.dumps(blueprint_schema)
+    return schema_string
+
+def create_blueprint(blueprint_name, schema_str):
+    response = get_client("bedrock-data-automation").create_blueprint(
+        blueprintName=blueprint_name,
+        type='DOCUMENT',
+        blueprintStage='LIVE',
+        schema=schema_str
+    )
+    return response
+
+def create_blueprint_version(blueprint_arn):
+    response = get_client("bedrock-data-automation").create_blueprint_version(
+        blueprintArn=blueprint_arn
+    )
+    return response
+
+def get_or_create_blueprint(blueprint_name, blueprint_file_name):
+        blueprint_arn = ""
+        all_blueprint_response = get_client("bedrock-data-automation").list_blueprints(blueprintStageFilter='LIVE')
+        for item in all_blueprint_response['blueprints']:
+            if blueprint_name in item['blueprintName']:
+                blueprint_arn = item['blueprintArn']
+                break
+        if blueprint_arn == "":
+            logger.info("Blueprint not found, creating it", blueprint_name=blueprint_name)
+            blueprint_schema = read_json_as_str(blueprint_file_name)
+            blueprint_response = create_blueprint(blueprint_name, blueprint_schema)
+            blueprint_arn = blueprint_response['blueprint']['blueprintArn']
+        return blueprint_arn
+
+def get_blueprint_schema(blueprint_arn):
+    if blueprint_arn not in blueprint_schema_cache:
+        response = get_client("bedrock-data-automation").get_blueprint(blueprintArn=blueprint_arn)
+        blueprint_schema_cache[blueprint_arn] = json.loads(response['blueprint']['schema'])
+    return blueprint_schema_cache[blueprint_arn]
+
+@timed("BdaInvoke")
+def invoke_data_automation(input_s3_uri, output_s3_uri, blueprint_arn):
+    response = get_client("bedrock-data-automation-runtime").invoke_data_automation_async(
+                                inputConfiguration={
+                                    's3Uri': input_s3_uri
+                                },
+                                outputConfiguration={
+                                    's3Uri': output_s3_uri
+                                },
+                                notificationConfiguration={
+                                    'eventBridgeConfiguration': {
+                                        'eventBridgeEnabled': True
+                                    }
+                                },
+                                blueprints=[{'blueprintArn': blueprint_arn},]
+                            )
+    return response
+
+def invoke_data_automation_with_cached_blueprint(input_s3_uri, output_s3_uri, ssm_param_name, blueprint_version=None):
+    blueprint_arn = get_parameter_from_ssm(ssm_param_name, version_tag=blueprint_version)
+    try:
+        return invoke_data_automation(input_s3_uri, output_s3_uri, blueprint_arn)
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in ("ResourceNotFoundException", "ValidationException"):
+            raise
+        # The cached blueprint ARN may be stale (e.g. the blueprint was re-created), read it again and retry once
+        logger.warning("Retrying with a fresh blueprint ARN", error_code=e.response["Error"]["Code"])
+        invalidate_ssm_cache(ssm_param_name)
+        blueprint_arn = get_parameter_from_ssm(ssm_param_name, version_tag=blueprint_version)
+        return invoke_data_automation(input_s3_uri, output_s3_uri, blueprint_arn)
+
+def new_correlation_id(seed=None):
+    # The same seed always gives the same id, e.g. the object of an S3 event, so a redelivered event
+    # queues its documents again under the ids they were first queued with
+    return uuid.uuid5(uuid.NAMESPACE_URL, seed).hex if seed else uuid.uuid4().hex
+
+def get_job_output_prefix(correlation_id, timestamp_ms=None):
+    # raw_bda_job_outputs/<yyyy>/<mm>/<dd>/<shard>/<correlation id>, dated by the upload (or now when unknown).
+    # The shard, two hex digits of a hash of the id, spreads the requests of a day over 256 prefixes
+    day = datetime.fromtimestamp(timestamp_ms / 1000 if timestamp_ms else time.time(), timezone.utc).strftime("%Y/%m/%d")
+    shard = hashlib.sha256(correlation_id.encode("utf-8")).hexdigest()[:2]
+    return f"{RAW_OUTPUT_PREFIX}/{day}/{shard}/{correlation_id}"
+
+def get_correlation_id(job_output_key):
+    # job_output_key is the output_s3_location of the completion event, <output prefix>/<job id>/<asset>, the
+    # correlation id is the last part of the output prefix. Returns None for the jobs submitted to the shared
+    # raw_bda_job_outputs prefix
+    parts = job_output_key.split("/")
+    if len(parts) >= 4 and parts[0] == RAW_OUTPUT_PREFIX:
+        return parts[-3]
+    return None
+
+@timed("BdaStatus")
+def get_data_automation_status(invocation_arn):
+    # A single status check, returns the status and the job_metadata.json URI once the job ended
+    job_status_response = get_client("bedrock-data-automation-runtime").get_data_automation_status(
+        invocationArn=invocation_arn
+    )
+    job_metadata_s3_uri = job_status_response.get('outputConfiguration', {}).get('s3Uri', "")
+    return job_status_response['status'], job_metadata_s3_uri
+
+def get_data_automation_statuses(invocation_arns, max_workers=None):
+    # Checks many jobs at once without waiting for any of them, returns {invocation_arn: (status, job_metadata_s3_uri)}.
+    # A failed check is returned as (None, error message), so one throttled job does not fail the others
+    statuses = {}
+    if not invocation_arns:
+        return statuses
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers or bda_max_concurrency, len(invocation_arns)))) as executor:
+        futures = {invocation_arn: executor.submit(get_data_automation_status, invocation_arn)
+                   for invocation_arn in invocation_arns}
+        for invocation_arn, future in futures.items():
+            try:
+                statuses[invocation_arn] = future.result()
+            except ClientError as e:
+                statuses[invocation_arn] = (None, str(e))
+    return statuses
+
+def get_custom_output_paths(job_metadata):
+    # Every document (asset) of a job can have several segments, each one with its own custom output
+    custom_output_paths = []
+    for output_metadata in job_metadata.get('output_metadata', []):
+        for segment_metadata in output_metadata.get('segment_metadata', []):
+            if segment_metadata.get('custom_output_path'):
+                custom_output_paths.append(segment_metadata['custom_output_path'])
+    return custom_output_paths
@@ -0,0 +1,49 @@
+## Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+## Licensed under the Amazon Software License  https://aws.amazon.com/asl/
+import boto3
+from botocore.config import Config
+import os
+import threading
+
+
+# Documents of a batch and the outputs of a result are processed by worker threads, every client keeps
+# a connection per worker (BDA_MAX_CONCURRENCY / S3_MAX_CONCURRENCY of the function) and keeps them alive
+bda_max_concurrency = int(os.getenv("BDA_MAX_CONCURRENCY", "5"))
+s3_max_concurrency = int(os.getenv("S3_MAX_CONCURRENCY", "8"))
+max_pool_connections = max(bda_max_concurrency, s3_max_concurrency, 10)
+
+# Throttling is absorbed by botocore's adaptive retry mode (client side rate limiting shared by all threads)
+default_config = Config(
+    max_pool_connections=max_pool_connections,
+    tcp_keepalive=True,
+    connect_timeout=10,
+    read_timeout=60,
+    retries={"max_attempts": 5, "mode": "adaptive"},
+)
+#increase the standard time out limits in boto3, because Bedrock may take a while to respond to large requests.
+# The read timeout stays below the timeout of the functions, so a stalled call is retried in time
+bedrock_config = default_config.merge(Config(
+    read_timeout=120,
+    retries={"max_attempts": 10, "mode": "adaptive"},
+))
+
+client_configs = {
+    "bedrock-data-automation": bedrock_config,
+    "bedrock-data-automation-runtime": bedrock_config,
+}
+# DYNAMODB_ENDPOINT_URL points the DynamoDB client to DynamoDB Local
+endpoint_urls = {
+    "dynamodb": os.getenv("DYNAMODB_ENDPOINT_URL") or None,
+}
+clients = {}
+clients_lock = threading.Lock()
+
+def get_client(service_name):
+    # Clients are created on first use, so a cold start only pays for the clients its code path needs.
+    # Creating clients is not thread safe, the lock also covers the worker threads of a batch
+    with clients_lock:
+        if service_name not in clients:
+            clients[service_name] = boto3.client(service_name, config=client_configs.get(service_name, default_config),
+                                                 endpoint_url=endpoint_urls.get(service_name))
+        return clients[service_name]
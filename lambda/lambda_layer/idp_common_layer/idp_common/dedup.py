@@ -0,0 +1,158 @@
+## Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+## Licensed under the Amazon Software License  https://aws.amazon.com/asl/
+import hashlib
+import json
+import time
+from idp_common.store import DynamoDBStore, InMemoryStore, get_store
+
+# Deduplication records are keyed by "<content hash>#<blueprint version>#<settings hash>" and hold:
+#   source_key      - input key of the document that was sent to BDA
+#   owner           - message that claimed the record, its retries take the record back, see claim
+#   submitted_inputs - BDA inputs already submitted, a retried message does not submit them again
+#   expected_jobs   - number of BDA jobs started for the document (one per BDA input)
+#   completed_jobs  - number of BDA jobs whose curated results are written
+#   completed_inputs - BDA inputs of those jobs, a job is only counted once when its completion is delivered again
+#   outputs         - curated keys in the output bucket, all of them contain source_key
+# A second kind of record, keyed by "job#<BDA input s3 uri>", points back to the deduplication key
+# so that draw_bboxes_invoices can record the outputs of a finished job.
+JOB_KEY_PREFIX = "job#"
+
+
+class DuplicateInProgress(Exception):
+    """Raised when the same content is still being processed, its message is retried once the results are written."""
+
+
+def get_dedup_key(content_hash, blueprint_version, input_settings=None):
+    # input_settings are the settings that shape the BDA input (page range, passthrough, rendering), part of the
+    # key as a short hash, so changing them does not reuse the results of a different input
+    if not input_settings:
+        return f"{content_hash}#{blueprint_version}"
+    settings_hash = hashlib.sha256(json.dumps(input_settings, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+    return f"{content_hash}#{blueprint_version}#{settings_hash}"
+
+
+def is_complete(record):
+    return bool(record) and record.get("expected_jobs") is not None \
+        and int(record.get("completed_jobs", 0)) >= int(record["expected_jobs"])
+
+
+def get_copied_output_keys(record, key):
+    # Map the curated keys of the original document to the keys of the re-uploaded one
+    return [(output_key, output_key.replace(record["source_key"], key, 1)) for output_key in record.get("outputs", [])]
+
+
+class InMemoryDedupStore(InMemoryStore):
+    """Deduplication records kept in process."""
+
+    def claim(self, dedup_key, source_key, stale_after_seconds, owner=None):
+        # Returns the record when the caller owns it and must run BDA, None otherwise. The owner of an unfinished
+        # record (e.g. its retried message) gets it back as it is, with the inputs it already submitted
+        now = int(time.time())
+        with self.lock:
+            item = self.items.get(dedup_key)
+            if item and owner is not None and item.get("owner") == owner and not is_complete(item):
+                return dict(item)
+            if item and (is_complete(item) or now - item["created_at"] < stale_after_seconds):
+                return None
+            item = self.items[dedup_key] = {"pk": dedup_key, "source_key": source_key, "owner": owner,
+                                            "created_at": now, "completed_jobs": 0, "outputs": []}
+            return dict(item)
+
+    def release(self, dedup_key):
+        # Returns False when jobs were already submitted, the record is kept so they are not submitted again
+        with self.lock:
+            if self.items.get(dedup_key, {}).get("submitted_inputs"):
+                return False
+            self.items.pop(dedup_key, None)
+            return True
+
+    def record_submitted_input(self, dedup_key, bda_input_s3_uri):
+        with self.lock:
+            if dedup_key in self.items:
+                self.items[dedup_key].setdefault("submitted_inputs", set()).add(bda_input_s3_uri)
+
+    def set_expected_jobs(self, dedup_key, bda_input_s3_uris):
+        with self.lock:
+            for bda_input_s3_uri in bda_input_s3_uris:
+                self.items[JOB_KEY_PREFIX + bda_input_s3_uri] = {"pk": JOB_KEY_PREFIX + bda_input_s3_uri,
+                                                                 "dedup_key": dedup_key}
+            if dedup_key in self.items:
+                self.items[dedup_key]["expected_jobs"] = len(bda_input_s3_uris)
+
+    def record_job_outputs(self, bda_input_s3_uri, output_keys):
+        with self.lock:
+            job = self.items.get(JOB_KEY_PREFIX + bda_input_s3_uri)
+            if not job or job["dedup_key"] not in self.items:
+                return None
+            item = self.items[job["dedup_key"]]
+            if bda_input_s3_uri in item.setdefault("completed_inputs", set()):
+                return None
+            item["completed_inputs"].add(bda_input_s3_uri)
+            item["completed_jobs"] += 1
+            item["outputs"] = sorted(set(item["outputs"]) | set(output_keys))
+            return dict(item)
+
+
+class DynamoDBDedupStore(DynamoDBStore):
+    """Deduplication records in DynamoDB."""
+
+    def get(self, pk):
+        item = super().get(pk)
+        if item and "outputs" in item:
+            item["outputs"] = sorted(item["outputs"])
+        return item
+
+    def claim(self, dedup_key, source_key, stale_after_seconds, owner=None):
+        now = int(time.time())
+        item = {"pk": dedup_key, "source_key": source_key, "created_at": now, "completed_jobs": 0,
+                "expires_at": now + self.retention_seconds}
+        if owner is not None:
+            item["owner"] = owner
+        # An incomplete record older than stale_after_seconds belongs to a job that never finished
+        if self.put(item,
+                    condition_expression="attribute_not_exists(pk) OR "
+                                         "(attribute_not_exists(expected_jobs) AND created_at < :stale) OR "
+                                         "(expected_jobs > completed_jobs AND created_at < :stale)",
+                    expression_values={":stale": now - stale_after_seconds}):
+            return item
+        record = self.get(dedup_key)
+        if record and owner is not None and record.get("owner") == owner and not is_complete(record):
+            return record
+        return None
+
+    def release(self, dedup_key):
+        return self.delete(dedup_key, condition_expression="attribute_not_exists(submitted_inputs)")
+
+    def record_submitted_input(self, dedup_key, bda_input_s3_uri):
+        self.update(dedup_key, "ADD submitted_inputs :submitted_inputs", {":submitted_inputs": {bda_input_s3_uri}},
+                    condition_expression="attribute_exists(pk)")
+
+    def set_expected_jobs(self, dedup_key, bda_input_s3_uris):
+        expires_at = int(time.time()) + self.retention_seconds
+        self.put_many([{"pk": JOB_KEY_PREFIX + bda_input_s3_uri, "dedup_key": dedup_key, "expires_at": expires_at}
+                       for bda_input_s3_uri in bda_input_s3_uris])
+        self.update(dedup_key, "SET expected_jobs = :expected_jobs", {":expected_jobs": len(bda_input_s3_uris)})
+
+    def record_job_outputs(self, bda_input_s3_uri, output_keys):
+        job = self.get(JOB_KEY_PREFIX + bda_input_s3_uri)
+        if not job:
+            return None
+        update_expression = "ADD completed_jobs :one, completed_inputs :completed_inputs"
+        expression_values = {":one": 1, ":completed_inputs": {bda_input_s3_uri}, ":bda_input_s3_uri": bda_input_s3_uri}
+        if output_keys:
+            update_expression += ", outputs :outputs"
+            expression_values[":outputs"] = set(output_keys)
+        # None when the record was released because the submission failed, or when the job was already recorded
+        # (e.g. a completion event delivered twice), nothing to record
+        item = self.update(job["dedup_key"], update_expression, expression_values,
+                           condition_expression="attribute_exists(pk) AND NOT contains(completed_inputs, :bda_input_s3_uri)",
+                           return_values="ALL_NEW")
+        if item and "outputs" in item:
+            item["outputs"] = sorted(item["outputs"])
+        return item
+
+
+def get_dedup_store():
+    # DEDUP_TABLE_NAME set to "memory" keeps the records in process, an empty value disables deduplication
+    return get_store("DEDUP_TABLE_NAME", InMemoryDedupStore, DynamoDBDedupStore, "DEDUP_RETENTION_DAYS")
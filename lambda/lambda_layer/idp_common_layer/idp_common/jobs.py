@@ -0,0 +1,242 @@
+## Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+## Licensed under the Amazon Software License  https://aws.amazon.com/asl/
+import random
+import time
+from idp_common.store import DynamoDBStore, InMemoryStore, get_store
+
+# Job records are keyed by the job id (the last part of the BDA invocationArn, the job_id of the completion
+# event) and hold:
+#   invocation_arn  - invocationArn returned by invoke_data_automation_async
+#   input_s3_uri    - BDA input of the job (the document or one of its staged pages)
+#   document_key    - input key of the document
+#   correlation_id  - id of the document from its upload to its curated outputs, see idp_common.bda
+#   uploaded_at_ms, submitted_at_ms - when the document was uploaded and the job submitted, for the stage timings
+#   job_status      - Created, InProgress, Success, ServiceError or ClientError, as in get_data_automation_status
+#   job_metadata_s3_uri - set once the job ended
+#   next_poll_at    - when the poller may check the job, only set while the job is pending
+#   poll_attempts   - status checks made by the poller so far
+# The item keyed by IN_FLIGHT_KEY counts the jobs submitted and not ended yet (in_flight), process_invoices_bda
+# only submits while it is under the concurrent job quota of the account. Its updated_at is set on every change
+PENDING_JOB_STATUSES = ("Created", "InProgress")
+TERMINAL_JOB_STATUSES = ("Success", "ServiceError", "ClientError")
+IN_FLIGHT_KEY = "counter#in_flight"
+
+
+class AdmissionDeferred(Exception):
+    """Raised when a document cannot be submitted to BDA yet, its message is retried later."""
+
+
+def get_job_id(invocation_arn):
+    # arn:aws:bedrock:<region>:<account>:data-automation-invocation/<job id>
+    return invocation_arn.rsplit("/", 1)[-1]
+
+
+def get_timing_attributes(correlation_id=None, uploaded_at_ms=None):
+    # Read back by draw_bboxes_invoices for the BDA processing and end to end timings of the document
+    attributes = {"submitted_at_ms": int(time.time() * 1000)}
+    if correlation_id:
+        attributes["correlation_id"] = correlation_id
+    if uploaded_at_ms is not None:
+        attributes["uploaded_at_ms"] = int(uploaded_at_ms)
+    return attributes
+
+
+def get_poll_delay(poll_attempts, base_delay_seconds, max_delay_seconds):
+    # Exponential backoff with full jitter, so jobs submitted together are not all checked together
+    return random.uniform(0, min(max_delay_seconds, base_delay_seconds * 2 ** poll_attempts))
+
+
+class InMemoryJobStore(InMemoryStore):
+    """BDA job records kept in process."""
+
+    def record_submitted(self, invocation_arn, input_s3_uri, document_key, first_poll_after_seconds,
+                         correlation_id=None, uploaded_at_ms=None):
+        now = int(time.time())
+        with self.lock:
+            self.items[get_job_id(invocation_arn)] = {
+                "pk": get_job_id(invocation_arn), "invocation_arn": invocation_arn, "input_s3_uri": input_s3_uri,
+                "document_key": document_key, "job_status": "Created", "submitted_at": now, "updated_at": now,
+                "next_poll_at": now + first_poll_after_seconds, "poll_attempts": 0,
+                **get_timing_attributes(correlation_id, uploaded_at_ms)}
+
+    def record_status(self, job_id, job_status, job_metadata_s3_uri=None, next_poll_at=None):
+        # Returns the record as it was before the update, None when the job already ended:
+        # a late status never overwrites the final one
+        with self.lock:
+            item = self.items.get(job_id)
+            if item is None:
+                item = self.items[job_id] = {"pk": job_id, "poll_attempts": 0}
+            elif item.get("job_status") in TERMINAL_JOB_STATUSES:
+                return None
+            elif job_status in TERMINAL_JOB_STATUSES:
+                # The job held an admission slot since it was submitted
+                self.set_in_flight(max(0, self.get_in_flight() - 1))
+            previous_item = dict(item)
+            item.update(job_status=job_status, updated_at=int(time.time()))
+            if job_metadata_s3_uri:
+                item["job_metadata_s3_uri"] = job_metadata_s3_uri
+            if job_status in TERMINAL_JOB_STATUSES:
+                item.pop("next_poll_at", None)
+            elif next_poll_at is not None:
+                item["next_poll_at"] = next_poll_at
+                item["poll_attempts"] += 1
+            return previous_item
+
+    def reschedule(self, job_id, next_poll_at):
+        # Moves the next check of a pending job without counting a poll attempt, e.g. after a failed check
+        with self.lock:
+            item = self.items.get(job_id)
+            if item and item.get("job_status") in PENDING_JOB_STATUSES:
+                item["next_poll_at"] = next_poll_at
+
+    def get_jobs(self, job_ids):
+        with self.lock:
+            return {job_id: dict(self.items[job_id]) for job_id in job_ids if job_id in self.items}
+
+    def list_due_jobs(self, limit):
+        now = int(time.time())
+        with self.lock:
+            due_jobs = [dict(item) for item in self.items.values()
+                        if item.get("job_status") in PENDING_JOB_STATUSES and item.get("next_poll_at", now + 1) <= now]
+        return sorted(due_jobs, key=lambda item: item["next_poll_at"])[:limit]
+
+    def get_in_flight(self):
+        return self.items.setdefault(IN_FLIGHT_KEY, {"pk": IN_FLIGHT_KEY, "in_flight": 0})["in_flight"]
+
+    def set_in_flight(self, in_flight):
+        self.items[IN_FLIGHT_KEY] = {"pk": IN_FLIGHT_KEY, "in_flight": in_flight, "updated_at": int(time.time())}
+
+    def acquire_job_slots(self, n_jobs, max_in_flight):
+        # Returns True when the jobs may be submitted. A document is admitted while the count is under
+        # max_in_flight, so a document with more pages than the quota is not blocked forever
+        with self.lock:
+            if self.get_in_flight() >= max_in_flight:
+                return False
+            self.set_in_flight(self.get_in_flight() + n_jobs)
+            return True
+
+    def release_job_slots(self, n_jobs):
+        with self.lock:
+            self.set_in_flight(max(0, self.get_in_flight() - n_jobs))
+
+    def reconcile_in_flight(self, unchanged_for_seconds=900):
+        # See DynamoDBJobStore.reconcile_in_flight
+        with self.lock:
+            seen = self.get_in_flight()
+            if int(time.time()) - self.items[IN_FLIGHT_KEY].get("updated_at", 0) < unchanged_for_seconds:
+                return seen
+            pending = sum(item.get("job_status") in PENDING_JOB_STATUSES for item in self.items.values())
+            if pending != seen:
+                self.set_in_flight(pending)
+            return pending
+
+
+class DynamoDBJobStore(DynamoDBStore):
+    """BDA job records in DynamoDB."""
+
+    # Global secondary index on job_status and next_poll_at, used by the poller to find the due jobs
+    due_jobs_index = "job_status-next_poll_at-index"
+
+    def record_submitted(self, invocation_arn, input_s3_uri, document_key, first_poll_after_seconds,
+                         correlation_id=None, uploaded_at_ms=None):
+        now = int(time.time())
+        self.put({
+            "pk": get_job_id(invocation_arn), "invocation_arn": invocation_arn, "input_s3_uri": input_s3_uri,
+            "document_key": document_key, "job_status": "Created", "submitted_at": now, "updated_at": now,
+            "next_poll_at": now + first_poll_after_seconds, "poll_attempts": 0,
+            "expires_at": now + self.retention_seconds, **get_timing_attributes(correlation_id, uploaded_at_ms)})
+
+    def record_status(self, job_id, job_status, job_metadata_s3_uri=None, next_poll_at=None):
+        # Returns the record as it was before the update, None when the job already ended:
+        # a late status never overwrites the final one
+        now = int(time.time())
+        update_expression = "SET job_status = :job_status, updated_at = :now, expires_at = :expires_at"
+        expression_values = {":job_status": job_status, ":now": now, ":expires_at": now + self.retention_seconds,
+                             ":success": "Success", ":service_error": "ServiceError", ":client_error": "ClientError"}
+        if job_metadata_s3_uri:
+            update_expression += ", job_metadata_s3_uri = :job_metadata_s3_uri"
+            expression_values[":job_metadata_s3_uri"] = job_metadata_s3_uri
+        if job_status not in TERMINAL_JOB_STATUSES and next_poll_at is not None:
+            update_expression += ", next_poll_at = :next_poll_at ADD poll_attempts :one"
+            expression_values.update({":next_poll_at": next_poll_at, ":one": 1})
+        elif job_status in TERMINAL_JOB_STATUSES:
+            # Jobs without next_poll_at are not in the index, so the poller only reads pending jobs
+            update_expression += " REMOVE next_poll_at"
+        previous_item = self.update(job_id, update_expression, expression_values,
+                                    condition_expression="attribute_not_exists(job_status) OR "
+                                                         "NOT job_status IN (:success, :service_error, :client_error)",
+                                    return_values="ALL_OLD")
+        if previous_item is None:
+            return None
+        previous_item = previous_item or {"pk": job_id}
+        # The job held an admission slot since it was submitted, the condition makes sure it is released once
+        if job_status in TERMINAL_JOB_STATUSES and previous_item.get("job_status") in PENDING_JOB_STATUSES:
+            self.release_job_slots(1)
+        return previous_item
+
+    def reschedule(self, job_id, next_poll_at):
+        # Moves the next check of a pending job without counting a poll attempt, e.g. after a failed check
+        self.update(job_id, "SET next_poll_at = :next_poll_at",
+                    {":next_poll_at": next_poll_at, ":created": "Created", ":in_progress": "InProgress"},
+                    condition_expression="job_status IN (:created, :in_progress)")
+
+    def get_jobs(self, job_ids):
+        return self.get_many(job_ids)
+
+    def list_due_jobs(self, limit):
+        now = int(time.time())
+        due_jobs = []
+        for job_status in PENDING_JOB_STATUSES:
+            for items in self.query(self.due_jobs_index, "job_status = :job_status AND next_poll_at <= :now",
+                                    {":job_status": job_status, ":now": now}, limit=limit):
+                due_jobs.extend(items)
+                if len(due_jobs) >= limit:
+                    break
+        return sorted(due_jobs, key=lambda item: item["next_poll_at"])[:limit]
+
+    def acquire_job_slots(self, n_jobs, max_in_flight):
+        # Returns True when the jobs may be submitted. A document is admitted while the count is under
+        # max_in_flight, so a document with more pages than the quota is not blocked forever
+        return self.update(IN_FLIGHT_KEY, "ADD in_flight :n_jobs SET updated_at = :now",
+                           {":n_jobs": n_jobs, ":max_in_flight": max_in_flight, ":now": int(time.time())},
+                           condition_expression="attribute_not_exists(in_flight) OR in_flight < :max_in_flight") is not None
+
+    def release_job_slots(self, n_jobs):
+        # The condition fails when the count was already reset by reconcile_in_flight
+        self.update(IN_FLIGHT_KEY, "ADD in_flight :minus_n_jobs SET updated_at = :now",
+                    {":minus_n_jobs": -n_jobs, ":n_jobs": n_jobs, ":now": int(time.time())},
+                    condition_expression="in_flight >= :n_jobs")
+
+    def reconcile_in_flight(self, unchanged_for_seconds=900):
+        # Resets the count to the pending jobs, so slots lost by failed invocations (e.g. a timeout between
+        # the submission and its record) are given back. Returns the count.
+        # Slots are reserved before the document is staged and only show as pending jobs once submitted, and the
+        # index lags behind the table, so only a count that has not changed for unchanged_for_seconds (longer than
+        # an invocation of process_invoices_bda) is reset, and only if it still holds the value read here
+        counter = self.get(IN_FLIGHT_KEY) or {}
+        seen = int(counter.get("in_flight", 0))
+        if int(time.time()) - int(counter.get("updated_at", 0)) < unchanged_for_seconds:
+            return seen
+        pending = 0
+        for job_status in PENDING_JOB_STATUSES:
+            pending += sum(self.query(self.due_jobs_index, "job_status = :job_status", {":job_status": job_status},
+                                      select="COUNT"))
+        if pending == seen:
+            return seen
+        expression_values = {":pending": pending, ":now": int(time.time())}
+        if "in_flight" in counter:
+            condition_expression = "in_flight = :seen"
+            expression_values[":seen"] = seen
+        else:
+            condition_expression = "attribute_not_exists(in_flight)"
+        if self.update(IN_FLIGHT_KEY, "SET in_flight = :pending, updated_at = :now", expression_values,
+                       condition_expression=condition_expression) is None:
+            # Slots were acquired or released meanwhile, the next run tries again
+            return seen
+        return pending
+
+
+def get_job_store():
+    # JOBS_TABLE_NAME set to "memory" keeps the records in process, an empty value disables job tracking
+    return get_store("JOBS_TABLE_NAME", InMemoryJobStore, DynamoDBJobStore, "JOBS_RETENTION_DAYS")
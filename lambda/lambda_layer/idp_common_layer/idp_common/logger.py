@@ -0,0 +1,102 @@
+## Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+## Licensed under the Amazon Software License  https://aws.amazon.com/asl/
+from contextlib import contextmanager
+import contextvars
+from datetime import datetime, timezone
+import json
+import os
+import random
+
+
+# Log records are single JSON lines, so they can be filtered with CloudWatch Logs Insights
+LOG_LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+log_level = os.getenv("LOG_LEVEL", "INFO").upper()
+# Share of the invocations that log their whole event, the others log a summary of it
+log_event_sample_rate = float(os.getenv("LOG_EVENT_SAMPLE_RATE", "0.01"))
+# Longer strings and lists are cut, so a large payload costs a bounded amount of log ingestion
+log_max_field_chars = int(os.getenv("LOG_MAX_FIELD_CHARS", "1024"))
+log_max_list_items = int(os.getenv("LOG_MAX_LIST_ITEMS", "20"))
+
+# Fields added to every record of the current document, e.g. its correlation_id. Worker threads get them
+# through contextvars.copy_context(), see idp_common.metrics.submit_in_context
+log_context = contextvars.ContextVar("log_context", default={})
+
+
+def truncate(value, max_chars=None, max_items=None):
+    # Cuts long strings and lists anywhere in the value, e.g. the records of an SQS batch
+    max_chars = max_chars or log_max_field_chars
+    max_items = max_items or log_max_list_items
+    if isinstance(value, str):
+        return value if len(value) <= max_chars else f"{value[:max_chars]}...({len(value)} chars)"
+    if isinstance(value, dict):
+        return {key: truncate(item, max_chars, max_items) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        items = [truncate(item, max_chars, max_items) for item in value[:max_items]]
+        if len(value) > max_items:
+            items.append(f"...({len(value)} items)")
+        return items
+    return value
+
+def get_event_summary(event):
+    # What identifies an event without its payload: the records of S3 and SQS events, the source and
+    # detail type of EventBridge events
+    if not isinstance(event, dict):
+        return {"event_type": type(event).__name__}
+    if "Records" in event:
+        records = event["Records"]
+        sources = sorted({record.get("eventSource") or record.get("EventSource") or "" for record in records})
+        return {"records": len(records), "event_source": ",".join(sources)}
+    if "detail-type" in event:
+        return {"event_source": event.get("source"), "detail_type": event["detail-type"], "event_id": event.get("id")}
+    return {"event_keys": sorted(event)[:log_max_list_items]}
+
+
+class Logger:
+    """Structured logger with levels, writes one JSON line per record to stdout (CloudWatch Logs in Lambda)."""
+
+    def __init__(self, name, level=None):
+        self.name = name
+        self.level = LOG_LEVELS.get((level or log_level).upper(), LOG_LEVELS["INFO"])
+
+    def is_enabled(self, level):
+        return LOG_LEVELS[level] >= self.level
+
+    def log(self, level, message, **fields):
+        # Disabled levels return before anything is serialized
+        if not self.is_enabled(level):
+            return
+        record = {"timestamp": datetime.now(timezone.utc).isoformat(), "level": level, "logger": self.name,
+                  "message": message, **log_context.get(), **truncate(fields)}
+        print(json.dumps(record, default=str))
+
+    def debug(self, message, **fields):
+        self.log("DEBUG", message, **fields)
+
+    def info(self, message, **fields):
+        self.log("INFO", message, **fields)
+
+    def warning(self, message, **fields):
+        self.log("WARNING", message, **fields)
+
+    def error(self, message, **fields):
+        self.log("ERROR", message, **fields)
+
+    def log_event(self, event):
+        # The whole event (truncated) for a sample of the invocations or at DEBUG level, a summary otherwise
+        if self.is_enabled("DEBUG") or random.random() < log_event_sample_rate:
+            self.info("Received event", event=event, **get_event_summary(event))
+        else:
+            self.info("Received event", **get_event_summary(event))
+
+
+def get_logger(name):
+    return Logger(name)
+
+@contextmanager
+def bind_log_context(**fields):
+    token = log_context.set({**log_context.get(), **fields})
+    try:
+        yield
+    finally:
+        log_context.reset(token)
@@ -0,0 +1,230 @@
+## Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+## Licensed under the Amazon Software License  https://aws.amazon.com/asl/
+from contextlib import contextmanager
+import contextvars
+from datetime import datetime
+import functools
+import json
+import os
+import random
+import threading
+import time
+
+
+# Metrics are written to the logs in CloudWatch Embedded Metric Format (EMF), CloudWatch extracts them
+# without any API call. One record is written per document and one per invocation
+metrics_namespace = os.getenv("METRICS_NAMESPACE", "IDPInvoices")
+metrics_enabled = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+# "cprofile" or "tracemalloc" profiles a sample (PROFILE_SAMPLE_RATE) of the invocations
+profile_mode = os.getenv("PROFILE_MODE", "")
+profile_sample_rate = float(os.getenv("PROFILE_SAMPLE_RATE", "1"))
+profile_top = int(os.getenv("PROFILE_TOP", "20"))
+
+# Exact sizes and page counts would create a metric per value, the dimensions use classes of them instead.
+# The exact values are kept as metrics and properties of the record
+DOCUMENT_DIMENSIONS = [["DocType"], ["DocType", "SizeClass", "PageClass"]]
+INVOCATION_DIMENSIONS = [["DocType"]]
+
+# Every emitted record is also passed to these callables, e.g. a list's append in local tests
+metric_sinks = []
+
+# Buffer of the current invocation or document, worker threads get it through contextvars.copy_context()
+current_buffer = contextvars.ContextVar("metrics_buffer", default=None)
+
+
+def get_size_class(size_bytes):
+    if size_bytes is None:
+        return "unknown"
+    if size_bytes < 1024 * 1024:
+        return "<1MB"
+    if size_bytes < 10 * 1024 * 1024:
+        return "1-10MB"
+    return ">10MB"
+
+def get_page_class(pages):
+    if pages is None:
+        return "unknown"
+    if pages <= 1:
+        return "1"
+    if pages <= 5:
+        return "2-5"
+    if pages <= 20:
+        return "6-20"
+    return ">20"
+
+def get_timestamp_ms(timestamp=None):
+    # Epoch milliseconds of an ISO 8601 timestamp (e.g. the eventTime of S3 events, the time of EventBridge
+    # events), of now when it is not set. Returns None when it cannot be parsed
+    if timestamp is None:
+        return int(time.time() * 1000)
+    try:
+        return int(datetime.fromisoformat(timestamp.replace("Z", "+00:00")).timestamp() * 1000)
+    except (AttributeError, ValueError):
+        return None
+
+def emit_record(record):
+    print(json.dumps(record, default=str))
+    for sink in metric_sinks:
+        sink(record)
+
+
+class MetricsBuffer:
+    """Metrics and properties of one document or invocation, written as a single EMF record."""
+
+    def __init__(self, dimensions, dimension_sets):
+        self.dimensions = dict(dimensions)
+        self.dimension_sets = dimension_sets
+        self.metrics = {}
+        self.properties = {}
+        self.lock = threading.Lock()
+
+    def put_metric(self, name, value, unit):
+        with self.lock:
+            # EMF takes at most 100 values per metric and record
+            metric = self.metrics.setdefault(name, {"unit": unit, "values": []})
+            if len(metric["values"]) < 100:
+                metric["values"].append(value)
+
+    def set_properties(self, **properties):
+        with self.lock:
+            self.properties.update(properties)
+
+    def to_emf(self):
+        with self.lock:
+            if not self.metrics:
+                return None
+            record = {
+                "_aws": {
+                    "Timestamp": int(time.time() * 1000),
+                    "CloudWatchMetrics": [{
+                        "Namespace": metrics_namespace,
+                        "Dimensions": self.dimension_sets,
+                        "Metrics": [{"Name": name, "Unit": metric["unit"]} for name, metric in self.metrics.items()],
+                    }],
+                },
+                **self.properties,
+                **self.dimensions,
+            }
+            for name, metric in self.metrics.items():
+                record[name] = metric["values"][0] if len(metric["values"]) == 1 else metric["values"]
+            return record
+
+    def flush(self):
+        record = self.to_emf()
+        if record is not None and metrics_enabled:
+            emit_record(record)
+        return record
+
+
+def put_metric(name, value, unit="Milliseconds"):
+    # Metrics recorded outside of a handler (e.g. local scripts) are dropped
+    buffer = current_buffer.get()
+    if buffer is not None:
+        buffer.put_metric(name, value, unit)
+
+def set_document_properties(**properties):
+    # e.g. pages once the PDF is opened. pages and size_bytes also set the dimensions of the document
+    buffer = current_buffer.get()
+    if buffer is None:
+        return
+    if "pages" in properties and "PageClass" in buffer.dimensions:
+        buffer.dimensions["PageClass"] = get_page_class(properties["pages"])
+        buffer.put_metric("Pages", properties["pages"], "Count")
+    if "size_bytes" in properties and "SizeClass" in buffer.dimensions:
+        buffer.dimensions["SizeClass"] = get_size_class(properties["size_bytes"])
+        buffer.put_metric("DocumentBytes", properties["size_bytes"], "Bytes")
+    buffer.set_properties(**properties)
+
+@contextmanager
+def timer(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        put_metric(name, (time.perf_counter() - start) * 1000)
+
+def timed(name):
+    # Decorator version of timer
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with timer(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@contextmanager
+def document_metrics(document_key, doc_type=None, size_bytes=None, pages=None):
+    # Everything timed inside the block, also by the worker threads started with copy_context(), goes to the
+    # record of the document. The document time is recorded as DocumentDuration
+    buffer = MetricsBuffer({"DocType": doc_type or os.getenv("DOC_TYPE", "invoices"), "SizeClass": "unknown",
+                            "PageClass": "unknown"}, DOCUMENT_DIMENSIONS)
+    token = current_buffer.set(buffer)
+    try:
+        set_document_properties(document_key=document_key)
+        if size_bytes is not None:
+            set_document_properties(size_bytes=size_bytes)
+        if pages is not None:
+            set_document_properties(pages=pages)
+        with timer("DocumentDuration"):
+            yield buffer
+    finally:
+        current_buffer.reset(token)
+        buffer.flush()
+
+@contextmanager
+def profiled(mode, top=None):
+    # Yields a dict that holds the profile once the block ends: the functions with the highest cumulative time
+    # (cprofile, only the calling thread) or the lines that allocated the most memory (tracemalloc, all threads)
+    top = top or profile_top
+    profile = {"profile": mode}
+    if mode == "cprofile":
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield profile
+        finally:
+            profiler.disable()
+            stats = sorted(pstats.Stats(profiler).stats.items(), key=lambda item: item[1][3], reverse=True)
+            profile["top"] = [{"function": f"{file_name}:{line}({function_name})", "calls": calls,
+                               "total_ms": total_time * 1000, "cumulative_ms": cumulative_time * 1000}
+                              for (file_name, line, function_name), (_, calls, total_time, cumulative_time, _)
+                              in stats[:top]]
+    elif mode == "tracemalloc":
+        import tracemalloc
+        tracemalloc.start()
+        try:
+            yield profile
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            _, profile["peak_bytes"] = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            profile["top"] = [{"line": str(stat.traceback[0]), "size_bytes": stat.size, "count": stat.count}
+                              for stat in snapshot.statistics("lineno")[:top]]
+    else:
+        yield profile
+
+def instrument_handler(handler):
+    # Wraps a lambda_handler: metrics recorded outside of a document go to the record of the invocation, and a
+    # sample of the invocations is profiled when PROFILE_MODE is set
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        buffer = MetricsBuffer({"DocType": os.getenv("DOC_TYPE", "invoices")}, INVOCATION_DIMENSIONS)
+        token = current_buffer.set(buffer)
+        mode = profile_mode if profile_mode and random.random() < profile_sample_rate else ""
+        try:
+            with profiled(mode) as profile, timer("HandlerDuration"):
+                return handler(event, context)
+        finally:
+            current_buffer.reset(token)
+            buffer.flush()
+            if mode:
+                emit_record(profile)
+    return wrapper
+
+def submit_in_context(executor, function, *args, **kwargs):
+    # executor.submit that keeps the current document, so the metrics of the worker thread go to its record
+    return executor.submit(contextvars.copy_context().run, function, *args, **kwargs)
@@ -0,0 +1,184 @@
+## Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+## Licensed under the Amazon Software License  https://aws.amazon.com/asl/
+from contextlib import contextmanager
+from io import BytesIO
+import json
+import os
+import tempfile
+import threading
+from idp_common.clients import get_client
+from idp_common.metrics import set_document_properties, timed, timer
+from idp_common.logger import get_logger
+from idp_common.s3 import S3RangeReader
+
+
+logger = get_logger("idp_common.pdf")
+
+# How PDFs are loaded from S3: "spool" (to /tmp), "range" (ranged GETs) or "memory"
+pdf_load_mode = os.getenv("PDF_LOAD_MODE", "spool")
+
+# Resolution, color and encoding of the rendered images, set per document type in project_config.json
+DEFAULT_RENDER_CONFIG = {
+    "dpi": 144,
+    "grayscale": False,
+    "format": "PNG",
+    "png_compress_level": 6,
+    "jpeg_quality": 85,
+    "webp_quality": 80,
+}
+IMAGE_FORMATS = {
+    "PNG": {"extension": "png", "content_type": "image/png"},
+    "JPEG": {"extension": "jpg", "content_type": "image/jpeg"},
+    "WEBP": {"extension": "webp", "content_type": "image/webp"},
+}
+render_config = {**DEFAULT_RENDER_CONFIG, **json.loads(os.getenv("RENDER_CONFIG", "{}"))}
+
+# pdfium is not thread safe, not even across documents. Every pdfium call of the worker threads
+# (open, page count, render, close) holds this lock, the S3 transfers and the image encoding do not
+pdfium_lock = threading.RLock()
+# Documents staged at the same time by the worker threads of a batch. Each one holds its PDF (in /tmp, or in
+# memory with PDF_LOAD_MODE "memory") and a rendered page, 1 stages a single document at a time
+pdf_max_concurrency = int(os.getenv("PDF_MAX_CONCURRENCY", "1"))
+staging_semaphore = threading.BoundedSemaphore(max(1, pdf_max_concurrency))
+
+def get_image_extension(config=None):
+    config = config or render_config
+    return IMAGE_FORMATS[config["format"].upper()]["extension"]
+
+@timed("ImageEncode")
+def encode_image(image, image_buffer, config=None):
+    config = config or render_config
+    image_format = config["format"].upper()
+    if config["grayscale"] and image.mode != "L":
+        image = image.convert("L")
+    elif image_format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    if image_format == "PNG":
+        image.save(image_buffer, "PNG", compress_level=config["png_compress_level"])
+    elif image_format == "JPEG":
+        image.save(image_buffer, "JPEG", quality=config["jpeg_quality"])
+    elif image_format == "WEBP":
+        image.save(image_buffer, "WEBP", quality=config["webp_quality"])
+    else:
+        raise ValueError(f"Unsupported image format: {config['format']}")
+    return IMAGE_FORMATS[image_format]["content_type"]
+
+def save_image_to_s3(image, bucket, key, config=None):
+    with BytesIO() as image_buffer:
+        content_type = encode_image(image, image_buffer, config)
+        image_buffer.seek(0)
+        with timer("S3Put"):
+            get_client("s3").upload_fileobj(image_buffer, bucket, key, ExtraArgs={"ContentType": content_type})
+    return bucket, key
+
+def load_image_from_s3(bucket, key):
+    from PIL import Image
+    with timer("S3Get"):
+        body = get_client("s3").get_object(Bucket=bucket, Key=key)['Body'].read()
+    return Image.open(BytesIO(body))
+
+@contextmanager
+def open_pdf_from_s3(bucket, key, load_mode=None):
+    # "spool" streams the object to /tmp and pdfium reads the pages from disk, "range" reads them with
+    # ranged GETs and "memory" loads the whole object into bytes. Only "memory" grows with the file size
+    # pdfium (and Pillow, used by its renderer) are only imported by the paths that read PDFs
+    import pypdfium2
+    load_mode = load_mode or pdf_load_mode
+    spool_file = None
+    if load_mode == "memory":
+        with timer("S3Get"):
+            source = get_client("s3").get_object(Bucket=bucket, Key=key)['Body'].read()
+    elif load_mode == "range":
+        source = S3RangeReader(bucket, key)
+    else:
+        spool_file = tempfile.NamedTemporaryFile(suffix=".pdf")
+        with timer("S3Get"):
+            get_client("s3").download_fileobj(bucket, key, spool_file)
+            spool_file.flush()
+        source = spool_file.name
+    with pdfium_lock:
+        pdf = pypdfium2.PdfDocument(source, autoclose=load_mode == "range")
+    try:
+        yield pdf
+    finally:
+        with pdfium_lock:
+            pdf.close()
+        if spool_file:
+            spool_file.close()
+
+def get_page_count(pdf):
+    with pdfium_lock:
+        return len(pdf)
+
+def get_page_indices(page_range, n_pages):
+    # page_range is 1-based and inclusive, e.g. "all", "1", "1-3" or "1-2,5"
+    if not page_range or page_range.strip().lower() == "all":
+        return list(range(n_pages))
+    page_indices = []
+    for part in page_range.split(","):
+        part = part.strip()
+        if "-" in part:
+            first, last = part.split("-", 1)
+            first = int(first) if first else 1
+            last = int(last) if last else n_pages
+        else:
+            first = last = int(part)
+        for page_number in range(max(first, 1), min(last, n_pages) + 1):
+            if page_number - 1 not in page_indices:
+                page_indices.append(page_number - 1)
+    return page_indices
+
+def get_staged_document_key(output_key):
+    # Several selected pages are staged as a single PDF of the rendered pages, e.g. invoices/a.pdf.png ->
+    # invoices/a.pdf.staged.pdf, so BDA extracts the whole invoice in one job
+    return f"{output_key.rsplit('.', 1)[0]}.staged.pdf"
+
+@timed("PdfRender")
+def render_pdf_page(pdf, page_index, config=None):
+    # Returns the page as a PIL image, the pdfium bitmap and page are released right away
+    config = config or render_config
+    with pdfium_lock:
+        page = pdf[page_index]
+        bitmap = page.render(scale=config["dpi"] / 72, rotation=0, grayscale=config["grayscale"])
+        # to_pil() shares the bitmap buffer, copy it before the bitmap is closed
+        pil_image = bitmap.to_pil().copy()
+        bitmap.close()
+        page.close()
+    return pil_image
+
+def render_pdf_pages(pdf, page_indices, config=None):
+    # Render one page at a time and release it before moving on to the next one,
+    # so memory stays bounded by a single page regardless of the document length
+    for page_index in page_indices:
+        pil_image = render_pdf_page(pdf, page_index, config)
+        try:
+            yield page_index, pil_image
+        finally:
+            pil_image.close()
+
+def convert_pdf_to_png(input_bucket, input_key, output_bucket, output_key, page_range="all"):
+    # Returns the bucket and key of the staged document, BDA gets a single input per document.
+    # A single selected page is staged as an image (output_key should end with get_image_extension()),
+    # several pages are appended one at a time to a PDF in /tmp, so memory stays bounded by a single page
+    if render_config["format"].upper() not in ("PNG", "JPEG"):
+        raise ValueError(f"Staged images must be PNG or JPEG, got {render_config['format']}")
+    with staging_semaphore, open_pdf_from_s3(input_bucket, input_key) as pdf:
+        n_pages = get_page_count(pdf)  # get the number of pages in the document
+        page_indices = get_page_indices(page_range, n_pages)
+        set_document_properties(pages=n_pages)
+        if not page_indices:
+            raise ValueError(f"Page range {page_range!r} selects no page of {input_key} ({n_pages} pages)")
+        logger.debug("Staging PDF pages", document_key=input_key, pages=n_pages, staged_pages=len(page_indices))
+        if len(page_indices) == 1:
+            for _, pil_image in render_pdf_pages(pdf, page_indices):
+                save_image_to_s3(pil_image, output_bucket, output_key)
+            return output_bucket, output_key
+        staged_key = get_staged_document_key(output_key)
+        with tempfile.NamedTemporaryFile(suffix=".pdf") as staged_pdf:
+            for page_index, pil_image in render_pdf_pages(pdf, page_indices):
+                pil_image.save(staged_pdf.name, "PDF", append=page_index != page_indices[0], resolution=render_config["dpi"])
+            with timer("S3Put"):
+                get_client("s3").upload_file(staged_pdf.name, output_bucket, staged_key,
+                                             ExtraArgs={"ContentType": "application/pdf"})
+    return output_bucket, staged_key
@@ -0,0 +1,184 @@
+## Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+## Licensed under the Amazon Software License  https://aws.amazon.com/asl/
+from collections import OrderedDict
+from urllib.parse import urlparse, unquote_plus
+import gzip
+import io
+import json
+import os
+from idp_common.clients import get_client
+from idp_common.metrics import timer
+try:
+    # Faster serializer, shipped in the orjson layer
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# How the curated JSON results are written: "compact", "gzip" (compact JSON with Content-Encoding gzip),
+# "jsonl" (one JSON document per line) or "pretty" (indented, as the results used to be written)
+OUTPUT_ENCODINGS = {
+    "pretty": {"content_type": "application/json"},
+    "compact": {"content_type": "application/json"},
+    "gzip": {"content_type": "application/json", "content_encoding": "gzip"},
+    "jsonl": {"content_type": "application/x-ndjson"},
+}
+output_encoding = os.getenv("OUTPUT_ENCODING", "compact")
+
+def get_s3_bucket_and_key(s3_input_uri):
+    parsed_uri = urlparse(s3_input_uri)
+
+    if parsed_uri.scheme == 's3':
+        # s3://bucket-name/key format
+        bucket = parsed_uri.netloc
+        key = parsed_uri.path.lstrip('/')
+    elif parsed_uri.scheme == 'https':
+        # https://bucket-name.s3.amazonaws.com/key format
+        bucket = parsed_uri.netloc.split('.')[0]
+        key = parsed_uri.path.lstrip('/')
+    else:
+        raise ValueError("Unsupported URL format")
+
+    # remove un necesssary special quotes
+    key = unquote_plus(key)
+
+    return bucket, key
+
+def dumps_json(data, pretty=False):
+    # Compact UTF-8 JSON, with orjson when it is available
+    if pretty:
+        return json.dumps(data, indent=4).encode('utf-8')
+    if orjson is not None:
+        try:
+            return orjson.dumps(data)
+        except TypeError:
+            # e.g. integers over 64 bits, the standard library handles them
+            pass
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode('utf-8')
+
+def loads_json(body):
+    return orjson.loads(body) if orjson is not None else json.loads(body)
+
+def encode_json(data, encoding=None):
+    # Returns the serialized body and the put_object arguments of the output encoding
+    encoding = encoding or output_encoding
+    if encoding not in OUTPUT_ENCODINGS:
+        raise ValueError(f"Unsupported output encoding: {encoding}")
+    if encoding == "jsonl":
+        # Lists are written one item per line, any other document on a single line
+        items = data if isinstance(data, list) else [data]
+        body = b"".join(dumps_json(item) + b"\n" for item in items)
+    else:
+        body = dumps_json(data, pretty=encoding == "pretty")
+    put_args = {"ContentType": OUTPUT_ENCODINGS[encoding]["content_type"]}
+    if encoding == "gzip":
+        # mtime=0 keeps the output identical for identical results
+        body = gzip.compress(body, compresslevel=6, mtime=0)
+        put_args["ContentEncoding"] = "gzip"
+    return body, put_args
+
+def decode_json(body, content_encoding=None, content_type=None):
+    # Reads any of the output encodings back, gzip is also recognized by its magic number
+    if content_encoding == "gzip" or body[:2] == b"\x1f\x8b":
+        body = gzip.decompress(body)
+    if content_type == OUTPUT_ENCODINGS["jsonl"]["content_type"]:
+        items = [loads_json(line) for line in body.splitlines() if line.strip()]
+        return items[0] if len(items) == 1 and isinstance(items[0], dict) else items
+    return loads_json(body)
+
+def read_json_from_s3(bucket, key):
+    with timer("S3Get"):
+        response = get_client("s3").get_object(Bucket=bucket, Key=key)
+        body = response['Body'].read()
+    return decode_json(body, response.get('ContentEncoding'), response.get('ContentType'))
+
+def read_json_content_from_s3(s3_path):
+    # Parse bucket and key from s3 path
+    bucket_name = s3_path.split('/')[2]
+    key = '/'.join(s3_path.split('/')[3:])
+    return read_json_from_s3(bucket_name, key)
+
+def save_json_to_s3(bucket, key, llm_json_response, encoding=None):
+    # Serialize with the output encoding of the deployment (OUTPUT_ENCODING)
+    json_content, put_args = encode_json(llm_json_response, encoding)
+    with timer("S3Put"):
+        get_client("s3").put_object(Bucket=bucket, Key=key, Body=json_content, **put_args)
+
+def list_s3_items(bucket_name, prefix):
+    items = []
+    paginator = get_client("s3").get_paginator('list_objects_v2')
+
+    # The S3 API returns results in pages, so we use a paginator
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        if 'Contents' in page:
+            for obj in page['Contents']:
+                key = obj['Key']
+                # Only include the key if it's not the prefix itself and it's not empty
+                if key != prefix and key.strip():
+                    full_uri = f"s3://{bucket_name}/{key}"
+                    items.append(full_uri)
+
+    return items
+
+def copy_s3_objects(bucket, copied_keys):
+    # Server side copies, used to reuse the curated results of a duplicate document
+    for source_key, destination_key in copied_keys:
+        if source_key != destination_key:
+            get_client("s3").copy_object(Bucket=bucket, Key=destination_key,
+                                  CopySource={'Bucket': bucket, 'Key': source_key})
+
+class S3RangeReader(io.RawIOBase):
+    # Read-only, seekable file object over an S3 object. pdfium seeks around the file and only the
+    # blocks it actually reads are fetched with ranged GETs, the last few blocks are kept in memory
+    def __init__(self, bucket, key, block_size=1024 * 1024, max_cached_blocks=8):
+        self.bucket = bucket
+        self.key = key
+        self.size = get_client("s3").head_object(Bucket=bucket, Key=key)['ContentLength']
+        self.block_size = block_size
+        self.max_cached_blocks = max_cached_blocks
+        self.blocks = OrderedDict()
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        elif whence == io.SEEK_END:
+            self.position = self.size + offset
+        return self.position
+
+    def get_block(self, block_index):
+        if block_index in self.blocks:
+            self.blocks.move_to_end(block_index)
+            return self.blocks[block_index]
+        start = block_index * self.block_size
+        end = min(start + self.block_size, self.size) - 1
+        with timer("S3Get"):
+            response = get_client("s3").get_object(Bucket=self.bucket, Key=self.key, Range=f"bytes={start}-{end}")
+            block = response['Body'].read()
+        self.blocks[block_index] = block
+        if len(self.blocks) > self.max_cached_blocks:
+            self.blocks.popitem(last=False)
+        return block
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast("B")
+        n_read = 0
+        while n_read < len(view) and self.position < self.size:
+            block_index, block_offset = divmod(self.position, self.block_size)
+            chunk = self.get_block(block_index)[block_offset:block_offset + len(view) - n_read]
+            view[n_read:n_read + len(chunk)] = chunk
+            n_read += len(chunk)
+            self.position += len(chunk)
+        return n_read
@@ -0,0 +1,31 @@
+## Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+## Licensed under the Amazon Software License  https://aws.amazon.com/asl/
+import json
+from idp_common.clients import get_client
+
+
+def get_queue_url(queue_arn):
+    # arn:aws:sqs:<region>:<account>:<queue name>, e.g. the eventSourceARN of an SQS record
+    _, _, _, region, account, queue_name = queue_arn.split(":")
+    return f"https://sqs.{region}.amazonaws.com/{account}/{queue_name}"
+
+def send_messages_to_sqs(queue_url, messages, max_attempts=3, delay_seconds=None):
+    # SQS takes at most 10 messages per batch. Messages are sent as compact JSON, and the entries that failed
+    # on the SQS side are sent again, so a partial failure does not resend the whole batch.
+    # delay_seconds (up to 900) hides the messages for that long after they are sent
+    for start in range(0, len(messages), 10):
+        entries = [{"Id": str(index), "MessageBody": json.dumps(message, separators=(",", ":"))}
+                   for index, message in enumerate(messages[start:start + 10])]
+        if delay_seconds is not None:
+            for entry in entries:
+                entry["DelaySeconds"] = delay_seconds
+        for attempt in range(max_attempts):
+            response = get_client("sqs").send_message_batch(QueueUrl=queue_url, Entries=entries)
+            failed = response.get("Failed", [])
+            failed_ids = {failure["Id"] for failure in failed}
+            if not failed or any(failure.get("SenderFault") for failure in failed) or attempt == max_attempts - 1:
+                break
+            entries = [entry for entry in entries if entry["Id"] in failed_ids]
+        if failed:
+            raise RuntimeError(f"Failed to send messages to SQS: {failed}")
@@ -0,0 +1,47 @@
+## Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+## Licensed under the Amazon Software License  https://aws.amazon.com/asl/
+import os
+import threading
+import time
+from idp_common.clients import get_client
+from idp_common.metrics import timer
+
+
+# SSM parameters (e.g. the blueprint ARN) cached across warm invocations
+ssm_cache_ttl_seconds = int(os.getenv("SSM_CACHE_TTL_SECONDS", "300"))
+ssm_cache = {}
+ssm_cache_lock = threading.Lock()
+
+def get_parameter_from_ssm(param_name, version_tag=None):
+    # Parameters are cached across warm invocations for ssm_cache_ttl_seconds.
+    # A different version_tag (e.g. the blueprint version) refreshes the cached value right away
+    with ssm_cache_lock:
+        cached = ssm_cache.get(param_name)
+        if cached and cached["version_tag"] == version_tag and time.monotonic() - cached["fetched_at"] < ssm_cache_ttl_seconds:
+            return cached["value"]
+        with timer("SsmGet"):
+            response = get_client("ssm").get_parameter(
+                    Name=param_name,
+                    WithDecryption=True
+                )
+        param_value = response['Parameter']['Value']
+        ssm_cache[param_name] = {"value": param_value, "version_tag": version_tag, "fetched_at": time.monotonic()}
+    return param_value
+
+def invalidate_ssm_cache(param_name=None):
+    with ssm_cache_lock:
+        if param_name is None:
+            ssm_cache.clear()
+        else:
+            ssm_cache.pop(param_name, None)
+
+def put_parameter_in_ssm(param_name, param_value):
+    response = get_client("ssm").put_parameter(
+            Name=param_name,
+            Value=param_value,
+            Type='String',
+            Overwrite=True
+        )
+    invalidate_ssm_cache(param_name)
+    return response
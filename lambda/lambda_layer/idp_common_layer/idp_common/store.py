@@ -0,0 +1,159 @@
+## Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+## Licensed under the Amazon Software License  https://aws.amazon.com/asl/
+import os
+import threading
+from botocore.exceptions import ClientError
+from idp_common.clients import get_client
+
+# Base classes of the record stores (idp_common.dedup, idp_common.jobs). Every store has a process local
+# implementation, used for offline runs and tests, and a DynamoDB one. The DynamoDB stores are shared by the
+# worker threads of a batch, they use the low-level client of idp_common.clients (thread safe, with its
+# connection pool and adaptive retries) and convert the items from and to DynamoDB attribute values here
+
+# Stores by the environment variable holding their table name, see get_store
+stores = {}
+stores_lock = threading.Lock()
+
+
+def serialize_item(item):
+    from boto3.dynamodb.types import TypeSerializer
+    serializer = TypeSerializer()
+    return {name: serializer.serialize(value) for name, value in item.items()}
+
+
+def deserialize_item(item):
+    # Numbers are returned as Decimal, as with the boto3 resource
+    from boto3.dynamodb.types import TypeDeserializer
+    deserializer = TypeDeserializer()
+    return {name: deserializer.deserialize(value) for name, value in item.items()}
+
+
+def is_condition_failed(error):
+    return error.response["Error"]["Code"] == "ConditionalCheckFailedException"
+
+
+class InMemoryStore:
+    """Process local store, used for offline runs and tests."""
+
+    def __init__(self):
+        self.items = {}
+        self.lock = threading.Lock()
+
+    def get(self, pk):
+        with self.lock:
+            item = self.items.get(pk)
+            return dict(item) if item else None
+
+
+class DynamoDBStore:
+    """DynamoDB backed store. Set DYNAMODB_ENDPOINT_URL to run against DynamoDB Local."""
+
+    def __init__(self, table_name, retention_days=30):
+        self.table_name = table_name
+        self.retention_seconds = retention_days * 24 * 60 * 60
+
+    def get(self, pk):
+        item = get_client("dynamodb").get_item(TableName=self.table_name, Key=serialize_item({"pk": pk}),
+                                               ConsistentRead=True).get("Item")
+        return deserialize_item(item) if item else None
+
+    def get_many(self, pks):
+        # BatchGetItem reads at most 100 keys per call, the keys it could not read are requested again
+        items = {}
+        pks = list(dict.fromkeys(pks))
+        for start in range(0, len(pks), 100):
+            request_items = {self.table_name: {"Keys": [serialize_item({"pk": pk}) for pk in pks[start:start + 100]],
+                                               "ConsistentRead": True}}
+            while request_items:
+                response = get_client("dynamodb").batch_get_item(RequestItems=request_items)
+                for item in response["Responses"].get(self.table_name, []):
+                    item = deserialize_item(item)
+                    items[item["pk"]] = item
+                request_items = response.get("UnprocessedKeys")
+        return items
+
+    def put(self, item, condition_expression=None, expression_values=None):
+        # Returns False when the condition failed
+        put_args = {"TableName": self.table_name, "Item": serialize_item(item)}
+        if condition_expression:
+            put_args["ConditionExpression"] = condition_expression
+        if expression_values:
+            put_args["ExpressionAttributeValues"] = serialize_item(expression_values)
+        try:
+            get_client("dynamodb").put_item(**put_args)
+        except ClientError as e:
+            if is_condition_failed(e):
+                return False
+            raise
+        return True
+
+    def put_many(self, items):
+        # BatchWriteItem writes at most 25 items per call, the items it could not write are sent again
+        for start in range(0, len(items), 25):
+            request_items = {self.table_name: [{"PutRequest": {"Item": serialize_item(item)}}
+                                               for item in items[start:start + 25]]}
+            while request_items:
+                request_items = get_client("dynamodb").batch_write_item(RequestItems=request_items).get("UnprocessedItems")
+
+    def update(self, pk, update_expression, expression_values=None, condition_expression=None, return_values="NONE"):
+        # Returns the attributes asked for with return_values ({} with "NONE"), None when the condition failed
+        update_args = {"TableName": self.table_name, "Key": serialize_item({"pk": pk}),
+                       "UpdateExpression": update_expression, "ReturnValues": return_values}
+        if condition_expression:
+            update_args["ConditionExpression"] = condition_expression
+        if expression_values:
+            update_args["ExpressionAttributeValues"] = serialize_item(expression_values)
+        try:
+            response = get_client("dynamodb").update_item(**update_args)
+        except ClientError as e:
+            if is_condition_failed(e):
+                return None
+            raise
+        return deserialize_item(response.get("Attributes", {}))
+
+    def delete(self, pk, condition_expression=None, expression_values=None):
+        # Returns False when the condition failed
+        delete_args = {"TableName": self.table_name, "Key": serialize_item({"pk": pk})}
+        if condition_expression:
+            delete_args["ConditionExpression"] = condition_expression
+        if expression_values:
+            delete_args["ExpressionAttributeValues"] = serialize_item(expression_values)
+        try:
+            get_client("dynamodb").delete_item(**delete_args)
+        except ClientError as e:
+            if is_condition_failed(e):
+                return False
+            raise
+        return True
+
+    def query(self, index_name, key_condition_expression, expression_values, limit=None, select=None):
+        # Yields the pages of a query, as deserialized items (or the count of the page with select="COUNT")
+        query_args = {"TableName": self.table_name, "IndexName": index_name,
+                      "KeyConditionExpression": key_condition_expression,
+                      "ExpressionAttributeValues": serialize_item(expression_values)}
+        if limit:
+            query_args["Limit"] = limit
+        if select:
+            query_args["Select"] = select
+        while True:
+            response = get_client("dynamodb").query(**query_args)
+            yield response["Count"] if select == "COUNT" else [deserialize_item(item) for item in response["Items"]]
+            if "LastEvaluatedKey" not in response:
+                break
+            query_args["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+
+def get_store(table_env_name, in_memory_class, dynamodb_class, retention_env_name):
+    # The table name environment variable set to "memory" keeps the records in process, an empty value
+    # disables the store. Stores are created once per container and shared by the worker threads
+    table_name = os.getenv(table_env_name, "")
+    if not table_name:
+        return None
+    with stores_lock:
+        if table_env_name not in stores:
+            retention_days = int(os.getenv(retention_env_name, "30"))
+            stores[table_env_name] = in_memory_class() if table_name == "memory" \
+                else dynamodb_class(table_name, retention_days=retention_days)
+        return stores[table_env_name]
@@ -0,0 +1,77 @@
+## Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+## Licensed under the Amazon Software License  https://aws.amazon.com/asl/
+import json
+import time
+from datetime import datetime, timezone
+from urllib.parse import quote_plus
+from idp_common.clients import *
+from idp_common.bda import *
+from idp_common.metrics import *
+from idp_common.jobs import *
+from idp_common.logger import get_logger
+
+logger = get_logger("poll_bda_jobs")
+
+
+def get_completion_event(job, job_metadata_s3_uri):
+    # The completion event BDA would have sent for the job, as draw_bboxes_invoices reads it. The outputs of the
+    # job sit next to its job_metadata.json, the keys are URL encoded like in the events
+    input_bucket, input_key = job["input_s3_uri"].removeprefix("s3://").split("/", 1)
+    output_bucket, job_metadata_key = job_metadata_s3_uri.removeprefix("s3://").split("/", 1)
+    output_key = f"{job_metadata_key.rsplit('/', 1)[0]}/0"
+    return {
+        "source": "poll_bda_jobs",
+        "detail-type": "Insights Extraction Job Completed",
+        "time": datetime.now(timezone.utc).isoformat(),
+        "detail": {"job_id": job["pk"], "job_status": "SUCCESS",
+                   "input_s3_object": {"s3_bucket": input_bucket, "name": quote_plus(input_key, safe="/")},
+                   "output_s3_location": {"s3_bucket": output_bucket, "name": quote_plus(output_key, safe="/")}},
+    }
+
+def hand_off_completion(function_name, event):
+    # Asynchronous invocation, Lambda retries it and the function records the job once its outputs are written
+    get_client("lambda").invoke(FunctionName=function_name, InvocationType="Event", Payload=json.dumps(event))
+
+def poll_due_jobs(job_store, max_jobs, base_delay_seconds, max_delay_seconds, completion_function_name=""):
+    # Checks the pending jobs whose next_poll_at has passed, all of them at once, and records what changed.
+    # Jobs still running get their next check pushed back with exponential backoff, nothing waits here.
+    # Successful jobs whose completion event was missed are handed to completion_function_name
+    # (draw_bboxes_invoices), so their outputs are written, exported and recorded for deduplication
+    due_jobs = job_store.list_due_jobs(max_jobs)
+    statuses = get_data_automation_statuses([job["invocation_arn"] for job in due_jobs])
+    counts = {"checked": len(due_jobs), "ended": 0, "pending": 0, "failed_checks": 0, "handed_off": 0}
+    now = int(time.time())
+    for job in due_jobs:
+        job_status, job_metadata_s3_uri = statuses[job["invocation_arn"]]
+        poll_attempts = int(job.get("poll_attempts", 0))
+        next_poll_at = now + int(get_poll_delay(poll_attempts, base_delay_seconds, max_delay_seconds))
+        if job_status is None:
+            # The check failed (e.g. throttled), it is tried again later without counting a poll attempt,
+            # so a burst of throttling does not push the following checks back
+            logger.warning("Failed to check job", job_id=job["pk"], error=job_metadata_s3_uri)
+            counts["failed_checks"] += 1
+            job_store.reschedule(job["pk"], next_poll_at)
+        elif job_status == "Success" and completion_function_name:
+            # The job is only recorded as ended once its post-processing was handed off, a failed hand-off is
+            # tried again on a later run
+            try:
+                hand_off_completion(completion_function_name, get_completion_event(job, job_metadata_s3_uri))
+            except Exception as e:
+                logger.warning("Failed to hand off the completed job", job_id=job["pk"], error=str(e))
+                counts["failed_checks"] += 1
+                job_store.reschedule(job["pk"], next_poll_at)
+                continue
+            logger.info("Job ended without a completion event", job_id=job["pk"], document_key=job["document_key"])
+            counts["ended"] += 1
+            counts["handed_off"] += 1
+            job_store.record_status(job["pk"], job_status, job_metadata_s3_uri)
+        elif job_status in TERMINAL_JOB_STATUSES:
+            # The completion event only covers successful jobs, failed ones are only seen here
+            logger.info("Job ended", job_id=job["pk"], document_key=job["document_key"], job_status=job_status)
+            counts["ended"] += 1
+            job_store.record_status(job["pk"], job_status, job_metadata_s3_uri)
+        else:
+            counts["pending"] += 1
+            job_store.record_status(job["pk"], job_status, next_poll_at=next_poll_at)
+    return counts
@@ -0,0 +1,41 @@
+## Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+## Licensed under the Amazon Software License  https://aws.amazon.com/asl/
+import json
+from helper import *
+import os
+
+@instrument_handler
+def lambda_handler(event, context):
+    logger.log_event(event)
+    ## os variables
+    max_jobs = int(os.getenv("JOBS_POLL_MAX_JOBS", "500"))
+    base_delay_seconds = int(os.getenv("JOBS_POLL_BASE_DELAY_SECONDS", "60"))
+    max_delay_seconds = int(os.getenv("JOBS_POLL_MAX_DELAY_SECONDS", "3600"))
+    completion_function_name = os.getenv("COMPLETION_FUNCTION_NAME", "")
+    reconcile_after_seconds = int(os.getenv("JOBS_RECONCILE_AFTER_SECONDS", "900"))
+    job_store = get_job_store()
+    if job_store is None:
+        logger.warning("Job tracking is disabled, JOBS_TABLE_NAME is not set")
+        return {}
+
+    # {"job_ids": [...]} returns the recorded status of many jobs at once, without calling BDA
+    if event and event.get("job_ids"):
+        jobs = job_store.get_jobs(event["job_ids"])
+        return {job_id: {"job_status": job.get("job_status"), "job_metadata_s3_uri": job.get("job_metadata_s3_uri")}
+                for job_id, job in jobs.items()}
+
+    # Scheduled runs check the jobs that did not report back through the completion event
+    counts = poll_due_jobs(job_store, max_jobs, base_delay_seconds, max_delay_seconds, completion_function_name)
+    # The admission count of process_invoices_bda is reset to the pending jobs once it has not changed for
+    # reconcile_after_seconds, so slots lost by failed invocations do not add up
+    counts["in_flight"] = job_store.reconcile_in_flight(reconcile_after_seconds)
+    put_metric("InFlightJobs", counts["in_flight"], "Count")
+    logger.info("Checked due jobs", **counts)
+    return counts
+
+
+if __name__ == "__main__":
+    print("dev mode activated")
+    os.environ.setdefault("JOBS_TABLE_NAME", "memory")
+    print(json.dumps(lambda_handler({}, None)))
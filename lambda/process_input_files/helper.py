@@ -2,27 +2,42 @@
 ## SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
 ## Licensed under the Amazon Software License  https://aws.amazon.com/asl/
 import json
-import boto3
+from idp_common.clients import get_client
+from idp_common.sqs import send_messages_to_sqs
+from idp_common.pdf import get_page_count, open_pdf_from_s3
+from idp_common.bda import new_correlation_id
+from idp_common.metrics import get_timestamp_ms, instrument_handler, put_metric
+from idp_common.logger import get_logger
 
-sns_client = boto3.client('sns')
-sqs_client = boto3.client("sqs")
+logger = get_logger("process_input_files")
 
-def send_message_to_sqs(queue_url, event):
-    message_body = json.dumps(event)
-    response = sqs_client.send_message(
-        QueueUrl=queue_url,
-        DelaySeconds=0,
-        MessageBody=(message_body)
-    )
-    print(f"Message body sent to SQS:: {message_body}")
-    return response
+def get_pdf_page_count(bucket, key):
+    # Ranged reads, pdfium only fetches the trailer, the cross reference table and the page tree
+    with open_pdf_from_s3(bucket, key, load_mode="range") as pdf:
+        return get_page_count(pdf)
+
+def get_lane(message, fast_lane_max_bytes, fast_lane_max_pages):
+    # "fast" for the small documents, "bulk" for the ones that take long to stage and extract.
+    # The page count is only read when the size does not decide already
+    if message.get("size") is not None and message["size"] > fast_lane_max_bytes:
+        return "bulk"
+    if fast_lane_max_pages > 0 and message["key"].lower().endswith(".pdf"):
+        try:
+            message["pages"] = get_pdf_page_count(message["bucket"], message["key"])
+        except Exception as e:
+            # The bulk lane has the time to process it, or to report why it cannot be read
+            logger.warning("Failed to count the pages", document_key=message["key"], error=str(e))
+            return "bulk"
+        if message["pages"] > fast_lane_max_pages:
+            return "bulk"
+    return "fast"
 
 
 def send_message_to_sns(topic_arn, event):
     message_body = json.dumps(event)
-    response = sns_client.publish(
+    response = get_client("sns").publish(
         TopicArn=topic_arn,
         Message=message_body
     )
-    print(f"Message body sent to SNS:: {message_body}")
+    logger.debug("Message sent to SNS", topic_arn=topic_arn, message_id=response.get("MessageId"))
     return response
\ No newline at end of file
@@ -6,30 +6,66 @@ from helper import *
 import os
 from urllib.parse import unquote_plus
 
+def get_document_message(s3_record):
+    # Only what process_invoices_bda needs, instead of the whole S3 event. The correlation id follows the
+    # document up to its curated outputs, the timestamps (epoch milliseconds) are used for the stage timings.
+    # The id is derived from the object, so when a failed send makes S3 deliver the event again, the documents
+    # already queued are queued again with the same id
+    bucket = s3_record["s3"]["bucket"]["name"]
+    s3_object = s3_record["s3"]["object"]
+    key = unquote_plus(s3_object["key"])
+    return {
+        "bucket": bucket,
+        "key": key,
+        "size": s3_object.get("size"),
+        "etag": s3_object.get("eTag"),
+        "correlation_id": new_correlation_id(f"{bucket}/{key}/{s3_object.get('eTag')}/{s3_object.get('sequencer')}"),
+        "uploaded_at_ms": get_timestamp_ms(s3_record["eventTime"]) if s3_record.get("eventTime") else None,
+        "queued_at_ms": get_timestamp_ms(),
+    }
+
+@instrument_handler
 def lambda_handler(event, context):
-    print(event)
-    try:
-        key = event["Records"][0]["s3"]["object"]["key"]
-        invoices_bda_queue_url = os.getenv("INVOICES_BDA_QUEUE_URL", "")
-        
-    except:
-        print("in dev mode")
-        key = ""
-        invoices_bda_queue_url = ""
+    logger.log_event(event)
+    ## os variables
+    invoices_bda_queue_url = os.getenv("INVOICES_BDA_QUEUE_URL", "")
+    invoices_bda_bulk_queue_url = os.getenv("INVOICES_BDA_BULK_QUEUE_URL", "")
+    fast_lane_max_bytes = float(os.getenv("FAST_LANE_MAX_MB", "5")) * 1024 * 1024
+    fast_lane_max_pages = int(os.getenv("FAST_LANE_MAX_PAGES", "10"))
+    doc_type = os.getenv("DOC_TYPE", "invoices")
 
-    doc_type_folder_name = unquote_plus(key.split("/")[0])
+    # S3 can deliver several records in one event, every one of them is forwarded.
+    # Large documents go to the bulk lane, so they do not hold the concurrency of the small ones
+    messages = {"fast": [], "bulk": []}
+    skipped_keys = []
+    for s3_record in (event or {}).get("Records", []):
+        message = get_document_message(s3_record)
+        doc_type_folder_name = message["key"].split("/")[0]
+        if doc_type_folder_name != doc_type:
+            skipped_keys.append(message["key"])
+            continue
+        lane = get_lane(message, fast_lane_max_bytes, fast_lane_max_pages) if invoices_bda_bulk_queue_url else "fast"
+        messages[lane].append(message)
+        logger.info("Queued document", document_key=message["key"], correlation_id=message["correlation_id"], lane=lane)
+        if message["uploaded_at_ms"] is not None:
+            put_metric("IntakeLatency", message["queued_at_ms"] - message["uploaded_at_ms"])
 
-    if doc_type_folder_name == "invoices":
-        response = send_message_to_sqs(invoices_bda_queue_url, event)
-    else:
-        response = "Invalid Document Type!! Please upload the files to the designated folder: invoices"
-        print(response)
+    if skipped_keys:
+        logger.warning("Invalid Document Type!! Please upload the files to the designated folder",
+                       doc_type=doc_type, skipped_keys=skipped_keys)
+    # Up to 10 messages per SendMessageBatch call
+    send_messages_to_sqs(invoices_bda_queue_url, messages["fast"])
+    send_messages_to_sqs(invoices_bda_bulk_queue_url, messages["bulk"])
+    put_metric("FastLaneDocuments", len(messages["fast"]), "Count")
+    put_metric("BulkLaneDocuments", len(messages["bulk"]), "Count")
+    logger.info("Sent documents", fast=len(messages["fast"]), bulk=len(messages["bulk"]), skipped=len(skipped_keys))
 
     return {'statusCode': 200,
-            'body': json.dumps({'course_content': response})
+            'body': json.dumps({'fast': len(messages['fast']), 'bulk': len(messages['bulk']), 'skipped': len(skipped_keys)})
     }
 
 
 if __name__ == "__main__":
-    event = None
-    lambda_handler(event, None)
\ No newline at end of file
+    print("in dev mode")
+    event = {"Records": [{"s3": {"bucket": {"name": ""}, "object": {"key": "invoices/test_invoice_0_1.pdf", "size": 0, "eTag": ""}}}]}
+    lambda_handler(event, None)
@@ -1,63 +1,27 @@
 ## Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
 ## SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
 ## Licensed under the Amazon Software License  https://aws.amazon.com/asl/
-import boto3
-from botocore.config import Config
-from io import BytesIO
-import pypdfium2
+import hashlib
+from idp_common.clients import *
+from idp_common.ssm import *
+from idp_common.s3 import *
+from idp_common.sqs import *
+from idp_common.pdf import *
+from idp_common.bda import *
+from idp_common.metrics import *
+from idp_common.logger import bind_log_context, get_logger
 
+logger = get_logger("process_invoices_bda")
 
-#increase the standard time out limits in boto3, because Bedrock may take a while to respond to large requests.
-my_config = Config(
-    connect_timeout=60*5,
-    read_timeout=60*5,
-)
 
-s3_client=boto3.client("s3")
-s3_resource = boto3.resource('s3')
-ssm = boto3.client('ssm')
-bda_client = boto3.client('bedrock-data-automation')
-bda_runtime_client = boto3.client('bedrock-data-automation-runtime')
-
-def save_image_to_s3(image, bucket, key):
-    with BytesIO() as image_buffer:
-        image.save(image_buffer, 'PNG')
-        image_buffer.seek(0)
-        s3_client.upload_fileobj(image_buffer, bucket, key)
-    return bucket, key
-
-def convert_pdf_to_png(input_bucket, input_key, output_bucket, output_key):
-    pdf_obj = s3_resource.Object(input_bucket, input_key).get()['Body'].read()
-    pdf = pypdfium2.PdfDocument(pdf_obj)
-    n_pages = len(pdf)  # get the number of pages in the document
-    print("Number of pages:", n_pages)
-    page = pdf[0] # we will take first page only
-    bitmap = page.render(scale=2, rotation=0)
-    pil_image = bitmap.to_pil()
-    save_image_to_s3(pil_image, output_bucket, output_key)
-    return output_bucket, output_key
-
-def invoke_data_automation(input_s3_uri, output_s3_uri, blueprint_arn):
-    response = bda_runtime_client.invoke_data_automation_async(
-                                inputConfiguration={
-                                    's3Uri': input_s3_uri
-                                },
-                                outputConfiguration={
-                                    's3Uri': output_s3_uri
-                                },
-                                notificationConfiguration={
-                                    'eventBridgeConfiguration': {
-                                        'eventBridgeEnabled': True
-                                    }
-                                },
-                                blueprints=[{'blueprintArn': blueprint_arn},]
-                            )
-    return response
-
-def get_parameter_from_ssm(param_name):
-    response = ssm.get_parameter(
-            Name=param_name,
-            WithDecryption=True
-        )
-    param_value = response['Parameter']['Value']
-    return param_value
\ No newline at end of file
+def get_content_hash(bucket, key, etag=None, hash_mode="etag"):
+    # The ETag of the S3 event is free, sha256 reads the object but also matches multipart re-uploads
+    if hash_mode == "sha256":
+        sha256 = hashlib.sha256()
+        body = get_client("s3").get_object(Bucket=bucket, Key=key)['Body']
+        for chunk in body.iter_chunks(chunk_size=1024 * 1024):
+            sha256.update(chunk)
+        return f"sha256:{sha256.hexdigest()}"
+    if not etag:
+        etag = get_client("s3").head_object(Bucket=bucket, Key=key)['ETag']
+    return f"etag:{etag.strip(chr(34))}"
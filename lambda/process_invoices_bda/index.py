@@ -2,56 +2,216 @@
 ## SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
 ## Licensed under the Amazon Software License  https://aws.amazon.com/asl/
 import json
-from helper import * 
+from helper import *
+from idp_common.dedup import DuplicateInProgress, get_dedup_store, get_dedup_key, get_copied_output_keys, is_complete
+from idp_common.jobs import AdmissionDeferred, get_job_store
+from botocore.exceptions import ClientError
+import random
 import os
-from urllib.parse import urlparse, unquote_plus
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote_plus
+
+def claim_duplicate(input_bucket, key, etag, settings, owner=None):
+    # Returns (dedup_record, reused). dedup_record is set when this document owns the record and must run BDA,
+    # reused is True when a previous copy of the same content already has curated results.
+    # Raises DuplicateInProgress while the owner of the record has not written them yet
+    dedup_store = get_dedup_store()
+    if dedup_store is None:
+        return None, False
+    content_hash = get_content_hash(input_bucket, key, etag, settings["dedup_hash"])
+    dedup_key = get_dedup_key(content_hash, settings["blueprint_version"],
+                              {"pdf_passthrough": settings["pdf_passthrough"], "pdf_page_range": settings["pdf_page_range"],
+                               "render_config": render_config})
+    dedup_record = dedup_store.claim(dedup_key, key, settings["dedup_stale_after_seconds"], owner)
+    if dedup_record:
+        return dedup_record, False
+    record = dedup_store.get(dedup_key)
+    if not is_complete(record):
+        ## Concurrent uploads and repeated S3 notifications of the same content wait for its results, a record
+        ## whose owner never finishes is taken over after dedup_stale_after_seconds
+        raise DuplicateInProgress(f"Same content is still being processed for {record and record['source_key']}")
+    copy_s3_objects(settings["output_bucket"], get_copied_output_keys(record, key))
+    logger.info("Duplicate document, reused the curated results", document_key=key, source_key=record["source_key"],
+                outputs=len(record.get("outputs", [])))
+    return None, True
+
+def process_invoice(input_bucket, key, settings, etag=None, correlation_id=None, uploaded_at_ms=None, owner=None):
+    dedup_record, reused = claim_duplicate(input_bucket, key, etag, settings, owner)
+    if reused:
+        return []
 
-def lambda_handler(event, context):
-    print(event)
-    event = json.loads(event['Records'][0]['body'])
-    print("event****", event)
     try:
-        input_bucket = event["Records"][0]["s3"]["bucket"]["name"]
-        key = event["Records"][0]["s3"]["object"]["key"]
-        key = unquote_plus(key)
-        ## os variables
-        stagging_bucket = os.getenv("STAGGING_BUCKET", "")
-        output_bucket = os.getenv("OUTPUT_BUCKET", "")
-        ssm_param_name = os.getenv("SSM_PARAMETER_NAME", "/my-demo/inovices_blueprint_arn")
-
-    except:
-        print("dev mode activated")
-        input_bucket=""
-        stagging_bucket = ""
-        key="invoices/test_invoice_0_1.pdf"
-        output_bucket = ""
-        ssm_param_name = "/my-demo/inovices_blueprint_arn"
-
-    ## consutructing paths
-    input_s3_uri = f"s3://{input_bucket}/{key}"
-    job_output_s3_uri = f"s3://{output_bucket}/raw_bda_job_outputs"
-    
-    ## Lets check if the file is pdf of png
-    file_extension = key.split(".")[-1]
-    if file_extension == "pdf":
-        print("PDF file detected")
-        _, key = convert_pdf_to_png(input_bucket, key, stagging_bucket, f"{key}.png")
-        input_s3_uri = f"s3://{stagging_bucket}/{key}"
-    
-    blueprint_arn = get_parameter_from_ssm(ssm_param_name)
-
-    ## Invoke the data automation job
-    invoke_response = invoke_data_automation(input_s3_uri, job_output_s3_uri, blueprint_arn)
-    invocation_arn = invoke_response['invocationArn']
-    print("Job successfully invoked with invocation_arn", invocation_arn)
-        
-    return {'statusCode': 200,
-            'body': json.dumps({
-                        'invoke_response': invoke_response
-                    })
+        invoke_responses = submit_invoice(input_bucket, key, settings, dedup_record, correlation_id, uploaded_at_ms)
+    except Exception:
+        ## Let the retried message claim the content again. Once a job was submitted the claim is kept,
+        ## the retried message takes it back and only submits what is left
+        if dedup_record and not get_dedup_store().release(dedup_record["pk"]):
+            logger.warning("Kept the deduplication record, jobs were already submitted", document_key=key)
+        raise
+    return invoke_responses
+
+def submit_invoice(input_bucket, key, settings, dedup_record=None, correlation_id=None, uploaded_at_ms=None):
+    ## A retried message skips the inputs its previous attempt already submitted
+    dedup_key = dedup_record and dedup_record["pk"]
+    submitted_inputs = set(dedup_record.get("submitted_inputs") or ()) if dedup_record else set()
+    if submitted_inputs and dedup_record.get("expected_jobs") is not None \
+            and len(submitted_inputs) >= int(dedup_record["expected_jobs"]):
+        logger.info("Document already submitted", document_key=key, jobs=len(submitted_inputs))
+        return []
+
+    ## Every document is a single BDA job. Only submit while the account is under its concurrent BDA job quota,
+    ## otherwise the message waits in the queue. The slot is reserved before the document is staged, so a
+    ## deferred message is neither rendered nor recorded again
+    job_store = get_job_store()
+    admission_control = job_store is not None and settings["max_in_flight_jobs"] > 0
+    n_slots = 1 if admission_control else 0
+    if admission_control and not job_store.acquire_job_slots(n_slots, settings["max_in_flight_jobs"]):
+        raise AdmissionDeferred(f"{settings['max_in_flight_jobs']} BDA jobs in flight")
+
+    invoke_responses = []
+    try:
+        ## consutructing paths. The outputs of the jobs go under the prefix of the document, sharded by date and hash
+        input_s3_uris = [f"s3://{input_bucket}/{key}"]
+        job_output_prefix = get_job_output_prefix(correlation_id, uploaded_at_ms) if correlation_id else RAW_OUTPUT_PREFIX
+        job_output_s3_uri = f"s3://{settings['output_bucket']}/{job_output_prefix}"
+
+        ## Lets check if the file is pdf of png
+        file_extension = key.split(".")[-1]
+        if file_extension == "pdf" and settings["pdf_passthrough"]:
+            ## BDA ingests the PDF directly, the image is only rendered later if an annotation is requested
+            logger.debug("PDF file detected, sending it to BDA as is", document_key=key)
+        elif file_extension == "pdf":
+            logger.debug("PDF file detected, staging its pages", document_key=key)
+            ## The selected pages are staged as one document (an image, or a PDF of the rendered pages) and sent to BDA
+            ## as a single job, so the fields and line items of a multi-page invoice come back in one result
+            stagging_bucket = settings["stagging_bucket"]
+            with timer("Rasterize"):
+                _, staged_key = convert_pdf_to_png(input_bucket, key, stagging_bucket, f"{key}.{get_image_extension()}", page_range=settings["pdf_page_range"])
+            input_s3_uris = [f"s3://{stagging_bucket}/{staged_key}"]
+
+        ## The completion Lambda finds the deduplication record through the BDA input of each job
+        if dedup_key:
+            get_dedup_store().set_expected_jobs(dedup_key, input_s3_uris)
+
+        ## Invoke the data automation job, the blueprint ARN is cached across warm invocations.
+        ## The jobs are tracked instead of waited for, the completion event (or the poller) records how they ended
+        for input_s3_uri in input_s3_uris:
+            if input_s3_uri in submitted_inputs:
+                continue
+            invoke_response = invoke_data_automation_with_cached_blueprint(input_s3_uri, job_output_s3_uri,
+                                                                           settings["ssm_param_name"], settings["blueprint_version"])
+            invoke_responses.append(invoke_response)
+            invocation_arn = invoke_response['invocationArn']
+            logger.info("Job successfully invoked", document_key=key, invocation_arn=invocation_arn)
+            if dedup_key:
+                get_dedup_store().record_submitted_input(dedup_key, input_s3_uri)
+            if job_store:
+                job_store.record_submitted(invocation_arn, input_s3_uri, key, settings["jobs_first_poll_after_seconds"],
+                                           correlation_id=correlation_id, uploaded_at_ms=uploaded_at_ms)
+    except Exception as e:
+        ## A slot of a job that was not started is given back, a started job releases its slot when it ends
+        if n_slots > len(invoke_responses):
+            job_store.release_job_slots(n_slots - len(invoke_responses))
+        if isinstance(e, ClientError) and e.response["Error"]["Code"] in ("ThrottlingException", "ServiceQuotaExceededException"):
+            raise AdmissionDeferred(f"BDA throttled the submission: {e.response['Error']['Code']}") from e
+        raise
+    return invoke_responses
+
+def defer_document(document, queue_arn, settings):
+    # Sends the document back to its queue as a new message, delayed for longer on every deferral (exponential
+    # backoff with jitter), so the queue is drained at the pace the quota allows. The deferrals are counted in the
+    # message itself, the receive count of the queue only grows with real failures before they go to the DLQ
+    deferrals = int(document.get("deferrals", 0)) + 1
+    delay_seconds = min(settings["admission_max_delay_seconds"], 900,
+                        settings["admission_base_delay_seconds"] * 2 ** (deferrals - 1))
+    delay_seconds = int(random.uniform(delay_seconds / 2, delay_seconds))
+    send_messages_to_sqs(get_queue_url(queue_arn), [{**document, "deferrals": deferrals}], delay_seconds=delay_seconds)
+    return deferrals, delay_seconds
+
+def get_documents(message):
+    # Messages of process_input_files hold one document ({"bucket", "key", "size", "etag", "correlation_id",
+    # "uploaded_at_ms", "queued_at_ms"}, the key is decoded, "pages" when the lane was chosen by the page count).
+    # Messages queued before that carry the whole S3 event notification, with URL encoded keys
+    if "Records" not in message:
+        return [message]
+    return [{"bucket": s3_record["s3"]["bucket"]["name"], "key": unquote_plus(s3_record["s3"]["object"]["key"]),
+             "etag": s3_record["s3"]["object"].get("eTag"), "size": s3_record["s3"]["object"].get("size")}
+            for s3_record in message["Records"]]
+
+def process_message(record, settings):
+    # Returns the responses of the jobs started and the number of documents deferred
+    invoke_responses = []
+    n_deferred = 0
+    ## The send time of the message stands in for queued_at_ms in the messages queued before it was added
+    sent_at_ms = int(record.get("attributes", {}).get("SentTimestamp", "0")) or None
+    for document in get_documents(json.loads(record["body"])):
+        correlation_id = document.get("correlation_id") or new_correlation_id()
+        queued_at_ms = document.get("queued_at_ms") or sent_at_ms
+        ## Every document gets its own metrics record, with its size and page count as dimensions,
+        ## and its correlation id in all its logs
+        with document_metrics(document["key"], size_bytes=document.get("size"), pages=document.get("pages")), \
+                bind_log_context(correlation_id=correlation_id):
+            set_document_properties(correlation_id=correlation_id)
+            if queued_at_ms:
+                put_metric("QueueWait", get_timestamp_ms() - queued_at_ms)
+            try:
+                ## The message owns the deduplication record it claims, its retries take it back
+                invoke_responses.extend(process_invoice(document["bucket"], document["key"], settings, document.get("etag"),
+                                                        correlation_id, document.get("uploaded_at_ms"),
+                                                        owner=f"{record['messageId']}#{document['key']}"))
+            except (AdmissionDeferred, DuplicateInProgress) as e:
+                ## Deferred documents are queued again, this message is deleted with the batch. When the document
+                ## cannot be queued again the error fails the message, which SQS then retries
+                deferrals, delay_seconds = defer_document({**document, "correlation_id": correlation_id,
+                                                           "queued_at_ms": queued_at_ms}, record["eventSourceARN"], settings)
+                logger.info("Deferred document", document_key=document["key"], deferrals=deferrals,
+                            delay_seconds=delay_seconds, reason=str(e))
+                n_deferred += 1
+    return invoke_responses, n_deferred
+
+@instrument_handler
+def lambda_handler(event, context):
+    logger.log_event(event)
+    ## os variables
+    settings = {
+        "stagging_bucket": os.getenv("STAGGING_BUCKET", ""),
+        "output_bucket": os.getenv("OUTPUT_BUCKET", ""),
+        "ssm_param_name": os.getenv("SSM_PARAMETER_NAME", "/my-demo/inovices_blueprint_arn"),
+        "pdf_page_range": os.getenv("PDF_PAGE_RANGE", "all"),
+        "pdf_passthrough": os.getenv("PDF_PASSTHROUGH", "true").lower() == "true",
+        "blueprint_version": os.getenv("BLUEPRINT_VERSION", ""),
+        "dedup_hash": os.getenv("DEDUP_HASH", "etag"),
+        "dedup_stale_after_seconds": int(os.getenv("DEDUP_STALE_AFTER_SECONDS", "3600")),
+        "jobs_first_poll_after_seconds": int(os.getenv("JOBS_FIRST_POLL_AFTER_SECONDS", "300")),
+        "max_in_flight_jobs": int(os.getenv("BDA_MAX_IN_FLIGHT_JOBS", "0")),
+        "admission_base_delay_seconds": int(os.getenv("ADMISSION_BASE_DELAY_SECONDS", "30")),
+        "admission_max_delay_seconds": int(os.getenv("ADMISSION_MAX_DELAY_SECONDS", "900")),
+    }
+
+    # Messages are rasterized and submitted in parallel, at most bda_max_concurrency at a time.
+    # Only the failed messages are reported back, so SQS retries them and deletes the rest of the batch
+    batch_item_failures = []
+    max_workers = max(1, min(bda_max_concurrency, len(event["Records"])))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            record["messageId"]: executor.submit(process_message, record, settings)
+            for record in event["Records"]
         }
+        n_deferred = 0
+        for message_id, future in futures.items():
+            try:
+                n_deferred += future.result()[1]
+            except Exception as e:
+                logger.error("Failed to process message", message_id=message_id, error=str(e))
+                batch_item_failures.append({"itemIdentifier": message_id})
+
+    logger.info("Processed messages", messages=len(event["Records"]), deferred=n_deferred,
+                failed=len(batch_item_failures))
+    return {"batchItemFailures": batch_item_failures}
 
 
 if __name__ == "__main__":
-    event = None
-    lambda_handler(event, None)
\ No newline at end of file
+    print("dev mode activated")
+    message = {"bucket": "", "key": "invoices/test_invoice_0_1.pdf", "size": None, "etag": None}
+    event = {"Records": [{"messageId": "dev", "body": json.dumps(message)}]}
+    lambda_handler(event, None)
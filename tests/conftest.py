@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The tests import the idp-common layer and the benchmarks as the Lambda runtime and the benchmark scripts do
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (os.path.join(ROOT_DIR, "lambda", "lambda_layer", "idp_common_layer"), os.path.join(ROOT_DIR, "benchmarks")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,72 @@
+from idp_common.dedup import InMemoryDedupStore, get_copied_output_keys, get_dedup_key, is_complete
+
+
+def test_duplicate_reuses_completed_outputs():
+    store = InMemoryDedupStore()
+    dedup_key = get_dedup_key("etag:abc", "v1")
+
+    assert store.claim(dedup_key, "invoices/a.pdf", stale_after_seconds=3600)
+    store.set_expected_jobs(dedup_key, ["s3://input/invoices/a.pdf"])
+    # The same content uploaded again while the first job runs is not claimed twice
+    assert not store.claim(dedup_key, "invoices/b.pdf", stale_after_seconds=3600)
+    assert not is_complete(store.get(dedup_key))
+
+    store.record_job_outputs("s3://input/invoices/a.pdf", [
+        "bda_json/inference_results/invoices/a.pdf.json",
+        "bda_bbox_img/invoices/a.pdf.png",
+    ])
+    record = store.get(dedup_key)
+    assert is_complete(record)
+    assert get_copied_output_keys(record, "invoices/b.pdf") == [
+        ("bda_bbox_img/invoices/a.pdf.png", "bda_bbox_img/invoices/b.pdf.png"),
+        ("bda_json/inference_results/invoices/a.pdf.json", "bda_json/inference_results/invoices/b.pdf.json"),
+    ]
+
+
+def test_multi_page_document_completes_after_every_job():
+    store = InMemoryDedupStore()
+    dedup_key = get_dedup_key("etag:abc", "v1")
+    pages = ["s3://staging/invoices/a.pdf.page1.png", "s3://staging/invoices/a.pdf.page2.png"]
+
+    assert store.claim(dedup_key, "invoices/a.pdf", stale_after_seconds=3600)
+    store.set_expected_jobs(dedup_key, pages)
+    store.record_job_outputs(pages[0], ["bda_json/inference_results/invoices/a.pdf.page1.png.json"])
+    # A completion event delivered twice counts its job once
+    assert store.record_job_outputs(pages[0], ["bda_json/inference_results/invoices/a.pdf.page1.png.json"]) is None
+    assert not is_complete(store.get(dedup_key))
+    store.record_job_outputs(pages[1], ["bda_json/inference_results/invoices/a.pdf.page2.png.json"])
+    assert is_complete(store.get(dedup_key))
+
+
+def test_released_and_stale_claims_can_be_claimed_again():
+    store = InMemoryDedupStore()
+    dedup_key = get_dedup_key("etag:abc", "v1")
+
+    assert store.claim(dedup_key, "invoices/a.pdf", stale_after_seconds=3600)
+    store.release(dedup_key)
+    assert store.claim(dedup_key, "invoices/a.pdf", stale_after_seconds=3600)
+    # An unfinished claim older than stale_after_seconds is taken over
+    assert store.claim(dedup_key, "invoices/b.pdf", stale_after_seconds=-1)
+    assert store.record_job_outputs("s3://input/unknown.pdf", []) is None
+
+
+def test_retried_message_takes_back_its_claim_without_resubmitting():
+    store = InMemoryDedupStore()
+    dedup_key = get_dedup_key("etag:abc", "v1")
+
+    assert store.claim(dedup_key, "invoices/a.pdf", stale_after_seconds=3600, owner="message-1")
+    store.set_expected_jobs(dedup_key, ["s3://input/invoices/a.pdf"])
+    store.record_submitted_input(dedup_key, "s3://input/invoices/a.pdf")
+    # The invocation failed after the submission, the claim is kept for the retried message
+    assert not store.release(dedup_key)
+    assert store.claim(dedup_key, "invoices/a.pdf", stale_after_seconds=3600, owner="message-1")["submitted_inputs"] \
+        == {"s3://input/invoices/a.pdf"}
+    assert store.claim(dedup_key, "invoices/b.pdf", stale_after_seconds=3600, owner="message-2") is None
+
+
+def test_input_settings_are_part_of_the_key():
+    input_settings = {"pdf_passthrough": False, "pdf_page_range": "all", "render_config": {"dpi": 144}}
+    dedup_key = get_dedup_key("etag:abc", "v1", input_settings)
+    assert dedup_key == get_dedup_key("etag:abc", "v1", dict(reversed(list(input_settings.items()))))
+    assert dedup_key != get_dedup_key("etag:abc", "v1", {**input_settings, "pdf_page_range": "1-2"})
+    assert dedup_key != get_dedup_key("etag:abc", "v1", {**input_settings, "render_config": {"dpi": 200}})
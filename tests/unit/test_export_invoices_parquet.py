@@ -0,0 +1,69 @@
+import importlib.util
+import json
+import os
+
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from idp_common import clients
+
+LAMBDA_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "lambda")
+BLUEPRINT_FILE = os.path.join(LAMBDA_DIR, "create_blueprint_cr", "invoices_blueprint.json")
+
+# Every function has its own helper module, this one is loaded under a name of its own
+spec = importlib.util.spec_from_file_location("export_invoices_parquet_helper",
+                                              os.path.join(LAMBDA_DIR, "export_invoices_parquet", "helper.py"))
+helper = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(helper)
+
+
+class RecordingS3Client:
+    def __init__(self):
+        self.keys = []
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.keys.append(Key)
+
+
+def test_values_are_coerced_to_their_blueprint_type():
+    assert helper.coerce_value("$1,234.50", "number") == 1234.5
+    assert helper.coerce_value("12.0", "integer") == 12
+    assert helper.coerce_value("n/a", "number") is None
+    assert helper.coerce_value("", "string") is None
+    assert helper.coerce_value("Yes", "boolean") is True
+    assert helper.coerce_value({"amount": 1}, "string") == '{"amount": 1}'
+
+
+def test_tables_follow_the_blueprint():
+    with open(BLUEPRINT_FILE) as file:
+        blueprint_schema = json.load(file)
+
+    header_table, child_tables = helper.get_table_schemas(blueprint_schema, "invoices")
+    header_columns = {column_name: (json_type, is_list) for _, column_name, json_type, is_list in header_table["columns"]}
+    assert header_columns["total"] == ("number", False)
+    assert header_columns["tax"][1] is True
+    # Arrays of objects become child tables, the header table does not hold them
+    [services_table] = [table for table in child_tables if table["field"] == "SERVICES_TABLE"]
+    assert services_table["name"] == "invoices_services_table" and "services_table" not in header_columns
+    schema = helper.get_arrow_schema(services_table, child=True)
+    assert schema.names[:2] == ["document_key", "line_number"] and "unit_price" in schema.names
+
+
+def test_retried_batch_writes_the_same_files(monkeypatch):
+    s3_client = RecordingS3Client()
+    monkeypatch.setitem(clients.clients, "s3", s3_client)
+    table = {"columns": [(("TOTAL",), "total", "number", False)]}
+    arrow_schema = helper.get_arrow_schema(table)
+    partition = (("ingest_date", "2024-01-31"),)
+
+    for _ in range(2):
+        writer = helper.PartitionedParquetWriter("output", "analytics", max_file_bytes=64 * 1024 * 1024)
+        for message_id in ("message-2", "message-1"):
+            writer.add("invoices", arrow_schema, partition, {"document_key": message_id, "total": 1.0,
+                                                             "exported_at": None}, message_id)
+        writer.flush_all()
+
+    first_key, retried_key = s3_client.keys
+    assert first_key == retried_key
+    assert first_key.startswith("analytics/invoices/ingest_date=2024-01-31/part-")
@@ -0,0 +1,58 @@
+from idp_common.jobs import InMemoryJobStore, get_job_id, get_poll_delay
+
+INVOCATION_ARN = "arn:aws:bedrock:us-east-1:123456789012:data-automation-invocation/job-1"
+
+
+def test_completion_is_not_overwritten_by_a_late_poll():
+    store = InMemoryJobStore()
+    store.record_submitted(INVOCATION_ARN, "s3://input/invoices/a.pdf", "invoices/a.pdf", first_poll_after_seconds=-1,
+                           correlation_id="c0ffee", uploaded_at_ms=1)
+    assert [job["pk"] for job in store.list_due_jobs(10)] == ["job-1"]
+
+    # The record before the update holds the timings of the document
+    previous_job = store.record_status(get_job_id(INVOCATION_ARN), "Success", "s3://output/job-1/job_metadata.json")
+    assert previous_job["job_status"] == "Created" and previous_job["correlation_id"] == "c0ffee"
+    assert previous_job["uploaded_at_ms"] == 1 and previous_job["submitted_at_ms"] > 1
+    # A poll that started before the completion event was recorded does not bring the job back
+    assert not store.record_status("job-1", "InProgress", next_poll_at=0)
+    assert store.get_jobs(["job-1", "job-2"])["job-1"]["job_status"] == "Success"
+    assert store.list_due_jobs(10) == []
+
+
+def test_poll_delay_backs_off_up_to_the_maximum():
+    for poll_attempts in range(10):
+        assert 0 <= get_poll_delay(poll_attempts, 60, 3600) <= min(3600, 60 * 2 ** poll_attempts)
+
+
+def test_job_slots_are_released_once_when_the_job_ends():
+    store = InMemoryJobStore()
+    assert store.acquire_job_slots(2, max_in_flight=2)
+    assert not store.acquire_job_slots(1, max_in_flight=2)
+
+    store.record_submitted(INVOCATION_ARN, "s3://input/invoices/a.pdf", "invoices/a.pdf", first_poll_after_seconds=300)
+    store.record_status("job-1", "ClientError")
+    store.record_status("job-1", "Success")
+    assert store.get_in_flight() == 1
+    assert store.acquire_job_slots(1, max_in_flight=2)
+
+
+def test_rescheduled_checks_do_not_count_as_poll_attempts():
+    store = InMemoryJobStore()
+    store.record_submitted(INVOCATION_ARN, "s3://input/invoices/a.pdf", "invoices/a.pdf", first_poll_after_seconds=-1)
+    store.reschedule("job-1", next_poll_at=0)
+    job = store.get_jobs(["job-1"])["job-1"]
+    assert job["next_poll_at"] == 0 and job["poll_attempts"] == 0
+    # Ended jobs are not checked again
+    store.record_status("job-1", "ClientError")
+    store.reschedule("job-1", next_poll_at=0)
+    assert "next_poll_at" not in store.get_jobs(["job-1"])["job-1"]
+
+
+def test_in_flight_count_is_only_reconciled_once_it_settled():
+    store = InMemoryJobStore()
+    # A slot reserved for a document still being staged has no job record yet
+    assert store.acquire_job_slots(1, max_in_flight=2)
+    assert store.reconcile_in_flight(unchanged_for_seconds=900) == 1
+    # Once the count has not changed for long enough, the slot is considered lost
+    assert store.reconcile_in_flight(unchanged_for_seconds=0) == 0
+    assert store.get_in_flight() == 0
@@ -0,0 +1,22 @@
+import json
+
+from idp_common import logger as logger_module
+from idp_common.logger import Logger
+
+
+def test_events_are_summarized_unless_sampled(capsys, monkeypatch):
+    event = {"Records": [{"eventSource": "aws:sqs", "body": "x" * 5000}] * 50}
+    logger = Logger("test", level="INFO")
+
+    monkeypatch.setattr(logger_module, "log_event_sample_rate", 0.0)
+    logger.log_event(event)
+    monkeypatch.setattr(logger_module, "log_event_sample_rate", 1.0)
+    logger.log_event(event)
+    logger.debug("not logged at INFO")
+
+    summary, sampled = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert summary["records"] == 50 and summary["event_source"] == "aws:sqs" and "event" not in summary
+    # The sampled event is logged with its long fields and lists cut
+    records = sampled["event"]["Records"]
+    assert len(records) == logger_module.log_max_list_items + 1
+    assert len(records[0]["body"]) < 5000 and records[0]["body"].endswith("(5000 chars)")
@@ -0,0 +1,44 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from idp_common import metrics
+
+
+def test_document_record_holds_the_timings_of_its_worker_threads():
+    records = []
+    metrics.metric_sinks.append(records.append)
+    try:
+        with metrics.document_metrics("invoices/a.pdf", "invoices", size_bytes=2 * 1024 * 1024):
+            metrics.set_document_properties(pages=3)
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                futures = [metrics.submit_in_context(executor, metrics.timed("S3Put")(len), "body") for _ in range(2)]
+                assert [future.result() for future in futures] == [4, 4]
+    finally:
+        metrics.metric_sinks.remove(records.append)
+
+    [record] = records
+    assert record["_aws"]["CloudWatchMetrics"][0]["Dimensions"] == [["DocType"], ["DocType", "SizeClass", "PageClass"]]
+    assert (record["DocType"], record["SizeClass"], record["PageClass"]) == ("invoices", "1-10MB", "2-5")
+    assert record["document_key"] == "invoices/a.pdf"
+    assert record["Pages"] == 3
+    assert len(record["S3Put"]) == 2
+
+
+def test_sampled_invocations_log_their_profile():
+    records = []
+
+    def handler(event, context):
+        return sorted(range(1000), key=str)
+
+    metrics.metric_sinks.append(records.append)
+    try:
+        with_profile = metrics.instrument_handler(handler)
+        metrics.profile_mode, metrics.profile_sample_rate = "cprofile", 1.0
+        with_profile({}, None)
+    finally:
+        metrics.profile_mode, metrics.profile_sample_rate = "", 1.0
+        metrics.metric_sinks.remove(records.append)
+
+    invocation_record, profile = records
+    assert "HandlerDuration" in invocation_record
+    assert profile["profile"] == "cprofile"
+    assert any("handler" in function["function"] for function in profile["top"])
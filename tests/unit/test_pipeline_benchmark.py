@@ -0,0 +1,37 @@
+import os
+import sys
+from unittest import mock
+
+import pytest
+
+from idp_common import bda, clients, ssm, store
+from pipeline_throughput import run_pipeline
+
+
+@pytest.fixture
+def pipeline_state(monkeypatch):
+    # run_pipeline sets the environment, the local clients, the in process record stores and the caches the
+    # handlers fill. The test gets its own of each, the ones of the other tests are put back after it
+    monkeypatch.setattr(sys, "path", list(sys.path))
+    monkeypatch.setattr(clients, "clients", {})
+    monkeypatch.setattr(store, "stores", {})
+    monkeypatch.setattr(ssm, "ssm_cache", {})
+    monkeypatch.setattr(bda, "blueprint_schema_cache", {})
+    with mock.patch.dict(os.environ):
+        yield
+
+
+def test_every_document_goes_through_the_pipeline(tmp_path, pipeline_state):
+    results = run_pipeline(12, str(tmp_path), max_in_flight_jobs=4)
+
+    assert results["results"] == 12
+    assert results["stages"]["process_input_files"]["invocations"] == 12
+    assert results["stages"]["draw_bboxes_invoices"]["invocations"] == 12
+    assert results["deferrals"] > 0
+    assert os.path.exists(tmp_path / "output" / "bda_bbox_img" / "invoices" / "000000_test_invoice_0_1.pdf.png")
+    # Every document is rendered and annotated once, and its S3 reads are timed
+    assert results["operations"]["Annotate"]["invocations"] == 12
+    assert results["operations"]["S3Get"]["invocations"] >= 12
+    # Every document has its own BDA output prefix, <yyyy>/<mm>/<dd>/<shard>/<correlation id>, and its end to end timing
+    assert len(list((tmp_path / "output" / "raw_bda_job_outputs").glob("*/*/*/*/*"))) == 12
+    assert results["operations"]["EndToEnd"]["invocations"] == 12
@@ -0,0 +1,67 @@
+import importlib.util
+import json
+import os
+from urllib.parse import unquote_plus
+
+from idp_common import clients
+from idp_common.jobs import InMemoryJobStore
+
+LAMBDA_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "lambda")
+INVOCATION_ARN = "arn:aws:bedrock:us-east-1:123456789012:data-automation-invocation/job-1"
+JOB_METADATA_S3_URI = "s3://output/raw_bda_job_outputs/2024/01/31/ab/c0ffee/job-1/job_metadata.json"
+
+# Every function has its own helper module, this one is loaded under a name of its own
+spec = importlib.util.spec_from_file_location("poll_bda_jobs_helper", os.path.join(LAMBDA_DIR, "poll_bda_jobs", "helper.py"))
+helper = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(helper)
+
+
+class RecordingLambdaClient:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.events = []
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        if self.fail:
+            raise RuntimeError("throttled")
+        self.events.append(json.loads(Payload))
+
+
+def poll(monkeypatch, lambda_client, job_status="Success"):
+    store = InMemoryJobStore()
+    store.record_submitted(INVOCATION_ARN, "s3://input/invoices/a b+c.pdf", "invoices/a b+c.pdf",
+                           first_poll_after_seconds=-1)
+    monkeypatch.setitem(clients.clients, "lambda", lambda_client)
+    monkeypatch.setattr(helper, "get_data_automation_statuses",
+                        lambda invocation_arns: {INVOCATION_ARN: (job_status, JOB_METADATA_S3_URI)})
+    counts = helper.poll_due_jobs(store, 10, 60, 3600, completion_function_name="draw_bboxes_invoices")
+    return store, counts
+
+
+def test_missed_completions_are_handed_off(monkeypatch):
+    lambda_client = RecordingLambdaClient()
+    store, counts = poll(monkeypatch, lambda_client)
+
+    assert counts["handed_off"] == 1
+    assert store.get_jobs(["job-1"])["job-1"]["job_status"] == "Success"
+    # draw_bboxes_invoices reads the event as the one BDA sends
+    [event] = lambda_client.events
+    assert event["detail"]["job_id"] == "job-1"
+    assert unquote_plus(event["detail"]["input_s3_object"]["name"]) == "invoices/a b+c.pdf"
+    output_key = unquote_plus(event["detail"]["output_s3_location"]["name"])
+    assert f"s3://output/{output_key.rsplit('/', 1)[0]}/job_metadata.json" == JOB_METADATA_S3_URI
+
+
+def test_failed_hand_off_leaves_the_job_pending(monkeypatch):
+    store, counts = poll(monkeypatch, RecordingLambdaClient(fail=True))
+
+    assert counts["handed_off"] == 0 and counts["failed_checks"] == 1
+    job = store.get_jobs(["job-1"])["job-1"]
+    assert job["job_status"] == "Created" and job["poll_attempts"] == 0
+
+
+def test_failed_checks_do_not_count_as_poll_attempts(monkeypatch):
+    store, counts = poll(monkeypatch, RecordingLambdaClient(), job_status=None)
+
+    assert counts["failed_checks"] == 1 and counts["pending"] == 0
+    assert store.get_jobs(["job-1"])["job-1"]["poll_attempts"] == 0
@@ -0,0 +1,57 @@
+import json
+
+import pytest
+
+from idp_common import clients
+from idp_common.bda import new_correlation_id
+from idp_common.sqs import get_queue_url, send_messages_to_sqs
+
+QUEUE_URL = "https://sqs.us-east-1.amazonaws.com/123456789012/invoices"
+
+
+class FlakySQSClient:
+    # Fails the entries listed in failures (by message body) the first times they are sent
+    def __init__(self, failures, sender_fault=False):
+        self.failures = dict(failures)
+        self.sender_fault = sender_fault
+        self.batches = []
+
+    def send_message_batch(self, QueueUrl, Entries):
+        self.batches.append([json.loads(entry["MessageBody"]) for entry in Entries])
+        failed = []
+        for entry in Entries:
+            body = json.loads(entry["MessageBody"])
+            if self.failures.get(body, 0) > 0:
+                self.failures[body] -= 1
+                failed.append({"Id": entry["Id"], "Code": "InternalError", "SenderFault": self.sender_fault})
+        return {"Successful": [], "Failed": failed}
+
+
+def test_only_the_failed_entries_are_sent_again(monkeypatch):
+    sqs_client = FlakySQSClient({3: 1, 11: 2})
+    monkeypatch.setitem(clients.clients, "sqs", sqs_client)
+
+    send_messages_to_sqs(QUEUE_URL, list(range(12)))
+    assert sqs_client.batches == [list(range(10)), [3], [10, 11], [11], [11]]
+
+
+def test_failures_are_raised_once_the_attempts_are_spent(monkeypatch):
+    monkeypatch.setitem(clients.clients, "sqs", FlakySQSClient({1: 3}))
+    with pytest.raises(RuntimeError):
+        send_messages_to_sqs(QUEUE_URL, [0, 1], max_attempts=3)
+
+
+def test_sender_faults_are_not_sent_again(monkeypatch):
+    sqs_client = FlakySQSClient({1: 1}, sender_fault=True)
+    monkeypatch.setitem(clients.clients, "sqs", sqs_client)
+    with pytest.raises(RuntimeError):
+        send_messages_to_sqs(QUEUE_URL, [0, 1])
+    assert sqs_client.batches == [[0, 1]]
+
+
+def test_queue_url_and_correlation_ids():
+    assert get_queue_url("arn:aws:sqs:us-east-1:123456789012:invoices") == QUEUE_URL
+    # Seeded ids are stable, so a redelivered S3 event queues its documents with the same ids
+    assert new_correlation_id("input/invoices/a.pdf/etag") == new_correlation_id("input/invoices/a.pdf/etag")
+    assert new_correlation_id("input/invoices/a.pdf/etag") != new_correlation_id("input/invoices/b.pdf/etag")
+    assert len(new_correlation_id()) == 32 and new_correlation_id() != new_correlation_id()